@@ -0,0 +1,142 @@
+#==============================================================================
+# Copyright (C) 2024  Emmanuel Mazurier <contact@bibliob.us>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#==============================================================================
+
+"""Micro benchmark of tools.buildBlockPosition on synthetic shelves, compared with previous implementation
+
+usage : python benchmarks/blocks.py [positions] [rounds]
+"""
+
+import os, random, sys, time
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+# settings are read from .env.sample when not set, as for tests
+with open(os.path.join(root, '.env.sample')) as env:
+  for line in env:
+    if '=' in line:
+      name, value = line.strip().split('=', 1)
+      os.environ.setdefault(name, value)
+import tools
+
+def legacyBuildBlockPosition(positions, action):
+  '''previous quadratic implementation, for output comparison'''
+
+  cpt = 0
+  blockend = 0  
+  block = {}
+  blocks = []
+  blockelem = []
+  uniqelem = []
+
+  #loop 1 : group nearby positions, and separate isolated postions 
+  for i, pos in enumerate(positions): 
+
+    #check if current pos is following the previous pos
+    if int(pos['led_column']) == int(positions[i-1]['led_column'] + positions[i-1]['interval']) \
+    and pos['color'] == positions[i-1]['color'] and pos['row'] == positions[i-1]['row'] : 
+
+      prevItem = positions[i-1]
+
+      #store node ids inside list
+      if int(prevItem['id_node']) not in blockelem:  
+        blockelem.append(int(prevItem['id_node']))
+      if int(pos['id_node']) not in blockelem:        
+        blockelem.append(int(pos['id_node']))
+
+      #remove block first element from isolated list
+      idx = prevItem['id_node'] if prevItem['id_node'] > 0 else (prevItem['row']+prevItem['led_column']+prevItem['interval'])
+      if idx in uniqelem:
+        uniqelem.remove(idx)
+
+      #build block element : get first position and agragate intervals
+      cpt+=1
+      blockend += prevItem['interval']
+      if cpt==1:
+        block = {'action':action, 'row':pos['row'], 'index':i, 'start':prevItem['led_column'], \
+        'color':pos['color'], 'id_tag':pos['id_tag'],}
+      block.update({'interval':blockend+pos['interval'], 'nodes':blockelem, 'client':pos['client'], 'date_add':pos['date_add']})
+
+      #populate blocks list
+      if block not in blocks:
+        blocks.append(block)
+        
+    #reinit for next block
+    else:
+
+      block = {}
+      blockelem = []
+      blockend = 0
+      cpt = 0
+
+      #store isolated elements: node_id for books, position for gaming
+      idx = pos['id_node'] if pos['id_node'] > 0 else (pos['row']+pos['led_column']+pos['interval'])
+      uniqelem.append(idx)
+  
+  #loop 2 : build response for isolated elements
+  for i, pos in enumerate(positions):
+    idx = pos['id_node'] if pos['id_node'] > 0 else (pos['row']+pos['led_column']+pos['interval'])
+    for j in uniqelem:
+      if j == idx:
+        blocks.append({'action':action, 'row':pos['row'], 'index':i, 'start':pos['led_column'], \
+          'id_tag':pos['id_tag'], 'color':pos['color'], 'interval':pos['interval'], \
+          'nodes':[pos['id_node']], 'client':pos['client'], 'date_add':pos['date_add']})
+  
+  #print(blocks)
+
+  #reset order for blocks:
+  if(action=='remove'):
+    blocks.sort(key=lambda block: block['index'], reverse=True)
+  else:
+    blocks.sort(key=lambda block: block['index'])
+
+  return blocks
+
+
+def buildPositions(size, rows = 10, seed = 1):
+  '''book positions with unique nodes, on long rows : following books of same color make blocks'''
+  rnd = random.Random(seed)
+  colors = ['51, 102, 255', '255, 0, 0']
+  positions = []
+  node = 0
+  for row in range(1, rows + 1):
+    column = 0
+    for i in range(size // rows):
+      column += rnd.choice([0, 0, 0, 1, 3])
+      interval = rnd.randint(1, 4)
+      node += 1
+      positions.append({'action':'add', 'row':row, 'led_column':column, 'interval':interval, 'id_tag':1, \
+        'color':rnd.choice(colors), 'id_node':node, 'client':'server', 'date_add':'2024-01-01 00:00:00'})
+      column += interval
+  rnd.shuffle(positions)
+  positions.sort(key=tools.sortPositions)
+  return positions
+
+def timeIt(fn, positions, action, rounds):
+  start = time.perf_counter()
+  for i in range(rounds):
+    blocks = fn(positions, action)
+  return (time.perf_counter() - start) / rounds, blocks
+
+if __name__ == '__main__':
+  size = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+  rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+  positions = buildPositions(size)
+  for action in ('add', 'remove'):
+    current, blocks = timeIt(tools.buildBlockPosition, positions, action, rounds)
+    previous, expected = timeIt(legacyBuildBlockPosition, positions, action, 1)
+    status = 'same output' if blocks == expected else 'DIFFERENT OUTPUT'
+    print(f"{action}: {len(positions)} positions, {len(blocks)} blocks, buildBlockPosition {current*1000:.1f} ms, " \
+      f"previous {previous*1000:.1f} ms ({previous/current:.0f}x), {status}")
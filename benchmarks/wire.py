@@ -0,0 +1,55 @@
+#==============================================================================
+# Copyright (C) 2024  Emmanuel Mazurier <contact@bibliob.us>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#==============================================================================
+
+"""Size and throughput of wire frames compared with json, for led blocks sent by event stream
+
+usage : python benchmarks/wire.py [positions] [rounds]
+"""
+
+import json, os, sys, time
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# settings are read from .env.sample when not set, as for tests
+with open(os.path.join(root, '.env.sample')) as env:
+  for line in env:
+    if '=' in line:
+      name, value = line.strip().split('=', 1)
+      os.environ.setdefault(name, value)
+from blocks import buildPositions
+import tools, wire
+
+def perSecond(fn, value, rounds):
+  start = time.perf_counter()
+  for i in range(rounds):
+    fn(value)
+  return rounds / (time.perf_counter() - start)
+
+if __name__ == '__main__':
+  size = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+  rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+  blocks = tools.buildBlockPosition(buildPositions(size), 'add')
+  encoders = {
+    'json': (lambda blocks: json.dumps(blocks, default=str), json.loads),
+    'frames': (wire.encode, wire.decode),
+    'frames base64': (wire.encodeData, wire.decodeData),
+  }
+  print(f"{len(blocks)} blocks from {size} positions")
+  for name, (encode, decode) in encoders.items():
+    data = encode(blocks)
+    print(f"{name}: {len(data)} bytes ({len(data)/len(blocks):.1f} by block), " \
+      f"encode {perSecond(encode, blocks, rounds):.0f}/s, decode {perSecond(decode, data, rounds):.0f}/s")
@@ -0,0 +1,153 @@
+#==============================================================================
+# Copyright (C) 2024  Emmanuel Mazurier <contact@bibliob.us>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#==============================================================================
+
+from config import settings
+import asyncio, logging, random, time
+import httpx
+
+logger = logging.getLogger(__name__)
+
+'''books metadata providers : base urls can be changed in settings (i.e. for a local stub server)'''
+providers = ['googleapis', 'openlibrary']
+
+class ProviderError(Exception):
+  '''provider unreachable or answered with an error'''
+  def __init__(self, provider, message):
+    super().__init__(f"{provider}: {message}")
+    self.provider = provider
+
+class CircuitOpen(ProviderError):
+  '''too many failures for provider : calls are skipped until reset timeout'''
+
+class CircuitBreaker:
+  '''closed : calls allowed, open : calls rejected, half open after reset timeout : one trial call at a time'''
+
+  def __init__(self, threshold, reset_timeout):
+    self.threshold = threshold
+    self.reset_timeout = reset_timeout
+    self.failures = 0
+    self.opened_at = None
+    self.probe_at = None
+
+  def allow(self):
+    if self.opened_at is None:
+      return True
+    now = time.monotonic()
+    if now - self.opened_at < self.reset_timeout:
+      return False
+    # half open : other calls are rejected until trial call ends (or is lost for reset timeout)
+    if self.probe_at is not None and now - self.probe_at < self.reset_timeout:
+      return False
+    self.probe_at = now
+    return True
+
+  def success(self):
+    self.failures = 0
+    self.opened_at = None
+    self.probe_at = None
+
+  def failure(self):
+    self.failures += 1
+    self.probe_at = None
+    if self.failures >= self.threshold:
+      self.opened_at = time.monotonic()
+
+  def release(self):
+    '''end of call without verdict on provider health'''
+    self.probe_at = None
+
+  def state(self):
+    if self.opened_at is None:
+      return 'closed'
+    return 'half-open' if time.monotonic() - self.opened_at >= self.reset_timeout else 'open'
+
+_client = None
+_breakers = {}
+
+def getClient():
+  '''one keep-alive client by worker, shared by all providers'''
+  global _client
+  if _client is None:
+    _client = httpx.AsyncClient(
+      timeout=httpx.Timeout(settings.book_api_timeout, connect=settings.book_api_connect_timeout),
+      limits=httpx.Limits(max_connections=settings.book_api_max_connections, \
+        max_keepalive_connections=settings.book_api_max_connections),
+      headers={'User-Agent': 'Bibliobus API (https://bibliob.us)'})
+  return _client
+
+async def closeClient():
+  global _client
+  if _client is not None:
+    await _client.aclose()
+    _client = None
+
+def getBreaker(provider):
+  if provider not in _breakers:
+    _breakers[provider] = CircuitBreaker(settings.book_api_breaker_threshold, settings.book_api_breaker_reset)
+  return _breakers[provider]
+
+def getStats():
+  return {provider: {'state': breaker.state(), 'failures': breaker.failures} for provider, breaker in _breakers.items()}
+
+async def getJson(provider, url, params = None):
+  '''GET json from provider with retries and exponential backoff, guarded by provider circuit breaker'''
+  breaker = getBreaker(provider)
+  if not breaker.allow():
+    raise CircuitOpen(provider, "circuit open, provider skipped")
+  attempts = settings.book_api_retries + 1
+  for attempt in range(attempts):
+    try:
+      r = await getClient().get(url, params=params)
+    except httpx.TransportError as e:
+      # connection errors and timeouts
+      error, failed = e, True
+    else:
+      # retry only on throttling or server errors, throttling is not a provider failure
+      if r.status_code == 429 or r.status_code >= 500:
+        error, failed = ProviderError(provider, f"HTTP {r.status_code}"), r.status_code >= 500
+      else:
+        # provider answered : client error or invalid json won't be retried, and are not provider failures
+        breaker.success()
+        try:
+          r.raise_for_status()
+          return r.json()
+        except (httpx.HTTPStatusError, ValueError) as e:
+          raise ProviderError(provider, str(e))
+    if attempt < attempts - 1:
+      await asyncio.sleep(settings.book_api_backoff * (2 ** attempt) * (1 + random.random()))
+  logger.warning("Book api %s failed after %s attempts: %s", provider, attempts, error)
+  if failed:
+    breaker.failure()
+  else:
+    breaker.release()
+  raise ProviderError(provider, str(error))
+
+async def searchIsbn(provider, isbn):
+  '''raw provider response for isbn'''
+  if provider == 'googleapis':
+    params = {'q': "ISBN:\""+isbn+"\""}
+    if settings.google_book_api_key:
+      params['key'] = settings.google_book_api_key
+    return await getJson(provider, settings.google_book_api_url + "/volumes", params)
+  if provider == 'openlibrary':
+    return await getJson(provider, settings.openlibrary_api_url + "/api/books", \
+      {'format': 'json', 'jscmd': 'data', 'bibkeys': "ISBN:"+isbn})
+  raise ProviderError(provider, "unknown provider")
+
+async def getVolume(ref):
+  '''google books volume for reference id'''
+  return await getJson('googleapis', settings.google_book_api_url + "/volumes/" + ref)
@@ -0,0 +1,96 @@
+#==============================================================================
+# Copyright (C) 2024  Emmanuel Mazurier <contact@bibliob.us>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#==============================================================================
+
+import asyncio, threading
+
+class Subscription:
+  '''event stream of one device : woken when location requests of its app change'''
+
+  def __init__(self, broker, app_id):
+    self.broker = broker
+    self.app_id = app_id
+    self._event = asyncio.Event()
+
+  def wake(self):
+    self._event.set()
+
+  async def wait(self, timeout):
+    '''True when woken before timeout'''
+    try:
+      await asyncio.wait_for(self._event.wait(), timeout)
+    except asyncio.TimeoutError:
+      return False
+    self._event.clear()
+    return True
+
+  def close(self):
+    self.broker.unsubscribe(self)
+
+class Broker:
+  '''location requests changes by app, pushed to event streams of worker
+
+  writes publish from any thread once committed, streams are woken in event loop;
+  writes done by other workers are only seen by streams polling fallback
+  '''
+
+  def __init__(self):
+    self._subscriptions = {}
+    self._loop = None
+    self._lock = threading.Lock()
+    self.stats = {'published': 0, 'woken': 0}
+
+  def subscribe(self, app_id):
+    self._loop = asyncio.get_running_loop()
+    subscription = Subscription(self, app_id)
+    with self._lock:
+      self._subscriptions.setdefault(app_id, set()).add(subscription)
+    return subscription
+
+  def unsubscribe(self, subscription):
+    with self._lock:
+      subscriptions = self._subscriptions.get(subscription.app_id)
+      if subscriptions is not None:
+        subscriptions.discard(subscription)
+        if not subscriptions:
+          del self._subscriptions[subscription.app_id]
+
+  def publish(self, app_id):
+    self.stats['published'] += 1
+    with self._lock:
+      subscriptions = list(self._subscriptions.get(app_id, ()))
+    if subscriptions and self._loop is not None and not self._loop.is_closed():
+      self._loop.call_soon_threadsafe(self._wake, subscriptions)
+
+  def _wake(self, subscriptions):
+    for subscription in subscriptions:
+      self.stats['woken'] += 1
+      subscription.wake()
+
+  def notify(self, mydb, app_id):
+    '''publish change of app requests once current transaction of mydb is committed'''
+    mydb.onCommit(lambda: self.publish(app_id))
+
+  def getStats(self):
+    stats = dict(self.stats)
+    with self._lock:
+      stats.update({'apps': len(self._subscriptions), 'streams': sum(len(s) for s in self._subscriptions.values())})
+    return stats
+
+_broker = Broker()
+
+def getBroker():
+  return _broker
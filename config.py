@@ -16,6 +16,7 @@
 #==============================================================================
 
 import os
+from pydantic import model_validator
 from pydantic_settings import BaseSettings
 from dotenv import load_dotenv
 
@@ -26,8 +27,54 @@ class Settings(BaseSettings):
     db_user: str = os.getenv('DB_USER')
     db_password: str = os.getenv('DB_PASSWORD')
     db_name: str = os.getenv('DB_NAME')
+    # connection pool by worker process
+    db_pool_size: int = int(os.getenv('DB_POOL_SIZE', 5))
+    db_pool_max_overflow: int = int(os.getenv('DB_POOL_MAX_OVERFLOW', 10))
+    db_pool_timeout: float = float(os.getenv('DB_POOL_TIMEOUT', 30))
+    db_pool_recycle: int = int(os.getenv('DB_POOL_RECYCLE', 3600))
+    db_pool_idle_timeout: int = int(os.getenv('DB_POOL_IDLE_TIMEOUT', 300))
+    db_pool_pre_ping: bool = os.getenv('DB_POOL_PRE_PING', '1') == '1'
+    db_pool_leak_timeout: int = int(os.getenv('DB_POOL_LEAK_TIMEOUT', 60))
+    db_async_pool_size: int = int(os.getenv('DB_ASYNC_POOL_SIZE', 10))
+    db_async_pool_max_overflow: int = int(os.getenv('DB_ASYNC_POOL_MAX_OVERFLOW', 20))
+    search_index_ttl: int = int(os.getenv('SEARCH_INDEX_TTL', 300))
+    # location events stream
+    sse_retry: int = int(os.getenv('SSE_RETRY', 3000))
+    sse_heartbeat: float = float(os.getenv('SSE_HEARTBEAT', 15))
+    sse_poll_interval: float = float(os.getenv('SSE_POLL_INTERVAL', 30))
+    event_log_size: int = int(os.getenv('EVENT_LOG_SIZE', 256))
+    event_log_retention: int = int(os.getenv('EVENT_LOG_RETENTION', 86400))
+    # background cleanup of location requests
+    sweeper_interval: float = float(os.getenv('SWEEPER_INTERVAL', 5))
+    sweeper_batch_size: int = int(os.getenv('SWEEPER_BATCH_SIZE', 1000))
+    # streams of other workers see remove requests at their next poll : they must be kept until then
+    request_remove_grace: int = int(os.getenv('REQUEST_REMOVE_GRACE', 35))
+    request_reset_grace: int = int(os.getenv('REQUEST_RESET_GRACE', 300))
+    tag_cache_max_items: int = int(os.getenv('TAG_CACHE_MAX_ITEMS', 20000))
+    book_import_chunk_size: int = int(os.getenv('BOOK_IMPORT_CHUNK_SIZE', 500))
     secret_key: str = os.getenv('SECRET_KEY')
     secret_key_access_token: str = os.getenv('SECRET_KEY_ACCESS_TOKEN')
     google_book_api_key: str = os.getenv('GOOGLE_BOOK_API_KEY')
+    # books metadata apis http client
+    google_book_api_url: str = os.getenv('GOOGLE_BOOK_API_URL', 'https://www.googleapis.com/books/v1')
+    openlibrary_api_url: str = os.getenv('OPENLIBRARY_API_URL', 'https://openlibrary.org')
+    book_api_timeout: float = float(os.getenv('BOOK_API_TIMEOUT', 5))
+    book_api_connect_timeout: float = float(os.getenv('BOOK_API_CONNECT_TIMEOUT', 2))
+    book_api_max_connections: int = int(os.getenv('BOOK_API_MAX_CONNECTIONS', 20))
+    book_api_retries: int = int(os.getenv('BOOK_API_RETRIES', 2))
+    book_api_backoff: float = float(os.getenv('BOOK_API_BACKOFF', 0.2))
+    book_api_breaker_threshold: int = int(os.getenv('BOOK_API_BREAKER_THRESHOLD', 5))
+    book_api_breaker_reset: float = float(os.getenv('BOOK_API_BREAKER_RESET', 30))
+    metadata_cache_path: str = os.getenv('METADATA_CACHE_PATH', 'metadata_cache.sqlite3')
+    metadata_cache_ttl: int = int(os.getenv('METADATA_CACHE_TTL', 30*24*3600))
+    metadata_cache_negative_ttl: int = int(os.getenv('METADATA_CACHE_NEGATIVE_TTL', 3600))
+    metadata_cache_max_items: int = int(os.getenv('METADATA_CACHE_MAX_ITEMS', 10000))
+
+    @model_validator(mode='after')
+    def check_remove_grace(self):
+        if self.request_remove_grace < self.sse_poll_interval:
+            raise ValueError(f"REQUEST_REMOVE_GRACE ({self.request_remove_grace}s) must be at least SSE_POLL_INTERVAL " \
+                f"({self.sse_poll_interval}s), else devices streamed by other workers never get remove requests")
+        return self
 
 settings = Settings()
\ No newline at end of file
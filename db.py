@@ -15,16 +15,427 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #==============================================================================
 
+from collections import deque
 from config import settings
+import asyncio, logging, threading, time, traceback
 import mysql.connector
+import mysql.connector.aio
 
-def getMyDB():
-	mydb = mysql.connector.connect(
+logger = logging.getLogger(__name__)
+
+class PoolTimeout(Exception):
+	'''no connection available in pool before timeout'''
+
+class PooledConnection:
+	'''proxy for a mysql connection : close() gives it back to the pool'''
+
+	def __init__(self, pool, cnx, created_at):
+		self._pool = pool
+		self._cnx = cnx
+		self._created_at = created_at
+		# checkout infos kept by pool for leak detection
+		self._record = {'checkout_at': time.monotonic(), 'stack': None, 'warned': False}
+		self._after_commit = []
+		self._closed = False
+
+	def __getattr__(self, name):
+		return getattr(self._cnx, name)
+
+	def onCommit(self, callback):
+		'''run callback once current transaction is committed (dropped on rollback)'''
+		self._after_commit.append(callback)
+
+	def commit(self):
+		self._cnx.commit()
+		callbacks, self._after_commit = self._after_commit, []
+		for callback in callbacks:
+			callback()
+
+	def rollback(self):
+		self._after_commit = []
+		self._cnx.rollback()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc, tb):
+		self.close()
+
+	def __del__(self):
+		# connection dropped without close() : give it back anyway and report it
+		if not getattr(self, '_closed', True):
+			self._pool._checkin(self, leaked=True)
+
+	def close(self):
+		if not self._closed:
+			self._pool._checkin(self)
+
+class ConnectionPool:
+	'''thread safe pool of mysql connections, one per uvicorn worker process
+
+	size : connections kept open in pool
+	max_overflow : extra connections opened under load, closed when released
+	timeout : seconds to wait for a free connection before raising PoolTimeout
+	recycle : max lifetime in seconds of a connection (0 to disable)
+	idle_timeout : connections idle for longer are reopened (under MySQL wait_timeout)
+	pre_ping : check connection is alive on checkout
+	leak_timeout : warn when a connection is held longer than this (0 to disable)
+	'''
+
+	def __init__(self, size=5, max_overflow=10, timeout=30, recycle=3600, idle_timeout=300, \
+		pre_ping=True, leak_timeout=60, **connect_args):
+		self.size = size
+		self.max_overflow = max_overflow
+		self.timeout = timeout
+		self.recycle = recycle
+		self.idle_timeout = idle_timeout
+		self.pre_ping = pre_ping
+		self.leak_timeout = leak_timeout
+		self._connect_args = connect_args
+		self._lock = threading.RLock()
+		self._available = threading.Condition(self._lock)
+		# idle connections : (cnx, created_at, released_at), last released first
+		self._idle = deque()
+		self._checked_out = {}
+		self._pending = 0
+		self._stats = {'created': 0, 'closed': 0, 'recycled': 0, 'reconnected': 0, 'checkouts': 0, \
+			'waits': 0, 'timeouts': 0, 'leaked': 0, 'peak': 0}
+
+	def _total(self):
+		return len(self._idle) + len(self._checked_out)
+
+	def _create(self):
+		cnx = mysql.connector.connect(**self._connect_args)
+		with self._lock:
+			self._stats['created'] += 1
+		return cnx
+
+	def _discard(self, cnx):
+		try:
+			cnx.close()
+		except mysql.connector.Error:
+			pass
+		with self._lock:
+			self._stats['closed'] += 1
+
+	def connect(self):
+		'''checkout a connection, waiting for a free one if pool and overflow are full'''
+		deadline = time.monotonic() + self.timeout
+		with self._available:
+			self._stats['checkouts'] += 1
+			while not self._idle and self._total() + self._pending >= self.size + self.max_overflow:
+				remaining = deadline - time.monotonic()
+				if remaining <= 0:
+					self._stats['timeouts'] += 1
+					raise PoolTimeout(f"No connection available in pool after {self.timeout}s: {self.status()}")
+				self._stats['waits'] += 1
+				self._available.wait(remaining)
+			record = self._idle.pop() if self._idle else None
+			# reserve a slot while connecting outside of lock
+			self._pending += 1
+		try:
+			cnx, created_at = self._prepare(record)
+		finally:
+			with self._available:
+				self._pending -= 1
+				self._available.notify()
+		proxy = PooledConnection(self, cnx, created_at)
+		if self.leak_timeout:
+			proxy._record['stack'] = ''.join(traceback.format_stack(limit=8)[:-1])
+		with self._lock:
+			self._checked_out[id(proxy)] = proxy._record
+			self._stats['peak'] = max(self._stats['peak'], len(self._checked_out))
+			self._checkLeaks()
+		return proxy
+
+	def _prepare(self, record):
+		'''open new connection, or validate idle one (recycle, idle timeout, pre ping)'''
+		if record is None:
+			return self._create(), time.monotonic()
+		cnx, created_at, released_at = record
+		now = time.monotonic()
+		expired = self.recycle and now - created_at > self.recycle
+		idle = self.idle_timeout and now - released_at > self.idle_timeout
+		if expired or idle:
+			self._discard(cnx)
+			with self._lock:
+				self._stats['recycled'] += 1
+			return self._create(), time.monotonic()
+		if self.pre_ping:
+			try:
+				if not cnx.is_connected():
+					cnx.reconnect(attempts=2, delay=0)
+					with self._lock:
+						self._stats['reconnected'] += 1
+			except mysql.connector.Error:
+				self._discard(cnx)
+				return self._create(), time.monotonic()
+		return cnx, created_at
+
+	def _checkin(self, proxy, leaked=False):
+		proxy._closed = True
+		cnx = proxy._cnx
+		with self._lock:
+			self._checked_out.pop(id(proxy), None)
+			if leaked:
+				self._stats['leaked'] += 1
+				logger.warning("DB connection garbage collected without close(), checked out at:\n%s", proxy._record['stack'])
+		# never give back a connection with pending results or opened transaction
+		try:
+			if cnx.unread_result:
+				cnx.consume_results()
+			cnx.rollback()
+			reusable = True
+		except mysql.connector.Error:
+			reusable = False
+		with self._available:
+			if reusable and self._total() < self.size:
+				self._idle.append((cnx, proxy._created_at, time.monotonic()))
+				reusable = None
+			self._available.notify()
+		if reusable is not None:
+			self._discard(cnx)
+
+	def _checkLeaks(self):
+		if not self.leak_timeout:
+			return
+		now = time.monotonic()
+		for record in self._checked_out.values():
+			if not record['warned'] and now - record['checkout_at'] > self.leak_timeout:
+				record['warned'] = True
+				logger.warning("DB connection held for more than %ss, checked out at:\n%s", self.leak_timeout, record['stack'])
+
+	def status(self):
+		'''pool statistics : use it to size pool per uvicorn worker'''
+		with self._lock:
+			self._checkLeaks()
+			stats = dict(self._stats)
+			stats.update({'size': self.size, 'max_overflow': self.max_overflow, 'idle': len(self._idle), \
+				'checked_out': len(self._checked_out), 'overflow': max(0, self._total() - self.size)})
+			return stats
+
+	def dispose(self):
+		'''close idle connections, checked out ones will be closed on checkin'''
+		with self._lock:
+			records = list(self._idle)
+			self._idle.clear()
+		for cnx, created_at, released_at in records:
+			self._discard(cnx)
+
+class AsyncPooledConnection:
+	'''proxy for an async mysql connection : await close() gives it back to the pool'''
+
+	def __init__(self, pool, cnx, created_at):
+		self._pool = pool
+		self._cnx = cnx
+		self._created_at = created_at
+		self._record = {'checkout_at': time.monotonic(), 'stack': None, 'warned': False}
+		self._after_commit = []
+		self._closed = False
+
+	def __getattr__(self, name):
+		return getattr(self._cnx, name)
+
+	def onCommit(self, callback):
+		'''run callback once current transaction is committed (dropped on rollback)'''
+		self._after_commit.append(callback)
+
+	async def commit(self):
+		await self._cnx.commit()
+		callbacks, self._after_commit = self._after_commit, []
+		for callback in callbacks:
+			callback()
+
+	async def rollback(self):
+		self._after_commit = []
+		await self._cnx.rollback()
+
+	async def __aenter__(self):
+		return self
+
+	async def __aexit__(self, exc_type, exc, tb):
+		await self.close()
+
+	async def close(self):
+		if not self._closed:
+			await self._pool._checkin(self)
+
+class AsyncConnectionPool(ConnectionPool):
+	'''pool of mysql.connector.aio connections for async routes, bound to the worker event loop'''
+
+	def __init__(self, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		self._available = asyncio.Condition()
+
+	async def _create(self):
+		cnx = await mysql.connector.aio.connect(**self._connect_args)
+		with self._lock:
+			self._stats['created'] += 1
+		return cnx
+
+	async def _discard(self, cnx):
+		try:
+			await cnx.close()
+		except mysql.connector.Error:
+			pass
+		with self._lock:
+			self._stats['closed'] += 1
+
+	async def connect(self):
+		'''checkout a connection, waiting for a free one if pool and overflow are full'''
+		deadline = time.monotonic() + self.timeout
+		async with self._available:
+			self._stats['checkouts'] += 1
+			while not self._idle and self._total() + self._pending >= self.size + self.max_overflow:
+				remaining = deadline - time.monotonic()
+				try:
+					if remaining <= 0:
+						raise asyncio.TimeoutError()
+					self._stats['waits'] += 1
+					await asyncio.wait_for(self._available.wait(), remaining)
+				except asyncio.TimeoutError:
+					self._stats['timeouts'] += 1
+					raise PoolTimeout(f"No connection available in async pool after {self.timeout}s: {self.status()}")
+			record = self._idle.pop() if self._idle else None
+			self._pending += 1
+		try:
+			cnx, created_at = await self._prepare(record)
+		finally:
+			async with self._available:
+				self._pending -= 1
+				self._available.notify()
+		proxy = AsyncPooledConnection(self, cnx, created_at)
+		if self.leak_timeout:
+			proxy._record['stack'] = ''.join(traceback.format_stack(limit=8)[:-1])
+		with self._lock:
+			self._checked_out[id(proxy)] = proxy._record
+			self._stats['peak'] = max(self._stats['peak'], len(self._checked_out))
+			self._checkLeaks()
+		return proxy
+
+	async def _prepare(self, record):
+		if record is None:
+			return await self._create(), time.monotonic()
+		cnx, created_at, released_at = record
+		now = time.monotonic()
+		expired = self.recycle and now - created_at > self.recycle
+		idle = self.idle_timeout and now - released_at > self.idle_timeout
+		if expired or idle:
+			await self._discard(cnx)
+			with self._lock:
+				self._stats['recycled'] += 1
+			return await self._create(), time.monotonic()
+		if self.pre_ping:
+			try:
+				if not await cnx.is_connected():
+					await cnx.reconnect(attempts=2, delay=0)
+					with self._lock:
+						self._stats['reconnected'] += 1
+			except mysql.connector.Error:
+				await self._discard(cnx)
+				return await self._create(), time.monotonic()
+		return cnx, created_at
+
+	async def _checkin(self, proxy):
+		proxy._closed = True
+		cnx = proxy._cnx
+		with self._lock:
+			self._checked_out.pop(id(proxy), None)
+		try:
+			await cnx.rollback()
+			reusable = True
+		except mysql.connector.Error:
+			reusable = False
+		async with self._available:
+			if reusable and self._total() < self.size:
+				self._idle.append((cnx, proxy._created_at, time.monotonic()))
+				reusable = None
+			self._available.notify()
+		if reusable is not None:
+			await self._discard(cnx)
+
+	async def dispose(self):
+		with self._lock:
+			records = list(self._idle)
+			self._idle.clear()
+		for cnx, created_at, released_at in records:
+			await self._discard(cnx)
+
+_pool = None
+_pool_lock = threading.Lock()
+_async_pool = None
+
+def _poolArgs(size, max_overflow):
+	return dict(
+	  size=size,
+	  max_overflow=max_overflow,
+	  timeout=settings.db_pool_timeout,
+	  recycle=settings.db_pool_recycle,
+	  idle_timeout=settings.db_pool_idle_timeout,
+	  pre_ping=settings.db_pool_pre_ping,
+	  leak_timeout=settings.db_pool_leak_timeout,
 	  host=settings.db_host,
 	  user=settings.db_user,
 	  password=settings.db_password,
-	  database=settings.db_name
+	  database=settings.db_name,
+	  buffered=True
 	)
-	if mydb and not mydb.is_connected():
-		mydb.reconnect()
-	return mydb
\ No newline at end of file
+
+def getPool():
+	'''pool is created lazily to be owned by current worker process'''
+	global _pool
+	if _pool is None:
+		with _pool_lock:
+			if _pool is None:
+				_pool = ConnectionPool(**_poolArgs(settings.db_pool_size, settings.db_pool_max_overflow))
+	return _pool
+
+def getMyDB():
+	'''get connection from pool : use it with "with" statement or call close() to release it'''
+	return getPool().connect()
+
+def getAsyncPool():
+	'''async pool must be created from the worker event loop'''
+	global _async_pool
+	if _async_pool is None:
+		_async_pool = AsyncConnectionPool(**_poolArgs(settings.db_async_pool_size, settings.db_async_pool_max_overflow))
+	return _async_pool
+
+async def getMyAsyncDB():
+	'''get connection from async pool : use it with "async with" statement or await close() to release it'''
+	return await getAsyncPool().connect()
+
+async def closePools():
+	if _async_pool is not None:
+		await _async_pool.dispose()
+	if _pool is not None:
+		_pool.dispose()
+
+def getPoolStats():
+	stats = {'sync': getPool().status()}
+	if _async_pool is not None:
+		stats['async'] = _async_pool.status()
+	return stats
+
+async def fetchAll(mydb, query, params = None):
+	'''async cursor helpers : rows as dict'''
+	cursor = await mydb.cursor(dictionary=True, buffered=True)
+	await cursor.execute(query, params)
+	rows = await cursor.fetchall()
+	await cursor.close()
+	return rows
+
+async def fetchOne(mydb, query, params = None):
+	cursor = await mydb.cursor(dictionary=True, buffered=True)
+	await cursor.execute(query, params)
+	row = await cursor.fetchone()
+	await cursor.close()
+	return row
+
+async def execute(mydb, query, params = None):
+	'''run write statement and return affected rows count'''
+	cursor = await mydb.cursor()
+	await cursor.execute(query, params)
+	rowcount = cursor.rowcount
+	await cursor.close()
+	return rowcount
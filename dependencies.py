@@ -17,11 +17,57 @@
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from db import getMyDB, getMyAsyncDB
 from models import Token, User
+import logging
+import mysql.connector
+
+logger = logging.getLogger(__name__)
 
 device_auth_scheme = HTTPBearer()
 
-def get_auth_device(token: HTTPAuthorizationCredentials = Depends(device_auth_scheme)):
+def get_db():
+    """Unit of work : one connection and one transaction by request. Used with scope="function", it is committed
+    before response is sent : a failed commit answers 503 instead of a success for changes not saved"""
+    mydb = getMyDB()
+    try:
+        yield mydb
+    except Exception:
+        mydb.rollback()
+        raise
+    else:
+        try:
+            mydb.commit()
+        except mysql.connector.Error as e:
+            logger.warning("Commit failed: %s", e)
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Changes could not be saved, please retry"
+            ) from e
+    finally:
+        mydb.close()
+
+async def get_async_db():
+    """Unit of work for async routes, using async pool"""
+    mydb = await getMyAsyncDB()
+    try:
+        yield mydb
+    except Exception:
+        await mydb.rollback()
+        raise
+    else:
+        try:
+            await mydb.commit()
+        except mysql.connector.Error as e:
+            logger.warning("Commit failed: %s", e)
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Changes could not be saved, please retry"
+            ) from e
+    finally:
+        await mydb.close()
+
+def get_auth_device(token: HTTPAuthorizationCredentials = Depends(device_auth_scheme), mydb = Depends(get_db, scope="function")):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -35,7 +81,7 @@ def get_auth_device(token: HTTPAuthorizationCredentials = Depends(device_auth_sc
             raise credentials_exception
     except Token.InvalidTokenError:
         raise credentials_exception
-    user = User.get_user(user_id)
+    user = User.get_user(mydb, user_id)
     if user is None:
         raise credentials_exception
     return {"user": user, "device": payload.get("device")}
\ No newline at end of file
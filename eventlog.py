@@ -0,0 +1,120 @@
+#==============================================================================
+# Copyright (C) 2024  Emmanuel Mazurier <contact@bibliob.us>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#==============================================================================
+
+from collections import deque, namedtuple
+from config import settings
+import json
+import db
+
+'''one location event : id increases by one for each event of app'''
+Event = namedtuple('Event', ['id', 'source', 'data'])
+
+class EventLog:
+  '''location events by app, replayed to reconnecting devices from their Last-Event-ID
+
+  events are stored in biblio_event, last ones of each app are kept in memory (ids without gap).
+  sequence row of app is locked by producer until commit : events of an app are produced
+  one at a time across workers, and committed in id order
+  '''
+
+  def __init__(self, max_items):
+    self.max_items = max_items
+    self._rings = {}
+    self.stats = {'appended': 0, 'memory_reads': 0, 'db_reads': 0, 'purged': 0}
+
+  async def lock(self, mydb, app_id):
+    '''lock sequence of app until end of transaction : last event id of app'''
+    await db.execute(mydb, "INSERT INTO biblio_event_seq (id_app, last_id) VALUES (%s, 0) \
+      ON DUPLICATE KEY UPDATE last_id=last_id", (app_id,))
+    row = await db.fetchOne(mydb, "SELECT last_id FROM biblio_event_seq WHERE id_app=%s", (app_id,))
+    return row['last_id']
+
+  async def append(self, mydb, app_id, source, data, last_id):
+    '''store event after last_id (sequence locked by lock()), kept in memory once committed'''
+    event = Event(last_id + 1, source, data)
+    await db.execute(mydb, "INSERT INTO biblio_event (id_app, id, source, data) VALUES (%s, %s, %s, %s)", \
+      (app_id, event.id, source, json.dumps(data, default=str)))
+    await db.execute(mydb, "UPDATE biblio_event_seq SET last_id=%s WHERE id_app=%s", (event.id, app_id))
+    mydb.onCommit(lambda: self._remember(app_id, [event]))
+    self.stats['appended'] += 1
+    return event.id
+
+  def _remember(self, app_id, events):
+    ring = self._rings.get(app_id)
+    if ring is None:
+      ring = self._rings[app_id] = deque(maxlen=self.max_items)
+    for event in events:
+      if ring and event.id <= ring[-1].id:
+        continue
+      # gap : events of other workers not read yet, or purged
+      if ring and event.id != ring[-1].id + 1:
+        ring.clear()
+      ring.append(event)
+
+  async def since(self, mydb, app_id, after_id, last_id):
+    '''committed events of app with id in ]after_id, last_id] : from memory when held, else from biblio_event'''
+    if after_id >= last_id:
+      return []
+    ring = self._rings.get(app_id)
+    if ring and ring[0].id <= after_id + 1 and ring[-1].id >= last_id:
+      self.stats['memory_reads'] += 1
+      return [event for event in ring if after_id < event.id <= last_id]
+    self.stats['db_reads'] += 1
+    rows = await db.fetchAll(mydb, "SELECT id, source, data FROM biblio_event WHERE id_app=%s and id>%s and id<=%s \
+      ORDER BY id", (app_id, after_id, last_id))
+    events = [Event(row['id'], row['source'], json.loads(row['data'])) for row in rows]
+    self._remember(app_id, events)
+    return events
+
+  async def last(self, mydb, app_id, source, last_id):
+    '''last committed event of source for app (sequence locked by lock() at last_id), None when purged'''
+    ring = self._rings.get(app_id)
+    if ring and ring[-1].id == last_id:
+      for event in reversed(ring):
+        if event.source == source:
+          self.stats['memory_reads'] += 1
+          return event
+    self.stats['db_reads'] += 1
+    row = await db.fetchOne(mydb, "SELECT id, source, data FROM biblio_event WHERE id_app=%s and source=%s \
+      ORDER BY id DESC LIMIT 1", (app_id, source))
+    return Event(row['id'], row['source'], json.loads(row['data'])) if row else None
+
+  async def purge(self, mydb, retention, batch_size):
+    '''remove events older than retention seconds from biblio_event by batches (sequences are kept)'''
+    purged = 0
+    while True:
+      count = await db.execute(mydb, "DELETE FROM biblio_event WHERE date_add<DATE_SUB(NOW(), INTERVAL %s SECOND) LIMIT %s", \
+        (int(retention), batch_size))
+      await mydb.commit()
+      purged += count
+      if count < batch_size:
+        break
+    self.stats['purged'] += purged
+    return purged
+
+  def getStats(self):
+    stats = dict(self.stats)
+    stats.update({'apps': len(self._rings), 'memory': sum(len(ring) for ring in self._rings.values())})
+    return stats
+
+_log = None
+
+def getLog():
+  global _log
+  if _log is None:
+    _log = EventLog(settings.event_log_size)
+  return _log
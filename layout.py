@@ -0,0 +1,161 @@
+#==============================================================================
+# Copyright (C) 2024  Emmanuel Mazurier <contact@bibliob.us>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#==============================================================================
+
+'''led strip layout of a shelf row
+
+led column of a book = sum of ranges and shifts of books at lower positions + own shift,
+then each static segment (ordered by position) adds its range when column reached its led column
+'''
+
+from bisect import bisect_left, insort
+
+def applyStatics(column, statics):
+  for static in statics:
+    if column >= static['led_column']:
+      column += static['range']
+  return column
+
+def computeLedColumns(positions, statics):
+  '''led columns for book positions of a row sorted by position, in one pass'''
+  columns = []
+  total = 0
+  # books sharing a position don't count for each other
+  group_position = None
+  group_total = 0
+  for pos in positions:
+    if pos['position'] != group_position:
+      total += group_total
+      group_total = 0
+      group_position = pos['position']
+    shift = pos.get('shiftpos') or 0
+    group_total += (pos['range'] or 0) + shift
+    columns.append(applyStatics(total + max(shift, 0), statics))
+  return columns
+
+class Fenwick:
+  '''prefix sums by position with O(log n) updates, grown on demand'''
+
+  def __init__(self, size = 0):
+    self.values = [0] * (size + 1)
+    self.tree = [0] * (size + 1)
+
+  def _grow(self, size):
+    values = self.values + [0] * (size + 1 - len(self.values))
+    self.values = [0] * len(values)
+    self.tree = [0] * len(values)
+    for i, value in enumerate(values):
+      if value:
+        self.add(i, value)
+
+  def add(self, i, delta):
+    if i < 1:
+      raise ValueError(f"Fenwick index must be 1 or more, got {i}")
+    if i >= len(self.values):
+      self._grow(max(i, 2 * (len(self.values) - 1)))
+    self.values[i] += delta
+    while i < len(self.tree):
+      self.tree[i] += delta
+      i += i & -i
+
+  def copy(self):
+    tree = Fenwick()
+    tree.values = list(self.values)
+    tree.tree = list(self.tree)
+    return tree
+
+  def prefix(self, i):
+    '''sum of values at positions 1..i (0 for empty prefix)'''
+    if i < 0:
+      raise ValueError(f"Fenwick prefix index must be 0 or more, got {i}")
+    i = min(i, len(self.tree) - 1)
+    total = 0
+    while i > 0:
+      total += self.tree[i]
+      i -= i & -i
+    return total
+
+class ShelfLayout:
+  '''book positions of a row with led columns kept as prefix sums of (range + shift) by position
+
+  rows : biblio_position rows of the row, books and statics
+  row_version : version of row in database the layout was built for
+  '''
+
+  def __init__(self, rows, row_version = 0):
+    self.row_version = row_version
+    self.items = {}
+    self.positions = []
+    self.statics = [row for row in rows if row['item_type'] == 'static']
+    self.statics.sort(key=lambda static: static['position'])
+    self.tree = Fenwick(max([row['position'] for row in rows if row['item_type'] == 'book'], default=0))
+    for row in rows:
+      if row['item_type'] == 'book':
+        self.insert(row['id_item'], row['position'], row['range'], row['shiftpos'])
+
+  def copy(self):
+    '''layout to edit in a transaction, cached one is kept as is until commit'''
+    shelf = ShelfLayout([], self.row_version)
+    shelf.items = {item_id: dict(item) for item_id, item in self.items.items()}
+    shelf.positions = list(self.positions)
+    shelf.statics = self.statics
+    shelf.tree = self.tree.copy()
+    return shelf
+
+  def insert(self, item_id, position, range, shiftpos = 0):
+    if position < 1:
+      raise ValueError(f"Invalid position {position} for item {item_id}: positions start at 1")
+    if item_id in self.items:
+      self.remove(item_id)
+    self.items[item_id] = {'position': position, 'range': range or 0, 'shiftpos': shiftpos or 0}
+    insort(self.positions, (position, item_id))
+    self.tree.add(position, (range or 0) + (shiftpos or 0))
+
+  def remove(self, item_id):
+    item = self.items.get(item_id)
+    if item is None:
+      return
+    self.tree.add(item['position'], -(item['range'] + item['shiftpos']))
+    self.positions.pop(bisect_left(self.positions, (item['position'], item_id)))
+    del self.items[item_id]
+
+  def resize(self, item_id, range):
+    item = self.items[item_id]
+    self.insert(item_id, item['position'], range, item['shiftpos'])
+
+  def itemsAt(self, position):
+    i = bisect_left(self.positions, (position,))
+    found = []
+    while i < len(self.positions) and self.positions[i][0] == position:
+      found.append(self.positions[i][1])
+      i += 1
+    return found
+
+  def after(self, position):
+    '''items at greater positions : their led column depends on items at position'''
+    i = bisect_left(self.positions, (position + 1,))
+    return [item_id for _, item_id in self.positions[i:]]
+
+  def order(self):
+    '''item ids sorted by position'''
+    return [item_id for _, item_id in self.positions]
+
+  def ledColumn(self, item_id):
+    item = self.items[item_id]
+    return applyStatics(self.tree.prefix(item['position'] - 1) + max(item['shiftpos'], 0), self.statics)
+
+  def ledColumns(self, item_ids):
+    return {item_id: self.ledColumn(item_id) for item_id in item_ids}
@@ -15,11 +15,23 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #==============================================================================
 
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from routers import customize, devices, books, locations, positions, tags
+import bookapi, broker, db, eventlog, metacache, os, sweeper, tagcache
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    sweeper.getSweeper().start()
+    yield
+    await sweeper.getSweeper().stop()
+    await bookapi.closeClient()
+    metacache.getCache().close()
+    await db.closePools()
 
 app = FastAPI(title="Bibliobus API",
+              lifespan=lifespan,
               summary="Rest API to manage item positions from and to \"Bibus\" devices",
               version="0.1.0",
               contact={
@@ -50,6 +62,14 @@ app.add_middleware(
 async def root():
     return {"message": "Welcome to Bibliobus API"}
 
+@app.get("/status")
+async def status():
+    """Database pools, books api, caches, event streams and sweeper statistics for current worker process"""
+    return {"pid": os.getpid(), "db_pool": db.getPoolStats(), "book_api": bookapi.getStats(), \
+        "metadata_cache": metacache.getCache().getStats(), "tag_cache": tagcache.getCache().getStats(), \
+        "events": broker.getBroker().getStats(), "event_log": eventlog.getLog().getStats(), \
+        "sweeper": sweeper.getSweeper().getStats()}
+
 app.include_router(books.router)
 app.include_router(devices.router)
 app.include_router(locations.router)
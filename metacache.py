@@ -0,0 +1,141 @@
+#==============================================================================
+# Copyright (C) 2024  Emmanuel Mazurier <contact@bibliob.us>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#==============================================================================
+
+from collections import OrderedDict
+from config import settings
+import asyncio, json, sqlite3, threading, time
+
+class MetadataCache:
+  '''books metadata by (provider, isbn or ref) : LRU in memory, backed by a sqlite file shared by workers
+
+  ttl : seconds before a found metadata is looked up again
+  negative_ttl : same for empty results (isbn unknown by provider)
+  max_items : entries kept in memory
+  '''
+
+  def __init__(self, path, ttl, negative_ttl, max_items):
+    self.path = path
+    self.ttl = ttl
+    self.negative_ttl = negative_ttl
+    self.max_items = max_items
+    self._memory = OrderedDict()
+    self._inflight = {}
+    self._db = None
+    self._lock = threading.Lock()
+    self.stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'coalesced': 0, 'errors': 0}
+
+  def _getDB(self):
+    if self._db is None:
+      self._db = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+      self._db.execute("PRAGMA journal_mode=WAL")
+      self._db.execute("CREATE TABLE IF NOT EXISTS book_metadata (provider TEXT NOT NULL, ref TEXT NOT NULL, \
+        data TEXT NOT NULL, expires_at REAL NOT NULL, PRIMARY KEY (provider, ref))")
+    return self._db
+
+  def _remember(self, key, expires_at, value):
+    self._memory[key] = (expires_at, value)
+    self._memory.move_to_end(key)
+    while len(self._memory) > self.max_items:
+      self._memory.popitem(last=False)
+
+  def _read(self, provider, ref, now):
+    with self._lock:
+      return self._getDB().execute("SELECT data, expires_at FROM book_metadata WHERE provider=? AND ref=? AND expires_at>?", \
+        (provider, ref, now)).fetchone()
+
+  def _write(self, provider, ref, data, expires_at):
+    with self._lock:
+      self._getDB().execute("INSERT OR REPLACE INTO book_metadata (provider, ref, data, expires_at) VALUES (?, ?, ?, ?)", \
+        (provider, ref, data, expires_at))
+
+  async def peek(self, provider, ref):
+    '''cached value or None : memory first, then sqlite file (read in a thread, out of event loop)'''
+    key = (provider, ref)
+    now = time.time()
+    entry = self._memory.get(key)
+    if entry is not None:
+      if entry[0] > now:
+        self._memory.move_to_end(key)
+        self.stats['hits'] += 1
+        return entry[1]
+      del self._memory[key]
+    row = await asyncio.to_thread(self._read, provider, ref, now)
+    if row is not None:
+      value = json.loads(row[0])
+      self._remember(key, row[1], value)
+      self.stats['disk_hits'] += 1
+      return value
+    return None
+
+  async def store(self, provider, ref, value):
+    expires_at = time.time() + (self.ttl if value else self.negative_ttl)
+    self._remember((provider, ref), expires_at, value)
+    await asyncio.to_thread(self._write, provider, ref, json.dumps(value, default=str), expires_at)
+
+  async def get(self, provider, ref, loader):
+    '''cached value, or value from loader() : concurrent lookups for same key share one call'''
+    value = await self.peek(provider, ref)
+    if value is not None:
+      return value
+    key = (provider, ref)
+    # same lookup already running, possibly started while file was read
+    if key in self._inflight:
+      self.stats['coalesced'] += 1
+      return await asyncio.shield(self._inflight[key])
+    self.stats['misses'] += 1
+    future = asyncio.get_running_loop().create_future()
+    self._inflight[key] = future
+    try:
+      value = await loader()
+      await self.store(provider, ref, value)
+      future.set_result(value)
+      return value
+    except asyncio.CancelledError:
+      future.cancel()
+      raise
+    except Exception as e:
+      self.stats['errors'] += 1
+      future.set_exception(e)
+      # exception is raised to this caller, avoid "never retrieved" warning when nobody waits
+      future.exception()
+      raise
+    finally:
+      del self._inflight[key]
+
+  def purge(self):
+    '''remove expired entries from sqlite file'''
+    with self._lock:
+      self._getDB().execute("DELETE FROM book_metadata WHERE expires_at<=?", (time.time(),))
+
+  def getStats(self):
+    stats = dict(self.stats)
+    stats.update({'memory': len(self._memory), 'inflight': len(self._inflight)})
+    return stats
+
+  def close(self):
+    if self._db is not None:
+      self._db.close()
+      self._db = None
+
+_cache = None
+
+def getCache():
+  global _cache
+  if _cache is None:
+    _cache = MetadataCache(settings.metadata_cache_path, settings.metadata_cache_ttl, \
+      settings.metadata_cache_negative_ttl, settings.metadata_cache_max_items)
+  return _cache
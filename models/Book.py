@@ -15,13 +15,12 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #==============================================================================
 
-from fastapi import Path
+from fastapi import Path, HTTPException
 from typing import Union, Annotated, List
-from pydantic import BaseModel, Field
-from db import getMyDB
+from pydantic import BaseModel, Field, ValidationError
 from config import settings
 from models import Location, Position
-import tools
+import asyncio, bookapi, codecs, csv, db, io, json, metacache, search, tools
 
 class Book(BaseModel):
     # id_user: int
@@ -68,170 +67,385 @@ class BookSearch(BaseModel):
     list_title: Annotated[Union[str, None], Path(title="Bookshelf name")] = Field(examples=["Biblio Demo"])
     items: List[BookItem]   
 
-async def getBooksForShelf(numshelf, device, user):
-    ''' Get list of books order by positions '''
+class BookImportError(BaseModel):
+    line: Annotated[int, Path(title="Line number in uploaded file")] = Field(examples=["12"])
+    error: str
+
+class BookImport(BaseModel):
+    imported: int
+    book_ids: List[int]
+    errors: List[BookImportError]
+
+async def getBooksForShelf(mydb, numshelf, device, user):
+    ''' Get list of books order by positions : all rows are loaded at once then split by shelf '''
     shelfs = range(1,device['nb_lines']+1)
     if numshelf:
         shelfs = [numshelf]
+    books = await getBooksForRows(mydb, device['id'], numshelf)
+    items = await formatBookList(mydb, books, user['id'], device['id'])
+    items = {item['book']['id']: item for item in items}
+    booksByRow = {}
+    for book in books:
+        if book['id'] in items:
+            booksByRow.setdefault(book['row'], []).append(items[book['id']])
+    # get stats elements for shelfs
+    statsByRow = {stat['row']: stat for stat in await statsRows(mydb, device['id'], numshelf)}
     elements = []
     for shelf in shelfs:
-        items = []
-        books = getBooksForRow(device['id'], shelf)
-        if books:
-            items = formatBookList(books, user['id'], device['id'])
-        # get stats elements for shelf
-        statBooks = statsBooks(device['id'], shelf)
-        statPositions = statsPositions(device['id'], shelf)
+        stat = statsByRow.get(shelf, {'nbbooks': 0, 'totpos': None})
         positionRate = 0
-        if statPositions['totpos'] != None:
-            positionRate = round((statPositions['totpos']/device['nb_cols'])*100)
-        stats = {'nbbooks':statBooks['nbbooks'], 'positionRate':positionRate}            
-        elements.append({'numshelf': shelf, 'items': items, 'stats': stats})
+        if stat['totpos'] != None:
+            positionRate = round((stat['totpos']/device['nb_cols'])*100)
+        stats = {'nbbooks':int(stat['nbbooks'] or 0), 'positionRate':positionRate}
+        elements.append({'numshelf': shelf, 'items': booksByRow.get(shelf, []), 'stats': stats})
     return elements
 
-async def getSearchResults(app_id, user_id, query):
+async def getSearchResults(mydb, app_id, user_id, query, limit = None, offset = 0):
     items = []
+    results = []
     if len(query) > 2:
-        results = searchBook(app_id, query)
+        results = await searchBook(mydb, app_id, query, limit, offset)
     if results:
-        items = formatBookList(results, user_id, app_id)
+        items = await formatBookList(mydb, results, user_id, app_id)
     return items
 
-def formatBookList(books, user_id, app_id):
+async def formatBookList(mydb, books, user_id, app_id):
+    ''' Build items for books list : books, positions and requests are loaded for whole list at once '''
     items = []
+    if not books:
+        return items
+    rows = await getBooksWithPositions(mydb, [element['id'] for element in books], user_id, app_id)
+    rows = {row['id']: row for row in rows}
     for element in books:
-        book = getBook(element['id'], user_id)
+        row = rows.get(element['id'])
+        if row is None:
+            continue
+        book = {field: row[field] for field in ('id', 'isbn', 'title', 'subtitle', 'keywords', 'author', 'editor', 'year', \
+            'pages', 'reference', 'description', 'width')}
         position = None
         # merge position for element if needed
         if 'position' not in element:
-            position = Position.getPositionForBook(app_id, element['id'])
+            if row['position'] is None:
+                continue
+            position = {field: row[field] for field in Position.Position.model_fields}
             element.update(position)
         book.update({'url':'/books/item/'+str(element['id']), 'borrowed':element['borrowed']})
-        requested = Location.getRequestForPosition(app_id, element['position'], element['row'])
-        if requested:
+        if row['requested']:
             book.update({'requested': True})
         items.append({'led_column': element['led_column'], 'book': book, 'address': position})
     return items
 
-def getBook(book_id, user_id):
-    mydb = getMyDB()
+async def getBooksWithPositions(mydb, book_ids, user_id, app_id):
+    ''' Get books with their position in app and pending location request, in one query '''
+    ids = list(set(book_ids))
+    placeholders = ', '.join(['%s'] * len(ids))
+    return await db.fetchAll(mydb, "SELECT bb.`id`, bb.`isbn`, bb.`title`, bb.`subtitle`, bb.`ocr_keywords` as keywords, bb.`author`, \
+        bb.`editor`, bb.`year`, bb.`pages`, bb.`reference`, bb.`description`, bb.`width`, bp.`id_app`, bp.`id_item`, bp.`item_type`, \
+        bp.`position`, bp.`row`, bp.`range`, bp.`shiftpos`, bp.`led_column`, bp.`borrowed`, \
+        EXISTS(SELECT 1 FROM biblio_request br WHERE br.id_app=bp.id_app and br.`column`=bp.`position` \
+          and br.`row`=bp.`row` and br.`action`='add') as requested \
+        FROM biblio_book bb LEFT JOIN biblio_position bp ON bp.id_item=bb.id and bp.item_type='book' and bp.id_app=%s \
+        WHERE bb.id_user=%s and bb.id IN (" + placeholders + ")", (app_id, user_id, *ids))
+
+def getBook(mydb, book_id, user_id):
     cursor = mydb.cursor(dictionary=True)
     cursor.execute("SELECT `id`, `isbn`, `title`, `subtitle`, `ocr_keywords` as keywords, `author`, `editor`, `year`, `pages`, \
         `reference`, `description`, `width` FROM biblio_book where id=%s and id_user=%s",(book_id, user_id))
     return cursor.fetchone()
 
-def getBookByISBN(isbn, ref, user_id):
-    mydb = getMyDB()
+def getBooks(mydb, book_ids, user_id):
+    cursor = mydb.cursor(dictionary=True)
+    cursor.execute("SELECT `id`, `isbn`, `title`, `subtitle`, `ocr_keywords` as keywords, `author`, `editor`, `year`, `pages`, \
+        `reference`, `description`, `width` FROM biblio_book where id IN (" + ', '.join(['%s'] * len(book_ids)) + ") and id_user=%s", \
+        (*book_ids, user_id))
+    return cursor.fetchall()
+
+def getBookByISBN(mydb, isbn, ref, user_id):
     cursor = mydb.cursor(dictionary=True)
     cursor.execute("SELECT id FROM biblio_book WHERE (`isbn`=%s or `reference`=%s) and `id_user`=%s", (isbn, ref, user_id))
     return cursor.fetchone()
 
-def getBooksForRow(app_id, numrow):
-    mydb = getMyDB()
-    cursor = mydb.cursor(dictionary=True)
-    cursor.execute("SELECT bb.`id`, bb.`title`, bb.`author`, bp.`position`, bp.`range`, bp.`row`, bp.`item_type`, bp.`led_column`,\
+async def getBooksForRows(mydb, app_id, numrow = None):
+    ''' Get books for all rows of app, or for given row '''
+    where = ''
+    params = [app_id]
+    if numrow:
+        where = " and bp.`row`=%s"
+        params.append(numrow)
+    return await db.fetchAll(mydb, "SELECT bb.`id`, bb.`title`, bb.`author`, bp.`position`, bp.`range`, bp.`row`, bp.`item_type`, bp.`led_column`,\
         bp.`borrowed` FROM biblio_book bb inner join biblio_position bp on bp.id_item=bb.id and bp.item_type='book'\
-        inner join biblio_app app on bp.id_app=app.id where app.id=%s and bp.row=%s order by row, led_column",(app_id,numrow))
-    #print(cursor._executed)
-    return cursor.fetchall()
+        where bp.id_app=%s" + where + " order by row, led_column", params)
 
-def statsBooks(app_id, numrow):
-    """Get books quantity by row for module"""
-    mydb = getMyDB()
-    cursor = mydb.cursor(dictionary=True)
-    cursor.execute("SELECT bp.`row`, count(bb.`id`) as nbbooks FROM biblio_book bb \
-        inner join biblio_position bp on bp.id_item=bb.id and bp.item_type='book' \
-        inner join biblio_app app on bp.id_app=app.id where app.id=%s and bp.`row`=%s", (app_id, numrow))
-    return cursor.fetchone()
+async def statsRows(mydb, app_id, numrow = None):
+    """Get books quantity and sum of positions ranges by row for module"""
+    where = ''
+    params = [app_id]
+    if numrow:
+        where = " and bp.`row`=%s"
+        params.append(numrow)
+    return await db.fetchAll(mydb, "SELECT bp.`row`, count(bb.`id`) as nbbooks, sum(bp.`range`) as totpos \
+        FROM biblio_position bp left join biblio_book bb on bb.id=bp.id_item and bp.item_type='book' \
+        where bp.id_app=%s" + where + " group by bp.`row`", params)
 
-def newBook(book, user_id, app_id):
-    mydb = getMyDB()
+def newBook(mydb, book, user_id, app_id):
     cursor = mydb.cursor(dictionary=True)
     cursor.execute("INSERT INTO biblio_book (`id_user`, `id_app`, `isbn`, `title`, `subtitle`, `ocr_keywords`, `author`, `editor`, `year`, `pages`, \
         `reference`, `description`, `width`) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)", (user_id, app_id, \
         book['isbn'], book['title'].strip(), book['subtitle'], book['keywords'], book['author'], book['editor'], book['year'], \
         book['pages'], book['reference'], book['description'], book['width']))
-    mydb.commit()
     cursor.execute("SELECT LAST_INSERT_ID() as id")
     bookId = cursor.fetchone()
     book.update(bookId)
+    search.invalidateBook(mydb, book['id'])
     return book
 
-def updateBook(book, book_id, user_id, app_id):
-    mydb = getMyDB()
+def newBooks(mydb, books, user_id, app_id):
+    ''' Insert list of books in one statement : ids are set in books dicts '''
+    if not books:
+        return books
+    cursor = mydb.cursor(dictionary=True)
+    cursor.executemany("INSERT INTO biblio_book (`id_user`, `id_app`, `isbn`, `title`, `subtitle`, `ocr_keywords`, `author`, `editor`, `year`, `pages`, \
+        `reference`, `description`, `width`) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)", [(user_id, app_id, \
+        book['isbn'], book['title'].strip(), book['subtitle'], book['keywords'], book['author'], book['editor'], book['year'], \
+        book['pages'], book['reference'], book['description'], book['width']) for book in books])
+    # executemany sends one multi rows insert : LAST_INSERT_ID is the id of its first row, next ones are read back
+    # since ids of concurrent inserts may be interleaved (innodb_autoinc_lock_mode=2)
+    cursor.execute("SELECT LAST_INSERT_ID() as id")
+    firstId = cursor.fetchone()['id']
+    cursor.execute("SELECT id, isbn FROM biblio_book WHERE id>=%s and id_user=%s and id_app=%s ORDER BY id LIMIT %s", \
+        (firstId, user_id, app_id, len(books)))
+    rows = cursor.fetchall()
+    if len(rows) != len(books) or any((row['isbn'] or None) != (book['isbn'] or None) for row, book in zip(rows, books)):
+        raise HTTPException(status_code=409, detail="Books were saved concurrently, please retry")
+    for row, book in zip(rows, books):
+        book['id'] = row['id']
+    search.invalidateBooks(mydb, [book['id'] for book in books])
+    return books
+
+def getBooksByISBNs(mydb, isbns, refs, user_id):
+    ''' Get books of user matching one of isbns or references, in one query '''
+    isbns = list(set(isbns)) or [None]
+    refs = list(set(refs)) or [None]
+    cursor = mydb.cursor(dictionary=True)
+    cursor.execute("SELECT id, isbn, reference FROM biblio_book WHERE (`isbn` IN (" + ', '.join(['%s'] * len(isbns)) + ") \
+        or `reference` IN (" + ', '.join(['%s'] * len(refs)) + ")) and `id_user`=%s", (*isbns, *refs, user_id))
+    return cursor.fetchall()
+
+async def parseBooksStream(chunks, fmt):
+    ''' Parse uploaded books file while it is received : yield (line number, row, error) for each record
+    csv : first line is header with Book fields, ndjson : one json object by line '''
+    decoder = codecs.getincrementaldecoder('utf-8-sig')(errors='replace')
+    parser = parseRecords(fmt)
+    next(parser)
+    buffer = ''
+    async for chunk in chunks:
+        records, buffer = splitRecords(buffer + decoder.decode(chunk), fmt)
+        for parsed in parser.send(records):
+            yield parsed
+    for parsed in parser.send(buffer + decoder.decode(b'', final=True)):
+        yield parsed
+
+def parseRecords(fmt):
+    ''' Generator receiving blocks of complete records, sending back parsed rows : keeps csv header and line count '''
+    line = 0
+    header = None
+    parsed = []
+    while True:
+        records = yield parsed
+        parsed = []
+        if not records:
+            continue
+        if fmt == 'csv':
+            for record in csv.reader(io.StringIO(records)):
+                line += 1
+                if not any(field.strip() for field in record):
+                    continue
+                if header is None:
+                    header = [field.strip().lower() for field in record]
+                elif len(record) != len(header):
+                    parsed.append((line, None, f"Expected {len(header)} fields, found {len(record)}"))
+                else:
+                    parsed.append((line, dict(zip(header, record)), None))
+        else:
+            for record in records.split('\n'):
+                line += 1
+                if not record.strip():
+                    continue
+                try:
+                    row = json.loads(record)
+                except ValueError as e:
+                    parsed.append((line, None, f"Invalid json: {e}"))
+                    continue
+                if isinstance(row, dict):
+                    parsed.append((line, row, None))
+                else:
+                    parsed.append((line, None, "Expected a json object"))
+
+def splitRecords(buffer, fmt):
+    ''' Split buffer after its last complete record : csv newlines inside quoted fields don't end a record '''
+    end = -1
+    if fmt == 'csv':
+        quoted = False
+        for i, char in enumerate(buffer):
+            if char == '"':
+                quoted = not quoted
+            elif char == '\n' and not quoted:
+                end = i
+    else:
+        end = buffer.rfind('\n')
+    if end < 0:
+        return '', buffer
+    return buffer[:end], buffer[end+1:]
+
+def importBooks(mydb, rows, user_id, app_id, errors, seen):
+    ''' Validate and save a chunk of parsed rows with a few bulk queries : return new books
+    errors by line are appended to errors, seen holds isbns and references of file already imported '''
+    books = []
+    for line, row in rows:
+        row = {key: (value.strip() if isinstance(value, str) else value) for key, value in row.items() if key}
+        row = {key: value for key, value in row.items() if value not in ('', None)}
+        categories = row.pop('categories', None)
+        if isinstance(categories, list):
+            categories = ','.join(str(category) for category in categories)
+        try:
+            book = Book(**row).dict()
+        except ValidationError as e:
+            errors.append({'line': line, 'error': '; '.join(f"{'.'.join(str(loc) for loc in error['loc'])}: {error['msg']}" \
+                for error in e.errors())})
+            continue
+        if book['width'] is None:
+            book['width'] = round(tools.setBookWidth(book['pages']))
+        book.update({'categories': categories, 'line': line})
+        books.append(book)
+    # skip books already saved for user, or present twice in file
+    isbns = [book['isbn'] for book in books if book['isbn']]
+    refs = [book['reference'] for book in books if book['reference']]
+    for book in getBooksByISBNs(mydb, isbns, refs, user_id) if isbns or refs else []:
+        seen['isbn'].add(book['isbn'])
+        seen['reference'].add(book['reference'])
+    saved = []
+    for book in books:
+        if (book['isbn'] and book['isbn'] in seen['isbn']) or (book['reference'] and book['reference'] in seen['reference']):
+            errors.append({'line': book['line'], 'error': f"A book already exists with isbn {book['isbn']} or reference {book['reference']}"})
+            continue
+        seen['isbn'].add(book['isbn'])
+        seen['reference'].add(book['reference'])
+        saved.append(book)
+    return newBooks(mydb, saved, user_id, app_id)
+
+def setImportPositions(mydb, books, device):
+    ''' Put books after last saved position, as POST /books/referencer with force_position does '''
+    lastPos = Position.getLastSavedPosition(mydb, device['id'])
+    if lastPos:
+        position = lastPos['position']
+        row = lastPos['row']
+        led_column = lastPos['led_column'] + lastPos['range']
+    else:
+        position = 0
+        row = 1
+        led_column = 0
+    positions = []
+    for book in books:
+        interval = tools.setBookInterval(book, device['leds_interval'])
+        position += 1
+        positions.append({'id_item': book['id'], 'position': position, 'row': row, 'range': interval, 'led_column': led_column})
+        led_column += interval
+    Position.bumpRowVersions(mydb, device['id'], [row])
+    Position.setPositions(mydb, device['id'], positions)
+
+def updateBook(mydb, book, book_id, user_id, app_id):
     cursor = mydb.cursor()
     cursor.execute("UPDATE biblio_book SET `isbn`=%s, `title`=%s, `subtitle`=%s, `author`=%s, `editor`=%s, `year`=%s, `pages`=%s, \
       `reference`=%s, `description`=%s, `width`=%s, `ocr_keywords`=%s  WHERE id=%s", (book['isbn'], book['title'].strip(), \
        book['subtitle'], book['author'], book['editor'], book['year'], book['pages'], book['reference'], \
        book['description'], book['width'], book['keywords'], book_id))
-    mydb.commit()
-    return getBook(book_id, user_id)
+    search.invalidateBook(mydb, book_id)
+    return getBook(mydb, book_id, user_id)
 
-def getStaticPositions(app_id, numrow):
-    mydb = getMyDB()
+def getStaticPositions(mydb, app_id, numrow):
     cursor = mydb.cursor(dictionary=True)
     cursor.execute("SELECT `led_column`, `range`, position, item_type FROM `biblio_position` \
         WHERE item_type='static' AND id_app=%s AND `row`=%s ORDER BY `position`", (app_id, numrow))
     return cursor.fetchall()
 
-def statsPositions(app_id, numrow):
-    """stats book positions by row for module"""
-    mydb = getMyDB()
-    cursor = mydb.cursor(dictionary=True)
-    cursor.execute("SELECT bp.`row`, sum(bp.range) as totpos FROM biblio_position bp \
-        inner join biblio_app app on bp.id_app=app.id \
-        where app.id=%s and bp.`row`=%s", (app_id, numrow))#item_type='book' and inner join biblio_book bb on bb.id=bp.id_item \ 
-    return cursor.fetchone()
-
-async def getAuthorsForApp(app_id, letter):
-    mydb = getMyDB()
-    cursor = mydb.cursor(dictionary=True)
+async def getAuthorsForApp(mydb, app_id, letter):
     searchLetter = letter+"%"
-    cursor.execute("SELECT bt.id, bt.tag, count(bb.id) as nbnode FROM `biblio_tags` bt \
+    return await db.fetchAll(mydb, "SELECT bt.id, bt.tag, count(bb.id) as nbnode FROM `biblio_tags` bt \
         INNER JOIN biblio_tag_node btn ON bt.id = btn.id_tag \
         INNER JOIN biblio_book bb ON btn.id_node = bb.id \
         INNER JOIN biblio_position bp ON bb.id = bp.id_item and bp.item_type='book' \
         WHERE bt.id_taxonomy=2 and bp.id_app=%s and bt.tag like %s GROUP BY bt.id ORDER BY bt.tag", (app_id, searchLetter))
-    return cursor.fetchall()
 
-async def getCategoriesForApp(id_user, id_app):
-    mydb = getMyDB()
-    cursor = mydb.cursor(dictionary=True)
-    cursor.execute("SELECT bt.id, bt.tag, btu.color, count(bb.id) as nbnode FROM `biblio_tags` bt \
+async def getCategoriesForApp(mydb, id_user, id_app):
+    return await db.fetchAll(mydb, "SELECT bt.id, bt.tag, btu.color, count(bb.id) as nbnode FROM `biblio_tags` bt \
     INNER JOIN biblio_tag_node btn ON bt.id = btn.id_tag \
     INNER JOIN biblio_tag_user btu ON btn.id_tag = btu.id_tag \
     INNER JOIN biblio_book bb ON btn.id_node = bb.id \
     INNER JOIN biblio_position bp ON bb.id = bp.id_item and bp.item_type='book'\
     WHERE bt.id_taxonomy=1 and bp.id_app=%s and btu.id_user=%s GROUP BY bt.id ORDER BY bt.tag", (id_app, id_user))
-    return cursor.fetchall()
 
-def updateAppBook(app_id, item_id) :
-  mydb = getMyDB()
+def updateAppBook(mydb, app_id, item_id) :
+  # before update : previous app of book is refreshed too
+  search.invalidateBook(mydb, item_id, [app_id])
   cursor = mydb.cursor()
   cursor.execute("UPDATE biblio_book SET id_app=%s WHERE id=%s", (app_id, item_id))
-  mydb.commit()
-
-def searchBook(app_id, keyword) :
-  searchTerm = "%"+keyword+"%"
-  mydb = getMyDB()
-  cursor = mydb.cursor(dictionary=True)
-  cursor.execute("SELECT * FROM biblio_search where id_app=%s and \
-    (author like %s or title like %s or tags like %s)", (app_id, searchTerm, searchTerm, searchTerm))
-  return cursor.fetchall()
-
-def searchBookApi(query, api, ref = None):
-  import requests
+
+def updateAppBooks(mydb, app_id, book_ids) :
+  if not book_ids:
+    return
+  search.invalidateBooks(mydb, book_ids, [app_id])
+  cursor = mydb.cursor()
+  cursor.execute("UPDATE biblio_book SET id_app=%s WHERE id IN (" + ', '.join(['%s'] * len(book_ids)) + ")", (app_id, *book_ids))
+
+async def searchBook(mydb, app_id, keyword, limit = None, offset = 0) :
+  '''ranked search on author, title and tags with in memory index of app'''
+  index = await search.getIndex(mydb, app_id)
+  return index.search(keyword, limit, offset)
+
+async def searchBookApi(isbn, api, ref = None):
+  ''' Get raw data from books api for isbn, or google books volume for given ref '''
+  if ref is not None:
+    return await bookapi.getVolume(ref)
+  return await bookapi.searchIsbn(api, isbn)
+
+async def referenceBooks(isbn, search_api):
+  ''' Search books for isbn with given api, or with all apis concurrently ('all') and merge results '''
+  apis = bookapi.providers if search_api == 'all' else [api for api in bookapi.providers if api == search_api]
+  responses = await asyncio.gather(*[getBookApiResults(isbn, api) for api in apis], return_exceptions=True)
+  res = []
+  seen = set()
+  errors = []
+  for api, books in zip(apis, responses):
+    if isinstance(books, bookapi.ProviderError):
+      errors.append(books)
+      continue
+    if isinstance(books, BaseException):
+      raise books
+    for book in books:
+      key = (book['isbn'], book['title'].strip().lower())
+      if key not in seen:
+        seen.add(key)
+        res.append(book)
+  # fail only when no provider could answer
+  if errors and len(errors) == len(apis):
+    raise errors[0]
+  return res
+
+async def getBookApiResults(isbn, api):
+  ''' Formatted books for isbn from api, kept in metadata cache '''
+  async def load():
+    data = await searchBookApi(isbn, api)
+    return formatBookApiResults(api, data, isbn)
+  return await metacache.getCache().get(api, isbn, load)
+
+def formatBookApiResults(api, data, isbn):
   if api == 'googleapis':
-    url = "https://www.googleapis.com/books/v1/volumes?key="+settings.google_book_api_key+"&q="
+    return [formatBookApi('googleapis', item, isbn) for item in data.get('items', [])]
   if api == 'openlibrary':
-    url = "https://openlibrary.org/api/books?format=json&jscmd=data&bibkeys="
-  if ref is not None:
-    url = "https://www.googleapis.com/books/v1/volumes/"
-    query = ref
-  data = {}
-  r = requests.get(url + query)
-  data = r.json()
-  return data
+    query = "ISBN:"+isbn
+    if query in data:
+      return [formatBookApi('openlibrary', data[query], isbn)]
+  return []
 
 def formatBookApi(api, data, isbn):
   bookapi = {}
@@ -19,7 +19,6 @@ from fastapi import Path
 from typing import Union, Annotated, List
 from pydantic import BaseModel, Field
 from datetime import datetime
-from db import getMyDB
 from config import settings
 
 class CustomCode(BaseModel):
@@ -38,15 +37,13 @@ class NativeEffects(BaseModel):
     list_title: Annotated[Union[str, None], Path(title="Native effects")] = Field(examples=["Effects for Biblio Demo"])
     items: List[str]
 
-def getCustomCode(code_id, app_id, user_id):
-    mydb = getMyDB()
+def getCustomCode(mydb, code_id, app_id, user_id):
     cursor = mydb.cursor(dictionary=True)
     cursor.execute("SELECT id, title, description, customvars, date_add, date_upd, published FROM biblio_customcode \
         where id_user=%s and id_app=%s and id=%s", (user_id, app_id, code_id))
     return cursor.fetchone()
 
-def getCustomcodes(app_id, user_id, published_only = False) :
-    mydb = getMyDB()
+def getCustomcodes(mydb, app_id, user_id, published_only = False) :
     cursor = mydb.cursor(dictionary=True)
     if published_only == True :
         cursor.execute("SELECT id, title, description, customvars, date_add, date_upd, published \
@@ -58,8 +55,7 @@ def getCustomcodes(app_id, user_id, published_only = False) :
             and description='blockly workspace' order by `position`", (user_id, app_id))
     return cursor.fetchall()
 
-def getCustomcolors(app_id, user_id) :
-    mydb = getMyDB()
+def getCustomcolors(mydb, app_id, user_id) :
     cursor = mydb.cursor(dictionary=True)
     cursor.execute("SELECT id, title, coordinates, date_add, date_upd FROM biblio_customcolors \
         where id_user=%s and id_app=%s", (user_id, app_id))
@@ -17,7 +17,6 @@
 
 from typing import Union
 from pydantic import BaseModel
-from db import getMyDB
 
 
 class DeviceToken(BaseModel):
@@ -39,22 +38,19 @@ class Device(BaseModel):
     mac: Union[str, None] = None
     total_leds: Union[int, None] = None
 
-def getDeviceForUuid(uuid):
-  mydb = getMyDB()
+def getDeviceForUuid(mydb, uuid):
   cursor = mydb.cursor(dictionary=True)
   cursor.execute("SELECT * FROM biblio_app WHERE id_ble=%s", [uuid])
   return cursor.fetchone()
 
-def getUserForUuid(uuid):
-  mydb = getMyDB()
+def getUserForUuid(mydb, uuid):
   cursor = mydb.cursor(dictionary=True)
   cursor.execute("SELECT bu.id, bu.email, bu.password, bu.firstname, ba.id as id_app, ba.arduino_name FROM biblio_user bu \
     INNER JOIN biblio_user_app bua ON bu.id = bua.id_user \
     INNER JOIN biblio_app ba ON bua.id_app = ba.id WHERE ba.id_ble=%s", [uuid])
   return cursor.fetchone()
 
-def getDevicesForUser(user_id):
-  mydb = getMyDB()
+def getDevicesForUser(mydb, user_id):
   cursor = mydb.cursor(dictionary=True)
   cursor.execute("SELECT ba.*, TO_BASE64(ba.id_ble) as id_ble_encode, bu.id as user_id FROM biblio_app ba \
     INNER JOIN biblio_user_app bua ON bua.id_app = ba.id \
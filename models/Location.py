@@ -18,11 +18,8 @@
 from fastapi import Path, HTTPException
 from typing import Union, Annotated, List
 from pydantic import BaseModel, Field
-from db import getMyDB
 from models import Book, Position
-import tools
-
-mydb = getMyDB()
+import broker, db, tools
 
 # biblio_app table definition
 
@@ -57,66 +54,65 @@ class Position(BaseModel):
   borrowed: Union[bool, None] = False
 
 
-def newRequest(app_id, node_id, row, column, interval, led_column, node_type, client, action, date_time, tag_id = None, color = None) :
-  mydb = getMyDB()
+def newRequest(mydb, app_id, node_id, row, column, interval, led_column, node_type, client, action, date_time, tag_id = None, color = None) :
   cursor = mydb.cursor(dictionary=True)
   cursor.execute("INSERT INTO biblio_request (`id_app`, `id_node`, `node_type`, `row`, `column`, `range`, \
     `led_column`, `client`, `action`, `id_tag`, `color`) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) \
     ON DUPLICATE KEY UPDATE `date_add`=%s, `range`=%s, `led_column`=%s, `client`=%s, `action`=%s, `color`=%s, `sent`=0", (app_id, node_id, node_type,\
      row, column, interval, led_column, client, action, tag_id, color, date_time, interval, led_column, \
      client, action, color))
-  mydb.commit()
+  broker.getBroker().notify(mydb, app_id)
 
-def getRequests(app_id, action, source = None):
-  '''for requests coming from mobile, we don't need to send location generated on mobile : events are already sent to device'''  
-  where = ''
-  if action == 'add':
-    where += " and `sent`=0"
-  if source == 'mobile':
-    where += " and `client`='server'"
-  mydb = getMyDB()
-  cursor = mydb.cursor(dictionary=True)
-  cursor.execute("SELECT * FROM biblio_request where id_app=%s and `action`=%s" + where, (app_id, action))
-  #print(cursor._executed)
-  return cursor.fetchall()
+def newRequests(mydb, app_id, addresses, client, action, date_time, tag_id = None, color = None) :
+  '''save requests for books at addresses (from getAddressesForBooks) with one multi-row upsert'''
+  if not addresses:
+    return
+  cursor = mydb.cursor()
+  cursor.executemany("INSERT INTO biblio_request (`id_app`, `id_node`, `node_type`, `row`, `column`, `range`, \
+    `led_column`, `client`, `action`, `id_tag`, `color`, `date_add`) VALUES (%s, %s, 'book', %s, %s, %s, %s, %s, %s, %s, %s, %s) \
+    ON DUPLICATE KEY UPDATE `date_add`=VALUES(`date_add`), `range`=VALUES(`range`), `led_column`=VALUES(`led_column`), \
+    `client`=VALUES(`client`), `action`=VALUES(`action`), `color`=VALUES(`color`), `sent`=0", \
+    [(app_id, address['id_item'], address['row'], address['position'], address['range'], address['led_column'], \
+    client, action, tag_id, color, date_time) for address in addresses])
+  broker.getBroker().notify(mydb, app_id)
 
-def getRequestForTag(app_id, tag_id) :
-  mydb = getMyDB()
+def getAddressesForBooks(mydb, app_id, user_id, book_ids) :
+  '''positions of books in app, with their title'''
+  if not book_ids:
+    return []
   cursor = mydb.cursor(dictionary=True)
-  cursor.execute("SELECT count(*) as nb_requests FROM biblio_request where id_app=%s and `id_tag`=%s \
-    and `action`='add'", (app_id, tag_id))
-  return cursor.fetchone()
+  cursor.execute("SELECT bp.*, bb.title FROM biblio_position bp INNER JOIN biblio_book bb ON bb.id = bp.id_item \
+    WHERE bp.id_app=%s and bp.item_type='book' and bb.id_user=%s and bp.id_item IN (" + ', '.join(['%s'] * len(book_ids)) + ")", \
+    (app_id, user_id, *book_ids))
+  return cursor.fetchall()
 
-def getRequestForPosition(app_id, position, row) :
-  mydb = getMyDB()
+def getAddressesForTag(mydb, app_id, user_id, tag_id) :
+  '''positions of books of tag in app, with their title'''
   cursor = mydb.cursor(dictionary=True)
-  cursor.execute("SELECT * FROM biblio_request where id_app=%s and `column`=%s and `row`=%s \
-    and `action`='add'", (app_id, position, row))
-  return cursor.fetchone()
+  cursor.execute("SELECT bp.*, bb.title FROM biblio_tag_node btn \
+    INNER JOIN biblio_book bb ON bb.id = btn.id_node \
+    INNER JOIN biblio_position bp ON bp.id_item = bb.id and bp.item_type='book' and bp.id_app=bb.id_app \
+    WHERE btn.id_tag=%s and btn.node_type='book' and bb.id_app=%s and bb.id_user=%s", (tag_id, app_id, user_id))
+  return cursor.fetchall()
 
-def setRequestSent(app_id, node_id, sent) :
-  mydb = getMyDB()
-  cursor = mydb.cursor()
-  cursor.execute("UPDATE biblio_request SET `sent`=%s WHERE `id_app`=%s and `id_node`=%s \
-    and `node_type` in ('book', 'static', 'reset')", (sent, app_id, node_id))
-  mydb.commit()
+async def getRequestsForEvents(mydb, app_id):
+  '''add requests not sent yet, remove and reset requests of app, to be partitioned by action'''
+  return await db.fetchAll(mydb, "SELECT * FROM biblio_request where id_app=%s and `action` IN ('add', 'remove', 'reset') \
+    and (`action`<>'add' or `sent`=0)", (app_id,))
 
-def removeRequest(app_id, led_column, row) :
-  mydb = getMyDB()
-  cursor = mydb.cursor()
-  cursor.execute("DELETE FROM biblio_request where id_app=%s and `led_column`=%s and `row`=%s", (app_id, led_column,row)) 
-  mydb.commit()
+async def setRequestsSent(mydb, app_id, node_ids, sent) :
+  if not node_ids:
+    return
+  placeholders = ', '.join(['%s'] * len(node_ids))
+  await db.execute(mydb, "UPDATE biblio_request SET `sent`=%s WHERE `id_app`=%s and `id_node` IN (" + placeholders + ") \
+    and `node_type` in ('book', 'static', 'reset')", [sent, app_id] + list(node_ids))
 
-def removeResetRequest(app_id) :
-  mydb = getMyDB()
-  cursor = mydb.cursor()
-  cursor.execute("DELETE FROM biblio_request where id_app=%s and `action`='reset'",[app_id])
-  mydb.commit()
+async def removeResetRequest(mydb, app_id) :
+  await db.execute(mydb, "DELETE FROM biblio_request where id_app=%s and `action`='reset'",[app_id])
 
-def setRequestForRemove(app_id) :
+def setRequestForRemove(mydb, app_id) :
   now = tools.getNow()
-  mydb = getMyDB()
   cursor = mydb.cursor()
   cursor.execute("UPDATE biblio_request SET `action`='remove', `client`='mobile', `date_add`=%s WHERE `id_app`=%s \
     and action IN ('add', 'reset')", (now.strftime("%Y-%m-%d %H:%M:%S"), app_id))
-  mydb.commit()
+  broker.getBroker().notify(mydb, app_id)
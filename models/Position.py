@@ -15,14 +15,12 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #==============================================================================
 
+from contextlib import asynccontextmanager, AsyncExitStack
 from fastapi import Path, HTTPException
-from typing import Union, Annotated
+from typing import Union, Annotated, List, Literal
 from pydantic import BaseModel
-from db import getMyDB
 from models import Book
-import tools
-
-mydb = getMyDB()
+import asyncio, layout, tools, weakref
 
 # biblio_app table definition
 
@@ -30,48 +28,61 @@ class Position(BaseModel):
     id_app: int
     id_item: int
     item_type: Annotated[str, Path(title="Type of item")] = "book"
-    position: int
+    position: Annotated[int, Path(title="Item position in row")]
     row: int
     range: int
     shiftpos: Union[int, None] = None
-    led_column: Annotated[int, Path(title="Defined by application", ge=1)] = 1
+    led_column: Annotated[int, Path(title="Defined by application, from 0", ge=0)] = 1
     borrowed: Union[bool, None] = False
 
-def newPositionForBook(device, book_id, request):
+# positions sent by application start at 1, rows saved before may still hold 0 and are read as Position
+class PositionEdit(Position):
+    position: Annotated[int, Path(title="Item position in row, from 1", ge=1)]
+
+class ShelfOperation(BaseModel):
+    op: Annotated[Literal['move', 'insert', 'remove'], Path(title="Operation on row order")]
+    id_item: int
+    index: Annotated[Union[int, None], Path(title="Target index in row order, from 1 : required for move and insert", ge=1)] = None
+
+class ShelfEdit(BaseModel):
+    version: Annotated[int, Path(title="Row version the operations apply to")]
+    operations: List[ShelfOperation]
+
+def newPositionForBook(mydb, device, book_id, request):
   '''save new position for given item_id and compute led's column number'''
-  position = getPositionForBook(device['id'], book_id)
+  # prevent create position for item in other bookshelf
+  if int(device['id']) != int(request['id_app']):
+    raise HTTPException(
+        status_code=400,
+        detail=f"A position for item {book_id} exists in app id {device['id']} different than requested {request['id_app']}"
+    )
+  shelf = lockLayout(mydb, device['id'], request['row'])
+  position = getPositionForBook(mydb, device['id'], book_id, for_update=True)
   # return error if position already exists
   if position:
     raise HTTPException(
         status_code=400,
         detail=f"A position already exists for book {book_id}"
     )
-  # prevent create position for item in other bookshelf
-  if int(device['id']) != int(request['id_app']):
+  # prevent create position doublon
+  taken = shelf.itemsAt(int(request['position']))
+  if taken:
     raise HTTPException(
         status_code=400,
-        detail=f"A position for item {book_id} exists in app id {device['id']} different than requested {request['id_app']}"
+        detail=f"This position is already taken by item id {taken[0]}. If you want to use this postion for item {request['id_item']}, you must delete position for item id {taken[0]}, first."
     )
-  # prevent create position doublon
-  current_positions = getPositionsForShelf(device['id'], request['row'])
-  for position in current_positions:
-    if int(position['position']) == int(request['position']):
-      raise HTTPException(
-          status_code=400,
-          detail=f"This position is already taken by item id {position['id_item']}. If you want to use this postion for item {request['id_item']}, you must delete position for item id {position['id_item']}, first."
-      )
   #save new position
-  setPosition(device['id'], book_id, request['position'], request['row'], request['range'], request['item_type'], 0)
-  position = getPositionForBook(device['id'], book_id)
-  # compute led's number in shelf
-  led_columns_sum = getLedColumn(device['id'], book_id, position['row'], position['position'])
-  setLedColumn(device['id'], book_id, position['row'], led_columns_sum)
-  position = getPositionForBook(device['id'], book_id)
+  setPosition(mydb, device['id'], book_id, request['position'], request['row'], request['range'], request['item_type'], 0)
+  # compute led's number in shelf, for new book and books after it
+  shelf.insert(book_id, int(request['position']), request['range'], 0)
+  setLedColumns(mydb, device['id'], request['row'], shelf.ledColumns([book_id] + shelf.after(int(request['position']))))
+  position = getPositionForBook(mydb, device['id'], book_id)
   return position
 
-def removePositionForBook(device, book_id, request):
+def removePositionForBook(mydb, device, book_id, request):
   '''remove position for given book'''
-  position = getPositionForBook(device['id'], book_id)
+  shelf = lockLayout(mydb, device['id'], request['row'])
+  position = getPositionForBook(mydb, device['id'], book_id, for_update=True)
   # return error if position already exists
   if not position:
       raise HTTPException(
@@ -84,158 +95,377 @@ def removePositionForBook(device, book_id, request):
           status_code=400,
           detail=f"Item id {book_id} is indexed for app id {position['id_app']}: change your requested app id {request['id_app']}"
       )
-  deletePosition(device['id'], book_id, request['item_type'], request['row'])  
+  deletePosition(mydb, device['id'], book_id, request['item_type'], request['row'])  
+  # books after removed one move back on led strip
+  if book_id in shelf.items:
+    shelf.remove(book_id)
+    setLedColumns(mydb, device['id'], request['row'], shelf.ledColumns(shelf.after(position['position'])))
 
-def updatePositionsForShelf(user_id, numshelf, book_ids, device):
-  ''' Compute intervals and update positions for items in current shelf '''
-  sortable = []
-  shift_position = 0
+def newPositionsForBooks(mydb, device, requests):
+  '''save new positions for many books at once : conflicts checked with one query, led columns computed once by row'''
+  app_id = device['id']
+  errors = []
+  items = set()
+  places = set()
+  shelves = lockLayouts(mydb, app_id, {request['row'] for request in requests})
+  for request in requests:
+    if int(request['id_app']) != int(app_id):
+      errors.append(f"A position for item {request['id_item']} exists in app id {app_id} different than requested {request['id_app']}")
+    if request['item_type'] != 'book':
+      errors.append(f"Item {request['id_item']} must be a book")
+    if request['id_item'] in items:
+      errors.append(f"Item {request['id_item']} is requested twice")
+    if (request['row'], request['position']) in places:
+      errors.append(f"Position {request['position']} of row {request['row']} is requested twice")
+    items.add(request['id_item'])
+    places.add((request['row'], request['position']))
+  for conflict in getConflictingPositions(mydb, app_id, items, places):
+    if conflict['id_item'] in items:
+      errors.append(f"A position already exists for book {conflict['id_item']}")
+    else:
+      errors.append(f"Position {conflict['position']} of row {conflict['row']} is already taken by item id {conflict['id_item']}")
+  if errors:
+    raise HTTPException(status_code=400, detail=errors)
+  # compute led columns of new books and books after them
+  positions = [{'id_item': request['id_item'], 'position': request['position'], 'row': request['row'], \
+    'range': request['range'], 'shiftpos': 0} for request in requests]
+  rowsPositions = {}
+  for position in positions:
+    rowsPositions.setdefault(position['row'], []).append(position)
+  moved = {}
+  for row, rowPositions in rowsPositions.items():
+    shelf = shelves[row]
+    for position in rowPositions:
+      shelf.insert(position['id_item'], position['position'], position['range'], 0)
+    first = min(position['position'] for position in rowPositions)
+    for position in rowPositions:
+      position['led_column'] = shelf.ledColumn(position['id_item'])
+    moved[row] = shelf.ledColumns(item_id for item_id in shelf.after(first) if item_id not in items)
+  setPositions(mydb, app_id, positions)
+  Book.updateAppBooks(mydb, app_id, list(items))
+  for row, led_columns in moved.items():
+    setLedColumns(mydb, app_id, row, led_columns)
+  return getPositionsForBooks(mydb, app_id, list(items))
+
+def getConflictingPositions(mydb, app_id, item_ids, places):
+  ''' positions of app already saved for given items or at given (row, position) : locking read, rows are locked by caller '''
+  if not item_ids:
+    return []
+  cursor = mydb.cursor(dictionary=True)
+  cursor.execute("SELECT id_item, `row`, `position` FROM biblio_position WHERE id_app=%s and item_type<>'static' \
+    and (id_item IN (" + ', '.join(['%s'] * len(item_ids)) + ") or (`row`, `position`) IN (" + \
+    ', '.join(['(%s, %s)'] * len(places)) + ")) FOR UPDATE", (app_id, *item_ids, *[value for place in places for value in place]))
+  return cursor.fetchall()
+
+def getPositionsForBooks(mydb, app_id, book_ids):
+  cursor = mydb.cursor(dictionary=True)
+  cursor.execute("SELECT * FROM biblio_position where id_app=%s and item_type='book' and id_item IN (" + \
+    ', '.join(['%s'] * len(book_ids)) + ") ORDER BY `row`, `position`", (app_id, *book_ids))
+  return cursor.fetchall()
 
-  # build list of new positions with ids already recorded
-  new_positions = []
-  current_positions = []
-  bdd_positions = getPositionsForShelf(device['id'], numshelf)
-  if bdd_positions is not None:
-      for pos in bdd_positions:
-          current_positions.append(str(pos['id_item']))
+def updatePositionsForShelf(mydb, user_id, numshelf, book_ids, device, reset_positions = False, version = None):
+  ''' Compute intervals and update positions for items in current shelf : row is laid out in memory and saved at once '''
+  app_id = device['id']
+  book_ids = [str(book_id) for book_id in book_ids]
+  # rows books are taken from are locked with this one
+  other_rows = getOtherRows(getCurrentPositions(mydb, app_id, [int(book_id) for book_id in book_ids if not book_id.startswith('empty')]), \
+    app_id, numshelf)
+  shelf = lockLayout(mydb, app_id, numshelf, version, other_rows)
+  if reset_positions:
+    cleanPositionsForShelf(mydb, app_id, numshelf)
+  current_positions = [str(pos['id_item']) for pos in getPositionsForShelf(mydb, app_id, numshelf, for_update=True)]
   # prevent not changing order for positions already in db 
-  for book_id in current_positions:
-    if book_id not in new_positions and book_id not in book_ids:
-      new_positions.append(book_id)
+  new_positions = [book_id for book_id in current_positions if book_id not in book_ids]
   # prevent doublon
   for book_id in book_ids:
     if book_id not in new_positions:
       new_positions.append(book_id)
 
-  # update all positions for current shelf
+  # find current interval for books, or compute it from book size
+  ids = [int(book_id) for book_id in new_positions if not book_id.startswith('empty')]
+  current = getCurrentPositions(mydb, app_id, ids, for_update=True)
+  checkLockedRows(getOtherRows(current, app_id, numshelf), other_rows)
+  intervals = {book_id: position['range'] for book_id, position in current.items()}
+  missing = [book_id for book_id in ids if book_id not in intervals]
+  for book in Book.getBooks(mydb, missing, user_id) if missing else []:
+    intervals[book['id']] = tools.setBookInterval(book, device['leds_interval'])
+
+  positions = []
   pos = 0
+  shift_position = 0
   for book_id in new_positions:
     # shift book position for books not found in ocr result
-    if str(book_id).startswith('empty'):
+    if book_id.startswith('empty'):
       shift_position = int(book_id.split('_')[1])
-    # save position
-    else:
-      pos += 1
-      updatePositionBeforeOrder(user_id, device['id'], book_id, numshelf, device, pos, shift_position)
-      shift_position = 0
+      continue
+    book_id = int(book_id)
+    if book_id not in intervals:
+      raise HTTPException(status_code=404, detail=f"Book {book_id} not found")
+    pos += 1
+    positions.append({'id_item': book_id, 'position': pos, 'row': numshelf, 'range': intervals[book_id], 'shiftpos': shift_position})
+    shift_position = 0
 
   #compute new leds interval
-  positions = getPositionsForShelf(device['id'], numshelf)
-  for pos in positions:
-    led_columns_sum = getLedColumn(device['id'], pos['id_item'], numshelf, pos['position'])
-    setLedColumn(device['id'], pos['id_item'], numshelf, led_columns_sum)  
-    sortable.append({'book':pos['id_item'], 'position':pos['position'], 'fulfillment':int(led_columns_sum+pos['range']), \
-      'led_column':led_columns_sum, 'shelf':numshelf})
+  statics = shelf.statics
+  for position, led_column in zip(positions, layout.computeLedColumns(positions, statics)):
+    position['led_column'] = led_column
+  setPositions(mydb, app_id, positions)
+  Book.updateAppBooks(mydb, app_id, ids)
+  for item_id in list(shelf.items):
+    shelf.remove(item_id)
+  for position in positions:
+    shelf.insert(position['id_item'], position['position'], position['range'], position['shiftpos'])
+
+  return [{'book':pos['id_item'], 'position':pos['position'], 'fulfillment':int(pos['led_column']+pos['range']), \
+    'led_column':pos['led_column'], 'shelf':numshelf} for pos in positions]
+
+def editShelf(mydb, user_id, numshelf, device, version, operations):
+  ''' Apply move / insert / remove operations to row order : only books whose position or led column changed are saved '''
+  app_id = device['id']
+  # rows inserted books are taken from are locked with this one
+  other_rows = getOtherRows(getCurrentPositions(mydb, app_id, \
+    list({operation['id_item'] for operation in operations if operation['op'] == 'insert'})), app_id, numshelf)
+  shelf = lockLayout(mydb, app_id, numshelf, version, other_rows)
+  order = shelf.order()
+  inserted = {}
+  removed = []
+  for operation in operations:
+    item_id = operation['id_item']
+    if operation['op'] != 'remove' and operation['index'] is None:
+      raise HTTPException(status_code=400, detail=f"Index is required to {operation['op']} item {item_id}")
+    if operation['op'] == 'insert':
+      if item_id in order:
+        raise HTTPException(status_code=400, detail=f"Item {item_id} is already in row {numshelf}")
+      inserted[item_id] = True
+    elif item_id not in order:
+      raise HTTPException(status_code=400, detail=f"Item {item_id} is not in row {numshelf}")
+    else:
+      order.remove(item_id)
+    if operation['op'] == 'remove':
+      if item_id in inserted:
+        del inserted[item_id]
+      else:
+        removed.append(item_id)
+    else:
+      order.insert(operation['index'] - 1, item_id)
+  # find current interval for inserted books, or compute it from book size
+  current = getCurrentPositions(mydb, app_id, list(inserted), for_update=True)
+  checkLockedRows(getOtherRows(current, app_id, numshelf), other_rows)
+  intervals = {book_id: position['range'] for book_id, position in current.items()}
+  missing = [book_id for book_id in inserted if book_id not in intervals]
+  for book in Book.getBooks(mydb, missing, user_id) if missing else []:
+    intervals[book['id']] = tools.setBookInterval(book, device['leds_interval'])
+  for book_id in inserted:
+    if book_id not in intervals:
+      raise HTTPException(status_code=404, detail=f"Book {book_id} not found")
+  # apply new order to layout, keeping led columns before change to save only what moved
+  before = shelf.ledColumns(shelf.items)
+  for book_id in removed:
+    shelf.remove(book_id)
+    deletePosition(mydb, app_id, book_id, 'book', numshelf)
+  changed = []
+  for index, book_id in enumerate(order, 1):
+    item = shelf.items.get(book_id)
+    if item is None:
+      shelf.insert(book_id, index, intervals[book_id], 0)
+      changed.append(book_id)
+    elif item['position'] != index:
+      shelf.insert(book_id, index, item['range'], item['shiftpos'])
+      changed.append(book_id)
+  after = shelf.ledColumns(shelf.items)
+  positions = [dict(shelf.items[book_id], id_item=book_id, row=numshelf, led_column=after[book_id]) for book_id in changed]
+  setPositions(mydb, app_id, positions)
+  Book.updateAppBooks(mydb, app_id, list(inserted))
+  setLedColumns(mydb, app_id, numshelf, {book_id: column for book_id, column in after.items() \
+    if book_id not in changed and column != before.get(book_id)})
+  return shelf
+
+def getShelfOrder(shelf, numshelf):
+  ''' sortable payload of row from its layout '''
+  led_columns = shelf.ledColumns(shelf.order())
+  return [{'book':book_id, 'position':shelf.items[book_id]['position'], \
+    'fulfillment':int(led_columns[book_id]+shelf.items[book_id]['range']), 'led_column':led_columns[book_id], 'shelf':numshelf} \
+    for book_id in shelf.order()]
+
+def getCurrentPositions(mydb, app_id, book_ids, for_update = False):
+  ''' current position of books in app, else in any app : used for their interval
+  for_update : locking read, seeing positions committed after transaction snapshot '''
+  if not book_ids:
+    return {}
+  cursor = mydb.cursor(dictionary=True)
+  cursor.execute("SELECT id_item, id_app, `row`, `range` FROM biblio_position where item_type='book' and id_item IN (" + \
+    ', '.join(['%s'] * len(book_ids)) + ") ORDER BY id_app=%s DESC" + (" FOR UPDATE" if for_update else ""), (*book_ids, app_id))
+  positions = {}
+  for row in cursor.fetchall():
+    positions.setdefault(row['id_item'], row)
+  return positions
 
-  return sortable
+def getOtherRows(current, app_id, row):
+  ''' rows of app other than row where books of current positions are '''
+  return {position['row'] for position in current.values() if position['id_app'] == app_id and position['row'] != row}
 
-def cleanPositionsForShelf(app_id, numshelf):
-  mydb = getMyDB()
+def checkLockedRows(rows, locked):
+  ''' books were moved to rows not locked by the edit since they were looked up : client has to retry '''
+  moved = set(rows) - set(locked)
+  if moved:
+    raise HTTPException(status_code=409, detail=f"Books were moved to rows {sorted(moved)} during edit, please retry")
+
+def updatePosition(mydb, device, request):
+  ''' save position for book as given, led column included '''
+  app_id = device['id']
+  current = getPositionForBook(mydb, app_id, request['id_item'])
+  rows = {request['row']} | ({current['row']} if current else set())
+  bumpRowVersions(mydb, app_id, rows)
+  current = getPositionForBook(mydb, app_id, request['id_item'], for_update=True)
+  checkLockedRows({current['row']} if current else set(), rows)
+  setPosition(mydb, app_id, request['id_item'], request['position'], request['row'], request['range'], 'book', \
+    request['led_column'], 0, request['borrowed'])
+  return getPositionForBook(mydb, app_id, request['id_item'])
+
+def cleanPositionsForShelf(mydb, app_id, numshelf):
   cursor = mydb.cursor()
   cursor.execute("DELETE FROM biblio_position WHERE `item_type`='book' and `id_app`=%s and `row`=%s", (app_id, numshelf))
-  mydb.commit()
 
-def getPositionsForShelf(app_id, numshelf):
-  mydb = getMyDB()  
+def getPositionsForShelf(mydb, app_id, numshelf, for_update = False):
   cursor = mydb.cursor(dictionary=True)
   cursor.execute("SELECT * FROM biblio_position where id_app=%s and `row`=%s \
-    and `item_type`<>'static' order by `position`", (app_id, numshelf))
+    and `item_type`<>'static' order by `position`" + (" FOR UPDATE" if for_update else ""), (app_id, numshelf))
   return cursor.fetchall()
 
-def getLastSavedPosition(app_id):
-  mydb = getMyDB()  
+def getLastSavedPosition(mydb, app_id):
   cursor = mydb.cursor(dictionary=True)
   cursor.execute("SELECT * FROM `biblio_position` WHERE id_app = %s and item_type='book' and \
       position in (SELECT max(position) FROM `biblio_position` WHERE id_app = %s and item_type='book' GROUP by row) \
       ORDER BY row DESC LIMIT 1", (app_id, app_id))
   return cursor.fetchone()      
 
-''' update position order before computing books intervals sum ''' 
-def updatePositionBeforeOrder(user_id, app_id, id_book, numshelf, device, new_position, shift_position = 0):
-  # find current interval for book
-  position = getPositionForBook(app_id, id_book, True)
-  if position is not None:
-    interval = position['range']
-  else:
-    book = Book.getBook(id_book, user_id)
-    interval = tools.setBookInterval(book, device['leds_interval'])
-  #save position + reinit led column + store shift led position before reorder
-  setPosition(app_id, id_book, new_position, numshelf, interval, 'book', 0, shift_position)
-  return getPositionForBook(app_id, id_book)
-
 ''' get book position for given app '''
-def getPositionForBook(app_id, book_id, all_apps = False):
-  mydb = getMyDB()
+def getPositionForBook(mydb, app_id, book_id, all_apps = False, for_update = False):
+  lock = " FOR UPDATE" if for_update else ""
   cursor = mydb.cursor(dictionary=True)
   if all_apps:
-    cursor.execute("SELECT * FROM biblio_position where id_item=%s and item_type='book'", [book_id])
+    cursor.execute("SELECT * FROM biblio_position where id_item=%s and item_type='book'" + lock, [book_id])
   else:
-    cursor.execute("SELECT * FROM biblio_position where id_app=%s and id_item=%s and item_type='book'", (app_id, book_id))
+    cursor.execute("SELECT * FROM biblio_position where id_app=%s and id_item=%s and item_type='book'" + lock, (app_id, book_id))
   return cursor.fetchone()
 
 ''' save or update item position '''
-def setPosition(app_id, item_id, position, row, interval, item_type, led_column, shift_position = 0, borrowed = 0):
-  mydb = getMyDB()
+def setPosition(mydb, app_id, item_id, position, row, interval, item_type, led_column, shift_position = 0, borrowed = 0):
   cursor = mydb.cursor()
   cursor.execute("INSERT INTO biblio_position (`id_app`, `id_item`, `item_type`, `position`, `row`, \
       `range`, `led_column`, `shiftpos`, `borrowed`) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) \
       ON DUPLICATE KEY UPDATE position=%s, row=%s, `range`=%s, `led_column`=%s, `shiftpos`=%s, `borrowed`=%s", \
       (app_id, item_id, item_type, position, row, interval, led_column, shift_position, borrowed, position, row, interval, \
         led_column, shift_position, borrowed))
-  mydb.commit()
   #udpate app for book item
   if item_type == 'book':
-    Book.updateAppBook(app_id, item_id) 
+    Book.updateAppBook(mydb, app_id, item_id) 
+
+def setPositions(mydb, app_id, positions):
+  ''' save or update book positions of app in one statement : borrowed state of existing positions is kept '''
+  if not positions:
+    return
+  cursor = mydb.cursor()
+  cursor.executemany("INSERT INTO biblio_position (`id_app`, `id_item`, `item_type`, `position`, `row`, \
+      `range`, `led_column`, `shiftpos`, `borrowed`) VALUES (%s, %s, 'book', %s, %s, %s, %s, %s, 0) \
+      ON DUPLICATE KEY UPDATE position=VALUES(position), row=VALUES(row), `range`=VALUES(`range`), `led_column`=VALUES(`led_column`), \
+      `shiftpos`=VALUES(`shiftpos`)", [(app_id, pos['id_item'], pos['position'], pos['row'], pos['range'], pos['led_column'], \
+      pos.get('shiftpos', 0)) for pos in positions])
 
-def deletePosition(app_id, item_id, item_type, numrow):
-  mydb = getMyDB()
+def deletePosition(mydb, app_id, item_id, item_type, numrow):
   cursor = mydb.cursor()
   cursor.execute("DELETE FROM biblio_position WHERE `id_item`=%s and `item_type`=%s and `id_app`=%s and `row`=%s", \
     (item_id, item_type, app_id, numrow))
-  mydb.commit()
   #remove app_id for book item
   if item_type == 'book':
-    Book.updateAppBook(None, item_id)  
+    Book.updateAppBook(mydb, None, item_id)  
 
-def setLedColumn(app_id, item_id, row, led_column):
-  mydb = getMyDB()
+def setLedColumns(mydb, app_id, row, led_columns):
+  ''' save led columns {item id: led column} of books in row with one statement '''
+  if not led_columns:
+    return
+  cursor = mydb.cursor()
+  cursor.execute("UPDATE biblio_position SET `led_column` = CASE `id_item` " + "WHEN %s THEN %s " * len(led_columns) + \
+    "END WHERE `id_app`=%s AND `row`=%s AND `item_type`='book' AND `id_item` IN (" + ', '.join(['%s'] * len(led_columns)) + ")", \
+    (*[value for item in led_columns.items() for value in item], app_id, row, *led_columns))
+
+_layouts = {}
+
+def getLayout(mydb, app_id, row, version = None):
+  ''' layout of row to edit : copy of layout cached by (app, row) while row version in database is the one it was built for,
+  else built with a locking read, seeing positions committed after transaction snapshot : row is locked by caller '''
+  if version is None:
+    version = getRowVersion(mydb, app_id, row)
+  shelf = _layouts.get((app_id, row))
+  if shelf is not None and shelf.row_version == version:
+    return shelf.copy()
   cursor = mydb.cursor(dictionary=True)
-  cursor.execute("UPDATE biblio_position SET `led_column`=%s WHERE `id_app`=%s AND `id_item`=%s AND \
-    `item_type`='book' AND `row`=%s", (led_column, app_id, item_id, row))
-  mydb.commit()
+  cursor.execute("SELECT `id_item`, `item_type`, `position`, `range`, `shiftpos`, `led_column` FROM biblio_position \
+    WHERE id_app=%s and `row`=%s ORDER BY `position` FOR UPDATE", (app_id, row))
+  return layout.ShelfLayout(cursor.fetchall(), version)
+
+def publishLayout(app_id, row, shelf):
+  ''' cache layout of a committed edit, unless a newer version of row was cached meanwhile '''
+  cached = _layouts.get((app_id, row))
+  if cached is None or cached.row_version < shelf.row_version:
+    _layouts[(app_id, row)] = shelf
 
-'''compute sum of books intervals and shifted position (for missing books) for setting physical position'''
-def getLedColumn(app_id, item_id, row, column):
-  mydb = getMyDB()
+def lockLayouts(mydb, app_id, rows, other_rows = ()):
+  ''' layouts of rows for an edit : versions of rows, and of other rows changed by the edit, are incremented first
+  in ascending order, which locks them in database until commit. Layouts are read after, with locking reads.
+  They are edited by caller and cached once transaction is committed : a rollback leaves cache as it was '''
+  versions = bumpRowVersions(mydb, app_id, set(rows) | set(other_rows))
+  shelves = {}
+  for row in sorted(set(rows)):
+    shelf = getLayout(mydb, app_id, row, versions[row] - 1)
+    shelf.row_version = versions[row]
+    mydb.onCommit(lambda row=row, shelf=shelf: publishLayout(app_id, row, shelf))
+    shelves[row] = shelf
+  return shelves
+
+def lockLayout(mydb, app_id, row, version = None, other_rows = ()):
+  ''' layout of row for an edit, see lockLayouts
+  version : row version the edit was prepared for, 409 with current row order if it changed since '''
+  shelf = lockLayouts(mydb, app_id, [row], other_rows)[row]
+  if version is not None and int(version) != shelf.row_version - 1:
+    raise HTTPException(status_code=409, detail={'message': f"Row {row} changed since version {version}", \
+      'numshelf': row, 'version': shelf.row_version - 1, 'positions': getShelfOrder(shelf, row)})
+  return shelf
+
+def getRowVersion(mydb, app_id, row):
   cursor = mydb.cursor(dictionary=True)
-  cursor.execute("SELECT (sum(`range`) + sum(`shiftpos`)) as `column` FROM `biblio_position` \
-    WHERE `position`<%s  and id_app=%s and `row`=%s and id_item <> %s and item_type='book'",(column, app_id, row, item_id))
-  #app.logger.info('get_led_column: %s', mysql['cursor']._last_executed)
+  cursor.execute("SELECT version FROM biblio_row_version WHERE id_app=%s and `row`=%s", (app_id, row))
   res = cursor.fetchone()
-  if res and res['column'] is None:
-    res['column'] = 0
-  #check if book's real position must be shifted     
-  shifted = getShiftedPositionForBook(app_id, row, item_id)    
-  if shifted and shifted['shiftpos'] > 0:
-    res['column'] += shifted['shiftpos']
-  #check for static columns to shift book's real position     
-  statics = getStaticPositions(app_id, row)    
-  if statics is not None:
-    for static in statics:
-      if res['column'] >= static['led_column']:
-        res['column'] += static['range']
-  return res['column']
-
-def getShiftedPositionForBook(app_id, row, item_id):
-  mydb = getMyDB()
+  return res['version'] if res else 0
+
+def bumpRowVersions(mydb, app_id, rows):
+  ''' increment versions of rows, in order to always lock them in same order : return new versions by row '''
+  rows = sorted(rows)
+  if not rows:
+    return {}
   cursor = mydb.cursor(dictionary=True)
-  cursor.execute("SELECT `shiftpos` FROM `biblio_position` \
-    WHERE `item_type`='book' AND `id_app`=%s AND `row`=%s AND `id_item`=%s ORDER BY `position`", \
-    (app_id, row, item_id))
-  return cursor.fetchone()
+  cursor.executemany("INSERT INTO biblio_row_version (`id_app`, `row`, `version`) VALUES (%s, %s, 1) \
+    ON DUPLICATE KEY UPDATE version=version+1", [(app_id, row) for row in rows])
+  cursor.execute("SELECT `row`, version FROM biblio_row_version WHERE id_app=%s and `row` IN (" + \
+    ', '.join(['%s'] * len(rows)) + ")", (app_id, *rows))
+  return {res['row']: res['version'] for res in cursor.fetchall()}
+
+# locks are dropped once no edit holds or waits for them
+_row_locks = weakref.WeakValueDictionary()
+
+@asynccontextmanager
+async def lockRows(app_id, rows):
+  ''' in process locks of rows : edits of a row wait for each other instead of failing on version, other rows go on
+  transaction must be committed before leaving '''
+  async with AsyncExitStack() as stack:
+    for row in sorted(set(rows)):
+      lock = _row_locks.get((app_id, row))
+      if lock is None:
+        lock = _row_locks[(app_id, row)] = asyncio.Lock()
+      await stack.enter_async_context(lock)
+    yield
 
-def getStaticPositions(app_id, row):
-  mydb = getMyDB()
+def getStaticPositions(mydb, app_id, row):
   cursor = mydb.cursor(dictionary=True)
   cursor.execute("SELECT `led_column`, `range`, position, item_type FROM `biblio_position` \
     WHERE item_type='static' AND id_app=%s AND `row`=%s ORDER BY `position`", (app_id, row))
@@ -18,9 +18,8 @@
 from fastapi import Path
 from typing import Union, Annotated, List
 from pydantic import BaseModel, Field
-from db import getMyDB
 from models import Book, Position
-import tools
+import db, search, tagcache, tools
 
 class Tag(BaseModel):
     id: Annotated[Union[int, None], Path(title="Tag Id")] = Field(examples=["1"])
@@ -54,119 +53,152 @@ class TagBooksList(BaseModel):
     list_title: Annotated[Union[str, None], Path(title="Tag name")] = Field(examples=["Auster Paul"])
     elements: List[TagBooksListElements]
 
-def setTagsBook(book, user_id, app_id, tags = None):
-    # manage tags + taxonomy
-    # author tags
-    authorTagids = []
-    authors = book['author'].split(',')
-    if len(authors) > 0:
-        authorTags = tools.getLastnameFirstname(authors)
-        authorTagids = saveTags(authorTags,'Authors')
-    if len(authorTagids) > 0:
-        saveTagNode(book, authorTagids)
-    # categories
-    catTagIds = []
-    if tags is not None :  
-        cleanTagForNode(book['id'], 1) #clean tags categories  before update
-        catTagIds = saveTags(tags.split(','),'Categories')
-    if len(catTagIds) > 0:
-        saveTagNode(book, catTagIds)
-        saveTagUser(user_id, catTagIds)
-
-def saveTagNode(node, tagIds):
-    mydb = getMyDB()
-    cursor = mydb.cursor()
-    for tag in tagIds:
-        cursor.execute("INSERT INTO biblio_tag_node (`node_type`, `id_node`, `id_tag`) VALUES (%s, %s, %s) ON DUPLICATE KEY UPDATE id_tag=%s", \
-            ('book', node['id'], tag['id'], tag['id']))
-    mydb.commit()
-
-def saveTags(tags, taxonomy_label):
-    tag_ids = []
-    taxonomy = getIdTaxonomy(taxonomy_label)
-    mydb = getMyDB()
-    cursor = mydb.cursor(dictionary=True)
+def setTagsBook(mydb, book, user_id, app_id, tags = None):
+    # manage tags + taxonomy : authors, and categories if given
+    if tags is not None :
+        cleanTagForNode(mydb, book['id'], 1) #clean tags categories  before update
+    setTagsBooks(mydb, [dict(book, categories=tags)], user_id)
+
+def setTagsBooks(mydb, books, user_id):
+    ''' tags for list of books : labels of all books are resolved at once, links saved in one statement '''
+    authorLinks = []
+    catLinks = []
+    for book in books:
+        for tag in tools.getLastnameFirstname(book['author'].split(',')):
+            authorLinks.append((book['id'], tag.strip()))
+        if book.get('categories'):
+            for tag in book['categories'].split(','):
+                catLinks.append((book['id'], tag.strip()))
+    authorIds = resolveTags(mydb, [tag for _, tag in authorLinks], 'Authors')
+    catIds = resolveTags(mydb, [tag for _, tag in catLinks], 'Categories')
+    links = {(book_id, authorIds[tools.fold(tag)]) for book_id, tag in authorLinks if tag}
+    links.update((book_id, catIds[tools.fold(tag)]) for book_id, tag in catLinks if tag)
+    saveTagNodes(mydb, links)
+    saveTagUser(mydb, user_id, [{'id': tag_id} for tag_id in set(catIds.values())])
+
+def resolveTags(mydb, tags, taxonomy_label):
+    ''' ids of tags by folded label : cached tags first, then known tags in one query, missing ones inserted in one statement '''
+    labels = {}
     for tag in tags:
-        hasTag = getTag(tag)
-        if hasTag is None:
-          cursor.execute("INSERT INTO biblio_tags (`tag`, `id_taxonomy`) VALUES (%s, %s)", (tag, taxonomy['id']))
-          mydb.commit()
-          cursor.execute("SELECT LAST_INSERT_ID() as id")
-          row = cursor.fetchone()
-          tag_ids.append(row)
-        else:
-          tag_ids.append(hasTag)
+        if tag:
+            labels.setdefault(tools.fold(tag), tag)
+    if not labels:
+        return {}
+    cache = tagcache.getCache()
+    tag_ids = cache.getTags(labels)
+    unknown = [tag for key, tag in labels.items() if key not in tag_ids]
+    if unknown:
+        found = getTagsByLabel(mydb, unknown)
+        missing = [tag for tag in unknown if tools.fold(tag) not in found]
+        if missing:
+            taxonomy = getIdTaxonomy(mydb, taxonomy_label)
+            cursor = mydb.cursor()
+            cursor.executemany("INSERT INTO biblio_tags (`tag`, `id_taxonomy`) VALUES (%s, %s)", [(tag, taxonomy['id']) for tag in missing])
+            found.update(getTagsByLabel(mydb, missing))
+        mydb.onCommit(lambda: cache.storeTags(found))
+        tag_ids.update(found)
     return tag_ids
 
-def saveTagUser(user_id, tagIds):
-    mydb = getMyDB()
-    cursor = mydb.cursor()
-    for tag in tagIds:
-        cursor.execute("INSERT INTO biblio_tag_user (`id_user`, `id_tag`) VALUES (%s, %s) ON DUPLICATE KEY UPDATE id_tag=%s", \
-            (user_id, tag['id'], tag['id']))
-    mydb.commit()
-
-def getTag(tag):
-    mydb = getMyDB()
+def getTagsByLabel(mydb, tags):
+    tags = list(tags)
     cursor = mydb.cursor(dictionary=True)
-    cursor.execute("SELECT id, tag, color FROM biblio_tags WHERE tag=%s", [tag])
-    return cursor.fetchone()
+    cursor.execute("SELECT id, tag FROM biblio_tags WHERE tag IN (" + ', '.join(['%s'] * len(tags)) + ")", tags)
+    return {tools.fold(row['tag']): row['id'] for row in cursor.fetchall()}
 
-def getTagById(tag_id, user_id):
-    mydb = getMyDB()
+def saveTagNodes(mydb, links):
+    ''' save (book id, tag id) links in one statement '''
+    if not links:
+        return
+    cursor = mydb.cursor()
+    cursor.executemany("INSERT INTO biblio_tag_node (`node_type`, `id_node`, `id_tag`) VALUES ('book', %s, %s) \
+        ON DUPLICATE KEY UPDATE id_tag=VALUES(id_tag)", list(links))
+    # tags are indexed with books
+    search.invalidateBooks(mydb, [book_id for book_id, _ in links])
+
+def saveTagUser(mydb, user_id, tagIds):
+    if not tagIds:
+        return
+    cursor = mydb.cursor()
+    cursor.executemany("INSERT INTO biblio_tag_user (`id_user`, `id_tag`) VALUES (%s, %s) ON DUPLICATE KEY UPDATE id_tag=VALUES(id_tag)", \
+        [(user_id, tag['id']) for tag in tagIds])
+
+def getTagById(mydb, tag_id, user_id):
     cursor = mydb.cursor(dictionary=True)
     cursor.execute("SELECT bt.id, bt.tag, btu.color, bt.id_taxonomy FROM biblio_tags bt \
         LEFT JOIN biblio_tag_user btu ON bt.id = btu.id_tag and btu.id_user=%s \
         WHERE id=%s", (user_id, tag_id))
     return cursor.fetchone()
 
-def getTagForNode(id_node, id_taxonomy):
-    mydb = getMyDB()
+async def getTagByIdAsync(mydb, tag_id, user_id):
+    return await db.fetchOne(mydb, "SELECT bt.id, bt.tag, btu.color, bt.id_taxonomy FROM biblio_tags bt \
+        LEFT JOIN biblio_tag_user btu ON bt.id = btu.id_tag and btu.id_user=%s \
+        WHERE id=%s", (user_id, tag_id))
+
+def getTagForNode(mydb, id_node, id_taxonomy):
     cursor = mydb.cursor(dictionary=True)
     cursor.execute("SELECT id, tag FROM biblio_tags bt \
     INNER JOIN biblio_tag_node btn ON bt.id = btn.id_tag WHERE btn.id_node=%s and bt.id_taxonomy=%s", (id_node,id_taxonomy))
     return cursor.fetchall()    
 
-def getBooksForTag(id_tag, id_app):
-    mydb = getMyDB()
-    cursor = mydb.cursor(dictionary=True)
-    cursor.execute("SELECT id_node FROM biblio_tag_node btn \
-        INNER JOIN biblio_tags bt ON bt.id = btn.id_tag \
+async def getBooksWithPositionsForTag(mydb, id_tag, user_id, id_app):
+    ''' Books of tag in app, with their position (None when not placed) and pending location request, in one query '''
+    return await db.fetchAll(mydb, "SELECT bb.`id`, bb.`isbn`, bb.`title`, bb.`subtitle`, bb.`ocr_keywords` as keywords, bb.`author`, \
+        bb.`editor`, bb.`year`, bb.`pages`, bb.`reference`, bb.`description`, bb.`width`, bp.`id_app`, bp.`id_item`, bp.`item_type`, \
+        bp.`position`, bp.`row`, bp.`range`, bp.`shiftpos`, bp.`led_column`, bp.`borrowed`, \
+        EXISTS(SELECT 1 FROM biblio_request br WHERE br.id_app=bp.id_app and br.`column`=bp.`position` \
+          and br.`row`=bp.`row` and br.`action`='add') as requested \
+        FROM biblio_tag_node btn \
         INNER JOIN biblio_book bb ON btn.id_node = bb.id \
-        WHERE btn.id_tag=%s and btn.node_type='book' and bb.id_app=%s", (id_tag, id_app))
-    return cursor.fetchall()
-
-def getIdTaxonomy(label):
-    mydb = getMyDB()
-    cursor = mydb.cursor(dictionary=True)
-    cursor.execute("SELECT id, label FROM biblio_taxonomy WHERE label=%s", [label])
-    return cursor.fetchone()
+        LEFT JOIN biblio_position bp ON bp.id_item=bb.id and bp.item_type='book' and bp.id_app=bb.id_app \
+        WHERE btn.id_tag=%s and btn.node_type='book' and bb.id_app=%s and bb.id_user=%s \
+        ORDER BY bp.`row`, bp.`position`", (id_tag, id_app, user_id))
+
+def getIdTaxonomy(mydb, label):
+    cache = tagcache.getCache()
+    taxonomy = cache.getTaxonomy(label)
+    if taxonomy is None:
+        cursor = mydb.cursor(dictionary=True)
+        cursor.execute("SELECT id, label FROM biblio_taxonomy WHERE label=%s", [label])
+        taxonomy = cursor.fetchone()
+        if taxonomy is not None:
+            cache.storeTaxonomy(label, taxonomy)
+    return taxonomy
   
-def cleanTagForNode(id_node, id_taxonomy):
-    mydb = getMyDB()
+def cleanTagForNode(mydb, id_node, id_taxonomy):
     cursor = mydb.cursor()
     cursor.execute("DELETE tn.* FROM biblio_tag_node tn LEFT JOIN biblio_tags t ON tn.id_tag = t.id \
       WHERE tn.id_node=%s and t.id_taxonomy=%s and tn.node_type='book'", (id_node, id_taxonomy))
-    mydb.commit()
-
-async def getAuthorsForApp(app_id, letter):
-    mydb = getMyDB()
-    cursor = mydb.cursor(dictionary=True)
-    searchLetter = letter+"%"
-    cursor.execute("SELECT bt.id, bt.tag, count(bb.id) as nbnode FROM `biblio_tags` bt \
+    search.invalidateBook(mydb, id_node)
+
+async def getAuthorsForApp(mydb, app_id, initial = None):
+    ''' Authors of app with books count and pending location requests count, in one query :
+    only names starting with initial letter (accents ignored by collation) or with no latin letter for '#' '''
+    where = ""
+    params = (app_id, app_id)
+    if initial == '#':
+        where = " and TRIM(bt.tag) NOT REGEXP '^[a-z]'"
+    elif initial is not None:
+        where = " and TRIM(bt.tag) LIKE %s"
+        params += (initial + '%',)
+    return await db.fetchAll(mydb, "SELECT bt.id, bt.tag, count(bb.id) as nbnode, coalesce(max(br.nb_requests), 0) as hasRequest \
+        FROM `biblio_tags` bt \
         INNER JOIN biblio_tag_node btn ON bt.id = btn.id_tag \
         INNER JOIN biblio_book bb ON btn.id_node = bb.id \
         INNER JOIN biblio_position bp ON bb.id = bp.id_item and bp.item_type='book' \
-        WHERE bt.id_taxonomy=2 and bp.id_app=%s and bt.tag like %s GROUP BY bt.id ORDER BY bt.tag", (app_id, "{}%".format(letter)))
-    return cursor.fetchall()
-
-async def getCategoriesForApp(id_user, id_app):
-    mydb = getMyDB()
-    cursor = mydb.cursor(dictionary=True)
-    cursor.execute("SELECT bt.id, bt.tag, btu.color, count(bb.id) as nbnode FROM `biblio_tags` bt \
+        LEFT JOIN (SELECT id_tag, count(*) as nb_requests FROM biblio_request WHERE id_app=%s and `action`='add' GROUP BY id_tag) br \
+          ON br.id_tag = bt.id \
+        WHERE bt.id_taxonomy=2 and bp.id_app=%s" + where + " GROUP BY bt.id ORDER BY bt.tag", params)
+
+async def getCategoriesForApp(mydb, id_user, id_app):
+    ''' Categories of app with books count, pending location requests count and RGB components of color, in one query '''
+    return await db.fetchAll(mydb, "SELECT bt.id, bt.tag, btu.color, count(bb.id) as nbnode, \
+    coalesce(max(br.nb_requests), 0) as hasRequest, SUBSTRING_INDEX(btu.color, ',', 1) as red, \
+    SUBSTRING_INDEX(SUBSTRING_INDEX(btu.color, ',', 2), ',', -1) as green, SUBSTRING_INDEX(btu.color, ',', -1) as blue \
+    FROM `biblio_tags` bt \
     INNER JOIN biblio_tag_node btn ON bt.id = btn.id_tag \
     INNER JOIN biblio_tag_user btu ON btn.id_tag = btu.id_tag \
     INNER JOIN biblio_book bb ON btn.id_node = bb.id \
     INNER JOIN biblio_position bp ON bb.id = bp.id_item and bp.item_type='book'\
-    WHERE bt.id_taxonomy=1 and bp.id_app=%s and btu.id_user=%s GROUP BY bt.id ORDER BY bt.tag", (id_app, id_user))
-    return cursor.fetchall()
\ No newline at end of file
+    LEFT JOIN (SELECT id_tag, count(*) as nb_requests FROM biblio_request WHERE id_app=%s and `action`='add' GROUP BY id_tag) br \
+      ON br.id_tag = bt.id \
+    WHERE bt.id_taxonomy=1 and bp.id_app=%s and btu.id_user=%s GROUP BY bt.id ORDER BY bt.tag", (id_app, id_app, id_user))
@@ -17,9 +17,6 @@
 
 from typing import Union
 from pydantic import BaseModel
-from db import getMyDB
-
-mydb = getMyDB()
 
 # biblio_app table definition
 
@@ -33,8 +30,7 @@ class User(BaseModel):
     created_at: str
     updated_at: str
 
-def get_user(user_id):
-  mydb = getMyDB()  
+def get_user(mydb, user_id):
   cursor = mydb.cursor(dictionary=True)
   cursor.execute("SELECT id, email, password, firstname, lastname FROM biblio_user WHERE id=%s", [user_id])
   user = cursor.fetchone()
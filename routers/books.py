@@ -15,11 +15,14 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #==============================================================================
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
 from typing import Annotated, List, Union
 from models import Book, Location, Position, Tag
-from dependencies import get_auth_device
-import tools
+from db import AsyncPooledConnection, PooledConnection
+from dependencies import get_async_db, get_auth_device, get_db
+from config import settings
+import bookapi, tools
 
 router = APIRouter(
     prefix="/books",
@@ -29,76 +32,66 @@ router = APIRouter(
 )
 
 @router.get("/item/{book_id}")
-async def get_book_item(current_device: Annotated[str, Depends(get_auth_device)], book_id: int) -> Book.BookItem:
+def get_book_item(current_device: Annotated[str, Depends(get_auth_device)], mydb: Annotated[PooledConnection, Depends(get_db, scope="function")], book_id: int) -> Book.BookItem:
     """Get book for device bookshelf"""
     device = current_device.get('device')
     user = current_device.get('user')
     item = {}
-    item['book'] = Book.getBook(book_id, user['id'])
+    item['book'] = Book.getBook(mydb, book_id, user['id'])
     if not item:
         raise HTTPException(status_code=404)
     item['categories'] = []
-    tags = Tag.getTagForNode(book_id, 1)
+    tags = Tag.getTagForNode(mydb, book_id, 1)
     if tags:
         for i in range(len(tags)):
             item['categories'].append(tags[i]['tag'])        
-    address = Position.getPositionForBook(device['id'], book_id)
+    address = Position.getPositionForBook(mydb, device['id'], book_id)
     if address:
         item['address'] = address
     return item
 
 @router.post("/item")
-def create_book_item(current_device: Annotated[str, Depends(get_auth_device)], item: Book.Book):
+def create_book_item(current_device: Annotated[str, Depends(get_auth_device)], mydb: Annotated[PooledConnection, Depends(get_db, scope="function")], item: Book.Book):
     """Create new book for current device"""
     device = current_device.get('device')
     user = current_device.get('user')
     bookDict = item.dict()
-    book = Book.newBook(bookDict, user['id'], device['id'])
+    book = Book.newBook(mydb, bookDict, user['id'], device['id'])
     # save tags
-    Tag.setTagsBook(book, user['id'], device['id'], None)
+    Tag.setTagsBook(mydb, book, user['id'], device['id'], None)
     return book
 
 @router.put("/item/{book_id}")
-def update_book_item(current_device: Annotated[str, Depends(get_auth_device)], book_id: int, item: Book.Book):
+def update_book_item(current_device: Annotated[str, Depends(get_auth_device)], mydb: Annotated[PooledConnection, Depends(get_db, scope="function")], book_id: int, item: Book.Book):
     """Update book data"""
     device = current_device.get('device')
     user = current_device.get('user')
     bookDict = item.dict()
-    book = Book.updateBook(bookDict, book_id, user['id'], device['id'])
+    book = Book.updateBook(mydb, bookDict, book_id, user['id'], device['id'])
+    if not book:
+        raise HTTPException(status_code=404)
     # save tags
-    Tag.setTagsBook(book, user_id, device['id'], None)
+    Tag.setTagsBook(mydb, book, user['id'], device['id'], None)
     return book
 
 @router.get("/referencer")
-def reference_books_with_api(current_device: Annotated[str, Depends(get_auth_device)], isbn: str, search_api: str) -> List[Book.Book]:
-    """Retrieve books references using external API with ISBN code"""
-    device = current_device.get('device')
-    user = current_device.get('user')
-    res = []
-    '''Search books with googleapis api'''
-    if search_api=='googleapis':
-      query = "ISBN:\""+isbn+"\""
-      data = Book.searchBookApi(query, 'googleapis')
-      if 'items' in data:
-        for item in data['items']:
-          res.append(Book.formatBookApi('googleapis', item, isbn))
-    '''Search books with openlibrary api'''
-    if search_api=='openlibrary':
-        query = "ISBN:"+isbn
-        data = Book.searchBookApi(query, 'openlibrary')
-        #print(data)      
-        if query in data:
-            res = [Book.formatBookApi('openlibrary', data[query], isbn)]
-    return res
+async def reference_books_with_api(current_device: Annotated[str, Depends(get_auth_device)], isbn: str, search_api: str) -> List[Book.Book]:
+    """Retrieve books references using external API with ISBN code : 'googleapis', 'openlibrary' or 'all' for both"""
+    try:
+        return await Book.referenceBooks(isbn, search_api)
+    except bookapi.CircuitOpen as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except bookapi.ProviderError as e:
+        raise HTTPException(status_code=502, detail=str(e))
 
 @router.post("/referencer")
-def create_book_and_position(current_device: Annotated[str, Depends(get_auth_device)], item: Book.Book, \
+def create_book_and_position(current_device: Annotated[str, Depends(get_auth_device)], mydb: Annotated[PooledConnection, Depends(get_db, scope="function")], item: Book.Book, \
     force_position: bool = False, book_width: Union[str, None] = None) -> Book.BookItem:
     """Create new book and position for current device"""
     device = current_device.get('device')
     user = current_device.get('user')
     bookDict = item.dict()
-    book_id = Book.getBookByISBN(bookDict['isbn'], bookDict['reference'], user['id'])
+    book_id = Book.getBookByISBN(mydb, bookDict['isbn'], bookDict['reference'], user['id'])
     # save book if not present     
     if book_id:
         raise HTTPException(
@@ -112,13 +105,13 @@ def create_book_and_position(current_device: Annotated[str, Depends(get_auth_dev
     elif bookDict['width'] is None:
       bookDict['width'] = round(tools.setBookWidth(bookDict['pages']))
     # save book + tags 
-    book = Book.newBook(bookDict, user['id'], device['id'])
-    Tag.setTagsBook(bookDict, user['id'], device['id'], None)     
+    book = Book.newBook(mydb, bookDict, user['id'], device['id'])
+    Tag.setTagsBook(mydb, bookDict, user['id'], device['id'], None)     
     book_id = book['id']
     item['book'] = book
     # save position if needed
     if force_position:
-        lastPos = Position.getLastSavedPosition(device['id'])
+        lastPos = Position.getLastSavedPosition(mydb, device['id'])
         interval = tools.setBookInterval(book, device['leds_interval'])       
         if lastPos:
             position = lastPos['position']+1
@@ -128,27 +121,63 @@ def create_book_and_position(current_device: Annotated[str, Depends(get_auth_dev
             position = 1
             row = 1
             led_column = 0
-        Position.setPosition(device['id'], book_id, position, row, interval, 'book', led_column)
-        address = Position.getPositionForBook(device['id'], book_id)
+        Position.bumpRowVersions(mydb, device['id'], [row])
+        Position.setPosition(mydb, device['id'], book_id, position, row, interval, 'book', led_column)
+        address = Position.getPositionForBook(mydb, device['id'], book_id)
         if address:
             item['address'] = address
     return item
 
+@router.post("/import")
+async def import_books(current_device: Annotated[str, Depends(get_auth_device)], mydb: Annotated[PooledConnection, Depends(get_db, scope="function")], request: Request, \
+    format: Union[str, None] = Query(None, pattern="^(csv|ndjson)$"), force_position: bool = False) -> Book.BookImport:
+    """Import books from uploaded CSV (header with book fields and optional 'categories') or NDJSON file, saved by chunks"""
+    device = current_device.get('device')
+    user = current_device.get('user')
+    if format is None:
+        format = 'ndjson' if 'json' in request.headers.get('content-type', '') else 'csv'
+    report = {'imported': 0, 'book_ids': [], 'errors': []}
+    seen = {'isbn': set(), 'reference': set()}
+    rows = []
+    async for line, row, error in Book.parseBooksStream(request.stream(), format):
+        if error is not None:
+            report['errors'].append({'line': line, 'error': error})
+            continue
+        rows.append((line, row))
+        if len(rows) >= settings.book_import_chunk_size:
+            await run_in_threadpool(save_books_chunk, mydb, rows, user, device, force_position, report, seen)
+            rows = []
+    if rows:
+        await run_in_threadpool(save_books_chunk, mydb, rows, user, device, force_position, report, seen)
+    report['errors'].sort(key=lambda error: error['line'])
+    return report
+
+def save_books_chunk(mydb, rows, user, device, force_position, report, seen):
+    books = Book.importBooks(mydb, rows, user['id'], device['id'], report['errors'], seen)
+    if not books:
+        return
+    Tag.setTagsBooks(mydb, books, user['id'])
+    if force_position:
+        Book.setImportPositions(mydb, books, device)
+    report['book_ids'] += [book['id'] for book in books]
+    report['imported'] += len(books)
+
 @router.post("/search")
-async def search_books_in_bookshelf(current_device: Annotated[str, Depends(get_auth_device)], query: str) -> Book.BookSearch:
-    """Search books fulltext for current connected device"""
+async def search_books_in_bookshelf(current_device: Annotated[str, Depends(get_auth_device)], mydb: Annotated[AsyncPooledConnection, Depends(get_async_db, scope="function")], query: str, \
+    limit: Union[int, None] = Query(None, ge=1), offset: int = Query(0, ge=0)) -> Book.BookSearch:
+    """Search books fulltext for current connected device, best matches first"""
     device = current_device.get('device')
     user = current_device.get('user')
-    results = await Book.getSearchResults(device['id'], user['id'], query)    
+    results = await Book.getSearchResults(mydb, device['id'], user['id'], query, limit, offset)    
     list_title = str(len(results))
     list_title += " books " if len(results) > 1 else " book "
     list_title += "for \""+query+"\""
     return {"list_title": list_title, "items":results}
 
 @router.get("/shelf")
-async def get_books_in_bookshelf(current_device: Annotated[str, Depends(get_auth_device)], numshelf: Union[int, None] = None) -> Book.BookShelf:
+async def get_books_in_bookshelf(current_device: Annotated[str, Depends(get_auth_device)], mydb: Annotated[AsyncPooledConnection, Depends(get_async_db, scope="function")], numshelf: Union[int, None] = None) -> Book.BookShelf:
     """Get books list for current connected device"""
     device = current_device.get('device')
     user = current_device.get('user')
-    elements = await Book.getBooksForShelf(numshelf, device, user)
+    elements = await Book.getBooksForShelf(mydb, numshelf, device, user)
     return {"list_title": device['arduino_name'], "books":elements}
\ No newline at end of file
@@ -19,7 +19,8 @@ from fastapi import APIRouter, Depends, HTTPException, Query, status
 from fastapi.responses import StreamingResponse
 from typing import Annotated, List, Union
 from models import Customize
-from dependencies import get_auth_device
+from db import PooledConnection
+from dependencies import get_auth_device, get_db
 import json
 import tools
 
@@ -31,11 +32,11 @@ router = APIRouter(
 )
 
 @router.get("/listcodes")
-async def get_codes_list(current_device: Annotated[str, Depends(get_auth_device)]) -> Customize.CustomCodes:
+def get_codes_list(current_device: Annotated[str, Depends(get_auth_device)], mydb: Annotated[PooledConnection, Depends(get_db, scope="function")]) -> Customize.CustomCodes:
     """Get list of published custom codes for current device"""
     device = current_device.get('device')
     user = current_device.get('user')
-    codelist = Customize.getCustomcodes(device['id'], user['id'], True)
+    codelist = Customize.getCustomcodes(mydb, device['id'], user['id'], True)
     if codelist is None:
         raise HTTPException(
             status_code=404,
@@ -44,11 +45,11 @@ async def get_codes_list(current_device: Annotated[str, Depends(get_auth_device)
     return {"list_title": f"Your codes for {device['arduino_name']}", "items":codelist}
 
 @router.get("/code/{code_id}")
-async def get_code(current_device: Annotated[str, Depends(get_auth_device)], code_id: int) -> Customize.CustomCode:
+def get_code(current_device: Annotated[str, Depends(get_auth_device)], mydb: Annotated[PooledConnection, Depends(get_db, scope="function")], code_id: int) -> Customize.CustomCode:
     """Get custom code for current device"""
     device = current_device.get('device')
     user = current_device.get('user')
-    customcode = Customize.getCustomCode(code_id, device['id'], user['id'])
+    customcode = Customize.getCustomCode(mydb, code_id, device['id'], user['id'])
     if customcode is None:
         raise HTTPException(
             status_code=404,
@@ -65,11 +66,11 @@ async def get_native_effects(current_device: Annotated[str, Depends(get_auth_dev
     return {"list_title": f"Effects for {device['arduino_name']}", "items":effects}
 
 @router.get("/customcolors")
-async def get_custom_colors(current_device: Annotated[str, Depends(get_auth_device)]):
+def get_custom_colors(current_device: Annotated[str, Depends(get_auth_device)], mydb: Annotated[PooledConnection, Depends(get_db, scope="function")]):
     """Get customzied coords of colors for current device"""
     device = current_device.get('device')
     user = current_device.get('user')     
-    dbcoords = Customize.getCustomcolors(device['id'], user['id'])
+    dbcoords = Customize.getCustomcolors(mydb, device['id'], user['id'])
     if dbcoords is None:
         raise HTTPException(
             status_code=404,
@@ -18,7 +18,8 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from typing import Annotated, List
 from models import Device, Token
-from dependencies import get_auth_device
+from db import PooledConnection
+from dependencies import get_auth_device, get_db
 import tools
 
 router = APIRouter(
@@ -29,11 +30,11 @@ router = APIRouter(
 )
 
 @router.get("/discover/{uuid}") #, response_model=Device.Device)
-async def get_device_infos(uuid: str) -> Device.Device:
+def get_device_infos(uuid: str, mydb: Annotated[PooledConnection, Depends(get_db, scope="function")]) -> Device.Device:
     """Get device infos for current BLE uuid and generate device's token"""
     uuid = tools.uuidDecode(uuid) 
     if uuid:
-        device = Device.getDeviceForUuid(uuid)
+        device = Device.getDeviceForUuid(mydb, uuid)
         device_token = Token.set_device_token('guest', uuid, 5)
         total_leds = device['nb_lines'] * device['nb_cols']
         device.update({"total_leds": total_leds})
@@ -43,7 +44,7 @@ async def get_device_infos(uuid: str) -> Device.Device:
 
 # join device using token
 @router.post("/login")
-async def login_to_device(device_token: str) -> Token.AccessToken:
+def login_to_device(device_token: str, mydb: Annotated[PooledConnection, Depends(get_db, scope="function")]) -> Token.AccessToken:
     """Get auth on device with device_token and generate access_token for datas"""
     uuid = Token.verify_device_token('guest', device_token)
     if uuid is False:
@@ -51,8 +52,8 @@ async def login_to_device(device_token: str) -> Token.AccessToken:
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid device token"
         )
-    user = Device.getUserForUuid(uuid)
-    device = Device.getDeviceForUuid(uuid)
+    user = Device.getUserForUuid(mydb, uuid)
+    device = Device.getDeviceForUuid(mydb, uuid)
     if not user:
         raise HTTPException(status_code=403)
     if not device:
@@ -64,10 +65,10 @@ async def login_to_device(device_token: str) -> Token.AccessToken:
     return Token.AccessToken(access_token=access_token, token_type="bearer")
 
 @router.get("/list")
-async def get_devices_for_user(current_device: Annotated[str, Depends(get_auth_device)]) -> List[Device.Device]:
+def get_devices_for_user(current_device: Annotated[str, Depends(get_auth_device)], mydb: Annotated[PooledConnection, Depends(get_db, scope="function")]) -> List[Device.Device]:
     """Get devices infos for current user"""
     user = current_device.get('user')
-    devices = Device.getDevicesForUser(user['id']) 
+    devices = Device.getDevicesForUser(mydb, user['id']) 
     if devices:
         return devices
     raise HTTPException(status_code=404)
\ No newline at end of file
@@ -15,13 +15,14 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #==============================================================================
 
-from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
 from fastapi.responses import StreamingResponse
 from typing import Annotated, List, Union
-from asyncio import sleep
-from models import Book, Device, Location, Position, Tag, Token
-from dependencies import get_auth_device
-import json
+from models import Device, Location, Position, Tag, Token
+from db import PooledConnection
+from dependencies import get_auth_device, get_db
+from config import settings
+import broker, db, eventlog, json, time, wire
 import tools
 
 router = APIRouter(
@@ -34,8 +35,8 @@ router = APIRouter(
 '''used when no color is customized : blue'''
 color_default = '51, 102, 255'
 
-def auth_device_token(uuid: str, device_token: str):
-    """For Event source, verify that uuid has a valid session"""
+def auth_device_token(uuid: str, device_token: str, mydb: Annotated[PooledConnection, Depends(get_db, scope="function")]):
+    """For Event source, verify that uuid has a valid session : connection is given back before streaming starts"""
     token_decode = Token.verify_device_token('guest', device_token)
     uuid_decode = tools.uuidDecode(uuid)
     if token_decode is False:
@@ -48,15 +49,20 @@ def auth_device_token(uuid: str, device_token: str):
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid device"
         )
-    device = Device.getDeviceForUuid(uuid_decode)
+    device = Device.getDeviceForUuid(mydb, uuid_decode)
     return device
 
-async def events_generator(app_id, source):
-    # get location requests data for turning on leds on device
-    requests = Location.getRequests(app_id, 'add', source)
+async def events_generator(mydb, app_id, source):
+    # get location requests data for turning on leds on device, and requests removed when leds are turned off
+    requests = await Location.getRequestsForEvents(mydb, app_id)
+    #for requests coming from mobile, we don't need to send location generated on mobile : events are already sent to device
+    add_requests = [data for data in requests if data['action'] == 'add' and (source != 'mobile' or data['client'] == 'server')]
+    remove_requests = [data for data in requests if data['action'] == 'remove']
+    reset_requests = [data for data in requests if data['action'] == 'reset' and data['client'] == 'server']
+
     data_to_add = []
     blocks = []
-    for i, data in enumerate(requests):
+    for i, data in enumerate(add_requests):
         #build simple requests blocks for gaming
         if data['id_node'] == 0: 
             blocks.append({'action':data['action'], 'row':data['row'], 'index':i, 'start':data['led_column'], \
@@ -66,139 +72,189 @@ async def events_generator(app_id, source):
             data_to_add.append({'action':data['action'], 'row':data['row'], \
             'led_column':data['led_column'], 'interval':data['range'], 'id_tag':data['id_tag'], \
             'color':data['color'], 'id_node':data['id_node'], 'client':data['client'], 'date_add':data['date_add']})
-        # set as sent for mobile (leds are already on)
-        if source == 'mobile':
-            Location.setRequestSent(app_id, data['id_node'], 1)
+    # set as sent for mobile (leds are already on)
+    if source == 'mobile':
+        await Location.setRequestsSent(mydb, app_id, {data['id_node'] for data in add_requests}, 1)
     # group positions by block
     data_to_add.sort(key=tools.sortPositions)
     blocks += tools.buildBlockPosition(data_to_add, 'add')
 
     # remove data request when leds are turned off from device
-    requests = Location.getRequests(app_id, 'remove')
-    data_to_remove = []
-    if requests:
+    if remove_requests:
         #soft remove   
-        for data in requests:
+        data_to_remove = []
+        for data in remove_requests:
           #send remove for mobile only when request come from server 
           if (source == 'mobile' and data['client']=='server') or (source == 'server'):
             data_to_remove.append({'action':data['action'], 'row':data['row'], 'led_column':data['led_column'], \
           'interval':data['range'], 'id_tag':'', 'color':'', 'id_node':data['id_node'], 'client':data['client'], 'date_add':data['date_add']})
         data_to_remove.sort(key=tools.sortPositions)
         blocks += tools.buildBlockPosition(data_to_remove, 'remove')   
-        #hard remove
-        for data in requests:
-            diff = tools.seconds_between_now(data['date_add'])
-            #wait for other clients before remove
-            if diff > 3:
-                Location.removeRequest(app_id, data['led_column'], data['row'])
+        #hard remove is done by sweeper, once other clients had time to get them
 
     # manage reset requests coming from distant app
-    requests = Location.getRequests(app_id, 'reset', 'mobile')
-    if requests:
+    if reset_requests:
         #soft remove   
-        for data in requests:
+        for data in reset_requests:
             #send remove for mobile only when request come from server 
             if (source == 'mobile' and data['client']=='server') or (source == 'server'):
                 blocks.append({'action':data['action'], 'client':data['client']})
         # clean reset request sent
         if source == 'mobile':
-            Location.removeResetRequest(app_id) 
+            await Location.removeResetRequest(mydb, app_id) 
 
     return blocks
 
+def getLastEventId(request):
+    """Id of last event received by device before reconnection, None for a new stream"""
+    try:
+        return int(request.headers.get('last-event-id'))
+    except (TypeError, ValueError):
+        return None
+
+async def events_stream(request, app_id, source, compact = False):
+    """Long lived stream : requests are read when a location write of app is published, or at poll interval for other workers.
+    Events of app are logged with an id, a reconnecting device gets the ones it missed since its Last-Event-ID.
+    Compact streams send blocks as base64 wire frames instead of json"""
+    yield f"retry: {settings.sse_retry}\n\n"
+    subscription = broker.getBroker().subscribe(app_id)
+    log = eventlog.getLog()
+    cursor = getLastEventId(request)
+    first_poll = cursor is None
+    try:
+        poll_at = 0
+        while not await request.is_disconnected():
+            now = time.monotonic()
+            if now >= poll_at:
+                poll_at = now + settings.sse_poll_interval
+                async with await db.getMyAsyncDB() as mydb:
+                    try:
+                        last_id = await log.lock(mydb, app_id)
+                        # new stream, or log reset since last event
+                        if cursor is None or cursor > last_id:
+                            cursor = last_id
+                        data = await events_generator(mydb, app_id, source)
+                        if data:
+                            # requests not consumed by source are read again at each poll : logged once
+                            previous = await log.last(mydb, app_id, source, last_id)
+                            if previous is None or json.dumps(previous.data, default=str) != json.dumps(data, default=str):
+                                last_id = await log.append(mydb, app_id, source, data, last_id)
+                            elif first_poll:
+                                # new stream gets current requests
+                                cursor = min(cursor, previous.id - 1)
+                        first_poll = False
+                        await mydb.commit()
+                        events = await log.since(mydb, app_id, cursor, last_id)
+                        await mydb.commit()
+                    except Exception:
+                        await mydb.rollback()
+                        raise
+                cursor = last_id
+                for event in events:
+                    if event.source == source:
+                        payload = wire.encodeData(event.data) if compact else json.dumps(event.data, default=str)
+                        yield f"id: {event.id}\nevent: location\ndata: {payload}\n\n"
+            timeout = min(settings.sse_heartbeat, max(poll_at - time.monotonic(), 0))
+            if await subscription.wait(timeout):
+                poll_at = 0
+            elif time.monotonic() < poll_at:
+                yield ": heartbeat\n\n"
+    finally:
+        subscription.close()
+
 @router.get("/events/{source}")
-async def manage_requested_positions_for_event_stream(device: Annotated[str, Depends(auth_device_token)], uuid: str, device_token: str, source: str = 'mobile') -> Location.EventLocations:
-    """Used with SSE: check if location request is sent to device, turn on light, and then remove request if leds are turned off"""
-    data = await events_generator(device['id'], source)
-    data = json.dumps(data, default=str)
-    msg = f"event: location\ndata: {data}\n\n"
-    return StreamingResponse(msg, media_type="text/event-stream")
+async def manage_requested_positions_for_event_stream(device: Annotated[str, Depends(auth_device_token)], request: Request, uuid: str, device_token: str, source: str = 'mobile', \
+    format: Union[str, None] = Query(None, pattern="^(json|frames)$")) -> Location.EventLocations:
+    """Used with SSE: stream location requests to device for turning on lights, and removals when leds are turned off.
+    Compact frames (see wire.py) are sent with format=frames, or when Accept header has application/vnd.bibliobus.frames"""
+    compact = wire.isRequested(request, format)
+    return StreamingResponse(events_stream(request, device['id'], source, compact), media_type="text/event-stream", \
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @router.post("/book/{book_id}")
-def create_request_for_book_location(current_device: Annotated[str, Depends(get_auth_device)], book_id: int, color: Union[str, None] = None, \
+def create_request_for_book_location(current_device: Annotated[str, Depends(get_auth_device)], mydb: Annotated[PooledConnection, Depends(get_db, scope="function")], book_id: int, color: Union[str, None] = None, \
   action: Union[str, None] = 'add', client: Union[str, None] = 'mobile') -> List[Location.Location] :
     """Get book position in current bookshelf and create location requests for lighting on (action 'add') or off leds (action 'remove')"""
     user = current_device.get('user')
     device = current_device.get('device')
-    address = Position.getPositionForBook(device['id'], book_id)
+    address = Position.getPositionForBook(mydb, device['id'], book_id)
     if address:
         position = []
         now = tools.getNow()
         dateTime = now.strftime("%Y-%m-%d %H:%M:%S")        
-        Location.newRequest(device['id'], book_id, address['row'], address['position'], address['range'], \
+        Location.newRequest(mydb, device['id'], book_id, address['row'], address['position'], address['range'], \
          address['led_column'], 'book', client, action, dateTime, None, color)
         position.append({'action':action, 'row':address['row'], 'index': address['position'], 'start':address['led_column'], \
             'interval':address['range'], 'nodes': [book_id], 'borrowed':address['borrowed'], \
             'color':color, 'client':client, 'date_add':dateTime})
         return position
 
+def light_books(mydb, device, addresses, action, client, tag_id = None, color = None):
+    """Save location requests for books addresses at once, and build leds blocks"""
+    now = tools.getNow()
+    dateTime = now.strftime("%Y-%m-%d %H:%M:%S")
+    #save requests
+    Location.newRequests(mydb, device['id'], addresses, client, action, dateTime, tag_id, color)
+    positions = []
+    for address in addresses:
+        positions.append({'item':address['title'], 'action':action, 'row':address['row'], 'led_column':address['led_column'], \
+        'interval':address['range'], 'id_tag':tag_id, 'color':color, 'id_node':address['id_item'], 'client':client, \
+        'date_add':dateTime})
+
+    '''sort elements for block build'''
+    positions.sort(key=tools.sortPositions)
+    return tools.buildBlockPosition(positions, action)
+
 @router.post("/tag/{tag_id}")
-def create_request_for_tag_location(current_device: Annotated[str, Depends(get_auth_device)], tag_id: int, action: Union[str, None] = 'add', \
+def create_request_for_tag_location(current_device: Annotated[str, Depends(get_auth_device)], mydb: Annotated[PooledConnection, Depends(get_db, scope="function")], tag_id: int, action: Union[str, None] = 'add', \
     client: Union[str, None] = 'mobile') -> List[Location.Location] :
     """Get books position for tags in current bookshelf and create location requests for lighting on (action 'add') or off leds (action 'remove')"""
     user = current_device.get('user')
     device = current_device.get('device')
-    nodes = Tag.getBooksForTag(tag_id, device['id'])
-    tag = Tag.getTagById(tag_id, user['id'])
-
-    if tag['color'] is not None:
-      colors = tag['color'].split(",")
-      tag['red'] = colors[0]
-      tag['green'] = colors[1]
-      tag['blue'] = colors[2]
-    else:
+    tag = Tag.getTagById(mydb, tag_id, user['id'])
+    if tag['color'] is None:
       tag['color'] = color_default
+    addresses = Location.getAddressesForTag(mydb, device['id'], user['id'], tag_id)
+    return light_books(mydb, device, addresses, action, client, tag_id, tag['color'])
 
-    positions = []
-    now = tools.getNow()
-    dateTime = now.strftime("%Y-%m-%d %H:%M:%S")
-    if nodes:
-      for node in nodes:
-        address = Position.getPositionForBook(device['id'], node['id_node'])
-        if address:
-          book = Book.getBook(node['id_node'], user['id'])
-          #save request
-          Location.newRequest(device['id'], node['id_node'], address['row'], address['position'], address['range'], \
-            address['led_column'], 'book', client, action, dateTime, tag_id, tag['color'])
-
-          positions.append({'item':book['title'], 'action':action, 'row':address['row'], 'led_column':address['led_column'], \
-          'interval':address['range'], 'id_tag':tag_id, 'color':tag['color'], 'id_node':node['id_node'], 'client':client, \
-          'date_add':dateTime})
-
-    '''sort elements for block build'''
-    positions.sort(key=tools.sortPositions)
-    blocks = tools.buildBlockPosition(positions, action)
-    return blocks
+@router.post("/books")
+def create_request_for_books_location(current_device: Annotated[str, Depends(get_auth_device)], mydb: Annotated[PooledConnection, Depends(get_db, scope="function")], book_ids: List[int], \
+    color: Union[str, None] = None, action: Union[str, None] = 'add', client: Union[str, None] = 'mobile') -> List[Location.Location] :
+    """Get positions of books list in current bookshelf and create location requests for lighting on (action 'add') or off leds (action 'remove')"""
+    user = current_device.get('user')
+    device = current_device.get('device')
+    addresses = Location.getAddressesForBooks(mydb, device['id'], user['id'], list(dict.fromkeys(book_ids)))
+    return light_books(mydb, device, addresses, action, client, None, color)
 
-def manage_position(device, item_id, position, action, color):
+def manage_position(mydb, device, item_id, position, action, color):
     now = tools.getNow()
     dateTime = now.strftime("%Y-%m-%d %H:%M:%S")
-    Location.newRequest(device['id'], item_id, position['row'], position['start'], position['interval'], position['start'], 'book', 'server', \
+    Location.newRequest(mydb, device['id'], item_id, position['row'], position['start'], position['interval'], position['start'], 'book', 'server', \
         action, dateTime, None, color)
     position.update({'nodes':[item_id], 'index':position['start'], 'date_add': dateTime, 'action': action, 'client': 'server', 'color': color})
     return position
 
 @router.put("/position/{item_id}")
-def ask_position(current_device: Annotated[str, Depends(get_auth_device)], pos: Location.Position, item_id: str) -> Location.Location:
+def ask_position(current_device: Annotated[str, Depends(get_auth_device)], mydb: Annotated[PooledConnection, Depends(get_db, scope="function")], pos: Location.Position, item_id: str) -> Location.Location:
     """Turn on leds for position in the lighting system. Used for tiers API (could be retrieved with server send event)"""
     device = current_device.get('device')
     position = pos.dict()
     action = "add"
     color = "{},{},{}".format(position['red'], position['green'], position['blue'])
-    return manage_position(device, item_id, position, action, color)
+    return manage_position(mydb, device, item_id, position, action, color)
 
 @router.delete("/position/{item_id}")
-def del_position(current_device: Annotated[str, Depends(get_auth_device)], pos: Location.Position, item_id: str) -> Location.Location:
+def del_position(current_device: Annotated[str, Depends(get_auth_device)], mydb: Annotated[PooledConnection, Depends(get_db, scope="function")], pos: Location.Position, item_id: str) -> Location.Location:
     """Turn off leds for position in the lighting system. Used for tiers API (could be retrieved with server send event)"""
     device = current_device.get('device')
     position = pos.dict()
     action = "remove"
     color = "-1"
-    return manage_position(device, item_id, position, action, color)
+    return manage_position(mydb, device, item_id, position, action, color)
 
 @router.put("/reset")
-def update_requests_for_reset(current_device: Annotated[str, Depends(get_auth_device)]):
+def update_requests_for_reset(current_device: Annotated[str, Depends(get_auth_device)], mydb: Annotated[PooledConnection, Depends(get_db, scope="function")]):
     """Force reset all location requests for current device : event stream will delete all remaining requests"""
     device = current_device.get('device')
-    Location.setRequestForRemove(device['id'])
+    Location.setRequestForRemove(mydb, device['id'])
     return {"status": "ok"}
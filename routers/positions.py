@@ -16,9 +16,11 @@
 #==============================================================================
 
 from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
 from typing import Annotated, List, Union
 from models import Position
-from dependencies import get_auth_device
+from db import PooledConnection
+from dependencies import get_auth_device, get_db
 
 router = APIRouter(
     prefix="/positions",
@@ -28,69 +30,101 @@ router = APIRouter(
 )
 
 @router.get("/item/{book_id}")
-async def get_position_for_item(current_device: Annotated[str, Depends(get_auth_device)], book_id: int) -> Position.Position:
+def get_position_for_item(current_device: Annotated[str, Depends(get_auth_device)], mydb: Annotated[PooledConnection, Depends(get_db, scope="function")], book_id: int) -> Position.Position:
     """Get book position in current bookshelf"""
     user = current_device.get('user')
     device = current_device.get('device')
-    position = Position.getPositionForBook(device['id'], book_id)
+    position = Position.getPositionForBook(mydb, device['id'], book_id)
     if not position:
         raise HTTPException(status_code=404)
     return position
 
 @router.post("/item")
-async def create_position_for_item(current_device: Annotated[str, Depends(get_auth_device)], item: Position.Position) -> Position.Position:
+async def create_position_for_item(current_device: Annotated[str, Depends(get_auth_device)], mydb: Annotated[PooledConnection, Depends(get_db, scope="function")], item: Position.PositionEdit) -> Position.Position:
     """set new position for book : if exists, return error"""
     user = current_device.get('user')
     device = current_device.get('device')
     positionDict = item.dict()
     book_id = positionDict['id_item']
-    position = Position.newPositionForBook(device, book_id, positionDict)
+    async with Position.lockRows(device['id'], [positionDict['row']]):
+        position = await run_in_threadpool(Position.newPositionForBook, mydb, device, book_id, positionDict)
+        await run_in_threadpool(mydb.commit)
     return position
 
+@router.post("/items")
+async def create_positions_for_items(current_device: Annotated[str, Depends(get_auth_device)], mydb: Annotated[PooledConnection, Depends(get_db, scope="function")], \
+    items: List[Position.PositionEdit]) -> List[Position.Position]:
+    """set new positions for many books : if one exists or places are taken, return errors and save nothing"""
+    device = current_device.get('device')
+    if not items:
+        return []
+    async with Position.lockRows(device['id'], [item.row for item in items]):
+        positions = await run_in_threadpool(Position.newPositionsForBooks, mydb, device, [item.dict() for item in items])
+        await run_in_threadpool(mydb.commit)
+    return positions
+
 @router.put("/item")
-async def update_position_for_item(current_device: Annotated[str, Depends(get_auth_device)], item: Position.Position) -> Position.Position:
+async def update_position_for_item(current_device: Annotated[str, Depends(get_auth_device)], mydb: Annotated[PooledConnection, Depends(get_db, scope="function")], item: Position.PositionEdit) -> Position.Position:
     """update position for book : be carefull, this is not for changing led position"""
     user = current_device.get('user')
     device = current_device.get('device')
     positionDict = item.dict()
-    book_id = positionDict['id_item']
-    Position.setPosition(device['id'], book_id, positionDict['position'], positionDict['row'], \
-     positionDict['range'], 'book', positionDict['led_column'], 0, positionDict['borrowed'])
-    position = Position.getPositionForBook(device['id'], book_id)
+    current = await run_in_threadpool(Position.getPositionForBook, mydb, device['id'], positionDict['id_item'])
+    rows = [positionDict['row']] + ([current['row']] if current else [])
+    async with Position.lockRows(device['id'], rows):
+        position = await run_in_threadpool(Position.updatePosition, mydb, device, positionDict)
+        await run_in_threadpool(mydb.commit)
     return position
 
 @router.delete("/item")
-async def delete_position_for_item(current_device: Annotated[str, Depends(get_auth_device)], item: Position.Position):
+async def delete_position_for_item(current_device: Annotated[str, Depends(get_auth_device)], mydb: Annotated[PooledConnection, Depends(get_db, scope="function")], item: Position.Position):
     """delete position for given book"""
     user = current_device.get('user')
     device = current_device.get('device')
     positionDict = item.dict()
     book_id = positionDict['id_item']
-    Position.removePositionForBook(device, book_id, positionDict)
+    async with Position.lockRows(device['id'], [positionDict['row']]):
+        await run_in_threadpool(Position.removePositionForBook, mydb, device, book_id, positionDict)
+        await run_in_threadpool(mydb.commit)
     return {"status": "ok"}
 
 @router.get("/order/{numshelf}")
-async def get_items_order_for_shelf(current_device: Annotated[str, Depends(get_auth_device)], numshelf: int):
-    """Get book positions for current device"""
+def get_items_order_for_shelf(current_device: Annotated[str, Depends(get_auth_device)], mydb: Annotated[PooledConnection, Depends(get_db, scope="function")], numshelf: int):
+    """Get book positions for current device, with row version to send back when editing order"""
     device = current_device.get('device')
     user = current_device.get('user')
     sortable = []
-    positions = Position.getPositionsForShelf(device['id'], numshelf)
+    positions = Position.getPositionsForShelf(mydb, device['id'], numshelf)
     for pos in positions:
         sortable.append({'book':pos['id_item'], 'position':pos['position'], 'fulfillment':int(pos['led_column']+pos['range']), \
             'led_column':pos['led_column'], 'shelf':numshelf})
-    return {"numshelf": numshelf, "positions": sortable}
+    version = Position.getRowVersion(mydb, device['id'], numshelf)
+    return {"numshelf": numshelf, "version": version, "positions": sortable}
+
+@router.patch("/order/{numshelf}")
+async def edit_items_order_for_shelf(current_device: Annotated[str, Depends(get_auth_device)], mydb: Annotated[PooledConnection, Depends(get_db, scope="function")], numshelf: int, \
+    edit: Position.ShelfEdit):
+    """Move, insert or remove books in row order : version must be the one returned with current order, else 409 with current order"""
+    device = current_device.get('device')
+    user = current_device.get('user')
+    async with Position.lockRows(device['id'], [numshelf]):
+        shelf = await run_in_threadpool(Position.editShelf, mydb, user['id'], numshelf, device, edit.version, \
+            [operation.dict() for operation in edit.operations])
+        await run_in_threadpool(mydb.commit)
+        return {"numshelf": numshelf, "version": shelf.row_version, "positions": Position.getShelfOrder(shelf, numshelf)}
 
 @router.put("/order/{numshelf}")
-def update_items_order_for_shelf(current_device: Annotated[str, Depends(get_auth_device)], numshelf: int, \
-    book_ids: List[int] = Query(None), reset_positions: Union[bool, None] = None):
-    """Order positions and compute intervals for given books list ids"""
+async def update_items_order_for_shelf(current_device: Annotated[str, Depends(get_auth_device)], mydb: Annotated[PooledConnection, Depends(get_db, scope="function")], numshelf: int, \
+    book_ids: List[int] = Query(None), reset_positions: Union[bool, None] = None, version: Union[int, None] = None):
+    """Order positions and compute intervals for given books list ids : if version is given, 409 when row changed since"""
     device = current_device.get('device')
     user = current_device.get('user')
     # set positions and intervals for books
     positions = None
     if book_ids is not None:
-        if reset_positions:
-            Position.cleanPositionsForShelf(device['id'], numshelf)
-        positions = Position.updatePositionsForShelf(user['id'], numshelf, book_ids, device)
-    return {"numshelf": numshelf, "positions": positions}
\ No newline at end of file
+        async with Position.lockRows(device['id'], [numshelf]):
+            positions = await run_in_threadpool(Position.updatePositionsForShelf, mydb, user['id'], numshelf, book_ids, device, \
+                reset_positions, version)
+            await run_in_threadpool(mydb.commit)
+    version = await run_in_threadpool(Position.getRowVersion, mydb, device['id'], numshelf)
+    return {"numshelf": numshelf, "version": version, "positions": positions}
@@ -17,8 +17,9 @@
 
 from fastapi import APIRouter, Depends, HTTPException, Query
 from typing import Annotated, List, Union
-from models import Book, Device, Location, Position, Tag
-from dependencies import get_auth_device
+from models import Book, Position, Tag
+from db import AsyncPooledConnection
+from dependencies import get_async_db, get_auth_device
 import tools
 
 router = APIRouter(
@@ -29,65 +30,57 @@ router = APIRouter(
 )
 
 @router.get("/books/{tag_id}")
-async def get_books_for_tag(current_device: Annotated[str, Depends(get_auth_device)], tag_id: int) -> Tag.TagBooksList:
+async def get_books_for_tag(current_device: Annotated[str, Depends(get_auth_device)], mydb: Annotated[AsyncPooledConnection, Depends(get_async_db, scope="function")], tag_id: int) -> Tag.TagBooksList:
     """Get books list for given tag"""
     device = current_device.get('device')
     user = current_device.get('user')
-    nodes = Tag.getBooksForTag(tag_id, device['id'])
-    tag = Tag.getTagById(tag_id, user['id'])
-    if not nodes:
+    tag = await Tag.getTagByIdAsync(mydb, tag_id, user['id'])
+    rows = await Tag.getBooksWithPositionsForTag(mydb, tag_id, user['id'], device['id'])
+    if not tag or not rows:
         raise HTTPException(status_code=404)
-    data = {}
-    data['list_title'] = tag['tag']
     books = []
-    for i in range(len(nodes)):
-        book = Book.getBook(nodes[i]['id_node'], user['id'])
-        address = Position.getPositionForBook(device['id'], book['id'])
-        if address:
-            requested = Location.getRequestForPosition(device['id'], address['position'], address['row'])
-            if requested:
-                book.update({'requested': True})
-            books.append({'book':book, 'address':address, 'color':tag['color']})
-    data['elements'] = books        
-    return data
+    for row in rows:
+        # tagged books not placed in bookshelf are not listed
+        if row['id_item'] is None:
+            continue
+        book = {field: row[field] for field in Book.Book.model_fields if field in row}
+        book['requested'] = bool(row['requested'])
+        address = {field: row[field] for field in Position.Position.model_fields}
+        books.append({'book':book, 'address':address, 'color':tag['color']})
+    return {'list_title': tag['tag'], 'elements': books}
 
 @router.get("/authors")
-async def get_authors_in_bookshelf(current_device: Annotated[str, Depends(get_auth_device)]) -> Tag.TagListAuthors:
-    """Get authors tags for current bookshelf"""
+async def get_authors_in_bookshelf(current_device: Annotated[str, Depends(get_auth_device)], mydb: Annotated[AsyncPooledConnection, Depends(get_async_db, scope="function")], \
+    initial: Union[str, None] = Query(None, min_length=1, max_length=1)) -> Tag.TagListAuthors:
+    """Get authors tags for current bookshelf, grouped by initial : '#' for names not starting with a letter"""
     device = current_device.get('device')
     user = current_device.get('user')    
     data = {}
     data['list_title'] = device['arduino_name']
     data['elements']=[]
     alphabet = ["a","b","c","d","e","f","g","h","i","j","k","l","m","n","o","p","q","r","s","t","u","v","w","x","y","z"]
-    for i in range(len(alphabet)):
-        items = await Tag.getAuthorsForApp(device['id'], alphabet[i])
-        if items:
+    initials = {letter: [] for letter in alphabet + ['#']}
+    if initial is not None:
+        initial = initial if initial == '#' else tools.getInitial(initial)
+        initials = {initial: []}
+    # filtered by initial in query, grouped here with accents removed
+    for item in await Tag.getAuthorsForApp(mydb, device['id'], initial):
+        items = initials.get(tools.getInitial(item['tag']))
+        if items is not None:
             '''set url for authenticate requesting location from app'''
-            for j in range(len(items)):
-                items[j]['url'] = f"/locations/tag/{items[j]['id']}"
-                hasRequest = Location.getRequestForTag(device['id'], items[j]['id'])
-                items[j]['hasRequest'] = hasRequest['nb_requests']
-        data['elements'].append({'initial':alphabet[i],'items':items})
+            item['url'] = f"/locations/tag/{item['id']}"
+            items.append(item)
+    for letter, items in initials.items():
+        if letter != '#' or items or initial is not None:
+            data['elements'].append({'initial':letter,'items':items})
     return data
 
 @router.get("/categories")
-async def get_categories_for_bookshelf(current_device: Annotated[str, Depends(get_auth_device)]) -> Tag.TagListCategories:
+async def get_categories_for_bookshelf(current_device: Annotated[str, Depends(get_auth_device)], mydb: Annotated[AsyncPooledConnection, Depends(get_async_db, scope="function")]) -> Tag.TagListCategories:
+    """Get categories tags for current bookshelf, with requests count and leds color"""
     device = current_device.get('device')
     user = current_device.get('user')    
-    categories = await Tag.getCategoriesForApp(user['id'], device['id'])
-    data = {}
-    data['list_title'] = device['arduino_name']
-    if categories:
-        for i in range(len(categories)):
-            hasRequest = Location.getRequestForTag(device['id'], categories[i]['id'])
-            categories[i]['url'] = f"/locations/tag/{categories[i]['id']}"
-            categories[i]['hasRequest'] = hasRequest['nb_requests']
-            if categories[i]['color'] is not None:
-                colors = categories[i]['color'].split(",")
-                categories[i]['red'] = colors[0]
-                categories[i]['green'] = colors[1]
-                categories[i]['blue'] = colors[2]
-        data['elements']=categories
-        #print(data)
-        return data
\ No newline at end of file
+    categories = await Tag.getCategoriesForApp(mydb, user['id'], device['id'])
+    for category in categories:
+        category['url'] = f"/locations/tag/{category['id']}"
+    return {'list_title': device['arduino_name'], 'elements': categories}
@@ -0,0 +1,219 @@
+#==============================================================================
+# Copyright (C) 2024  Emmanuel Mazurier <contact@bibliob.us>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#==============================================================================
+
+from bisect import bisect_left
+from config import settings
+from tools import fold
+import logging, re, threading, time
+import mysql.connector
+import db
+
+logger = logging.getLogger(__name__)
+
+'''searchable fields of biblio_search with their weight for ranking'''
+fields = {'title': 3, 'author': 2, 'tags': 1}
+
+'''match weights : exact word, word prefix, inside word'''
+match_exact = 3
+match_prefix = 2
+match_infix = 1
+
+def tokenize(text):
+  return re.findall(r'\w+', fold(text))
+
+def trigrams(token):
+  return {token[i:i+3] for i in range(len(token) - 2)}
+
+class SearchIndex:
+  '''inverted index of biblio_search rows for one app, built for search version of app'''
+
+  def __init__(self, app_id, version = 0):
+    self.app_id = app_id
+    self.version = version
+    self.built_at = time.monotonic()
+    self.docs = {}
+    # token -> {doc id: best field weight}
+    self.postings = {}
+    # trigram -> tokens, for matching inside words
+    self.grams = {}
+    self._vocabulary = None
+
+  def add(self, row):
+    self.remove(row['id'])
+    self.docs[row['id']] = row
+    for field, weight in fields.items():
+      for token in tokenize(row.get(field)):
+        docs = self.postings.get(token)
+        if docs is None:
+          docs = self.postings[token] = {}
+          self._vocabulary = None
+          for gram in trigrams(token):
+            self.grams.setdefault(gram, set()).add(token)
+        if docs.get(row['id'], 0) < weight:
+          docs[row['id']] = weight
+
+  def remove(self, doc_id):
+    row = self.docs.pop(doc_id, None)
+    if row is None:
+      return
+    for field in fields:
+      for token in tokenize(row.get(field)):
+        docs = self.postings.get(token)
+        if docs is None:
+          continue
+        docs.pop(doc_id, None)
+        if not docs:
+          del self.postings[token]
+          self._vocabulary = None
+          for gram in trigrams(token):
+            tokens = self.grams.get(gram)
+            if tokens is not None:
+              tokens.discard(token)
+              if not tokens:
+                del self.grams[gram]
+
+  def vocabulary(self):
+    '''sorted tokens for prefix lookup'''
+    if self._vocabulary is None:
+      self._vocabulary = sorted(self.postings)
+    return self._vocabulary
+
+  def matches(self, term):
+    '''tokens matching term with their match weight'''
+    found = {}
+    if term in self.postings:
+      found[term] = match_exact
+    vocabulary = self.vocabulary()
+    i = bisect_left(vocabulary, term)
+    while i < len(vocabulary) and vocabulary[i].startswith(term):
+      found.setdefault(vocabulary[i], match_prefix)
+      i += 1
+    if len(term) >= 3:
+      candidates = None
+      for gram in trigrams(term):
+        tokens = self.grams.get(gram, set())
+        candidates = set(tokens) if candidates is None else candidates & tokens
+        if not candidates:
+          break
+      for token in candidates or ():
+        if term in token:
+          found.setdefault(token, match_infix)
+    return found
+
+  def search(self, query, limit = None, offset = 0):
+    '''rows matching all query terms, best ranked first'''
+    terms = tokenize(query)
+    if not terms:
+      return []
+    scores = None
+    for term in terms:
+      termScores = {}
+      for token, weight in self.matches(term).items():
+        for doc_id, fieldWeight in self.postings[token].items():
+          score = weight * fieldWeight
+          if termScores.get(doc_id, 0) < score:
+            termScores[doc_id] = score
+      if scores is None:
+        scores = termScores
+      else:
+        scores = {doc_id: score + termScores[doc_id] for doc_id, score in scores.items() if doc_id in termScores}
+      if not scores:
+        return []
+    ranked = sorted(scores, key=lambda doc_id: (-scores[doc_id], fold(self.docs[doc_id].get('title'))))
+    end = None if limit is None else offset + limit
+    return [self.docs[doc_id] for doc_id in ranked[offset:end]]
+
+_indexes = {}
+_dirty = set()
+_dirty_lock = threading.Lock()
+
+def invalidateBook(mydb, book_id, app_ids = ()):
+  invalidateBooks(mydb, [book_id], app_ids)
+
+def invalidateBooks(mydb, book_ids, app_ids = ()):
+  '''books indexed content or app changed : refreshed on next search, once transaction is committed.
+  called before a change of app, with new app in app_ids : search versions of their apps are incremented then,
+  for indexes of other workers'''
+  book_ids = {int(book_id) for book_id in book_ids}
+  if not book_ids:
+    return
+  cursor = mydb.cursor(dictionary=True)
+  cursor.execute("SELECT DISTINCT id_app FROM biblio_book WHERE id IN (" + ', '.join(['%s'] * len(book_ids)) + ") \
+    and id_app IS NOT NULL", list(book_ids))
+  apps = {row['id_app'] for row in cursor.fetchall()} | {app_id for app_id in app_ids if app_id}
+  def markDirty():
+    with _dirty_lock:
+      _dirty.update(book_ids)
+    bumpVersions(mydb, apps)
+  mydb.onCommit(markDirty)
+
+def bumpVersions(mydb, app_ids):
+  '''increment search versions of apps in a transaction of their own, run once changes are committed'''
+  if not app_ids:
+    return
+  app_ids = sorted(app_ids)
+  try:
+    cursor = mydb.cursor(dictionary=True)
+    cursor.executemany("INSERT INTO biblio_search_version (`id_app`, `version`) VALUES (%s, 1) \
+      ON DUPLICATE KEY UPDATE version=version+1", [(app_id,) for app_id in app_ids])
+    cursor.execute("SELECT id_app, version FROM biblio_search_version WHERE id_app IN (" + \
+      ', '.join(['%s'] * len(app_ids)) + ")", app_ids)
+    versions = cursor.fetchall()
+    mydb.commit()
+  except mysql.connector.Error as e:
+    # changes are saved : other workers see them at index ttl
+    logger.warning("Search version of apps %s not incremented: %s", app_ids, e)
+    try:
+      mydb.rollback()
+    except mysql.connector.Error:
+      pass
+    return
+  # indexes of this worker get changed books from dirty ones : only a version incremented by another worker rebuilds them
+  with _dirty_lock:
+    for row in versions:
+      index = _indexes.get(row['id_app'])
+      if index is not None and index.version == row['version'] - 1:
+        index.version = row['version']
+
+async def getIndex(mydb, app_id):
+  '''get index for app : built from biblio_search, rebuilt when search version of app was changed by another worker,
+  or after ttl'''
+  row = await db.fetchOne(mydb, "SELECT version FROM biblio_search_version WHERE id_app=%s", (app_id,))
+  version = row['version'] if row else 0
+  index = _indexes.get(app_id)
+  if index is None or index.version != version or time.monotonic() - index.built_at > settings.search_index_ttl:
+    index = SearchIndex(app_id, version)
+    for row in await db.fetchAll(mydb, "SELECT * FROM biblio_search where id_app=%s", (app_id,)):
+      index.add(row)
+    _indexes[app_id] = index
+  await refreshDirty(mydb)
+  return index
+
+async def refreshDirty(mydb):
+  with _dirty_lock:
+    if not _dirty:
+      return
+    ids = list(_dirty)
+    _dirty.clear()
+  placeholders = ', '.join(['%s'] * len(ids))
+  rows = await db.fetchAll(mydb, "SELECT * FROM biblio_search where id IN (" + placeholders + ")", ids)
+  for index in _indexes.values():
+    for book_id in ids:
+      index.remove(book_id)
+    for row in rows:
+      if row['id_app'] == index.app_id:
+        index.add(row)
@@ -0,0 +1,8 @@
+-- version of each bookshelf row, incremented by every position write on the row
+-- used for optimistic concurrency of shelf edits and to validate cached row layouts
+CREATE TABLE IF NOT EXISTS `biblio_row_version` (
+  `id_app` int NOT NULL,
+  `row` int NOT NULL,
+  `version` int NOT NULL DEFAULT 0,
+  PRIMARY KEY (`id_app`, `row`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
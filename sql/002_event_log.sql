@@ -0,0 +1,17 @@
+-- location events sent to devices by event stream, replayed from Last-Event-ID on reconnection
+-- event ids follow a sequence by app, locked by the producer until commit
+CREATE TABLE IF NOT EXISTS `biblio_event_seq` (
+  `id_app` int NOT NULL,
+  `last_id` bigint NOT NULL DEFAULT 0,
+  PRIMARY KEY (`id_app`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS `biblio_event` (
+  `id_app` int NOT NULL,
+  `id` bigint NOT NULL,
+  `source` varchar(16) NOT NULL,
+  `data` mediumtext NOT NULL,
+  `date_add` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id_app`, `id`),
+  KEY `date_add` (`date_add`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
@@ -0,0 +1,2 @@
+-- expired remove and reset requests are deleted by the background sweeper of api workers
+ALTER TABLE `biblio_request` ADD INDEX `action_date_add` (`action`, `date_add`);
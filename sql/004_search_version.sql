@@ -0,0 +1,7 @@
+-- version of searchable books of each app, incremented after each committed change of their indexed content
+-- search indexes held in memory by api workers are rebuilt when it was changed by another worker
+CREATE TABLE IF NOT EXISTS `biblio_search_version` (
+  `id_app` int NOT NULL,
+  `version` bigint NOT NULL DEFAULT 0,
+  PRIMARY KEY (`id_app`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
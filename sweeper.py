@@ -0,0 +1,102 @@
+#==============================================================================
+# Copyright (C) 2024  Emmanuel Mazurier <contact@bibliob.us>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#==============================================================================
+
+from datetime import timedelta
+from config import settings
+import asyncio, logging, time
+import db, eventlog, tools
+
+logger = logging.getLogger(__name__)
+
+class Sweeper:
+  '''background task of worker : deletes expired location requests of all apps, and old logged events
+
+  remove requests are kept for remove_grace seconds (at least one stream poll interval) so every client gets them,
+  reset requests not consumed by a mobile app expire after reset_grace seconds
+  '''
+
+  def __init__(self, interval, batch_size, remove_grace, reset_grace):
+    self.interval = interval
+    self.batch_size = batch_size
+    self.remove_grace = remove_grace
+    self.reset_grace = reset_grace
+    self._task = None
+    self.stats = {'runs': 0, 'removed': 0, 'resets': 0, 'errors': 0, 'last_run': None, 'last_duration': None}
+
+  async def deleteExpired(self, mydb, action, grace):
+    '''delete requests of action older than grace seconds by batches, date_add is set by api clock'''
+    before = (tools.getNow() - timedelta(seconds=grace)).strftime("%Y-%m-%d %H:%M:%S")
+    deleted = 0
+    while True:
+      count = await db.execute(mydb, "DELETE FROM biblio_request WHERE `action`=%s and `date_add`<%s LIMIT %s", \
+        (action, before, self.batch_size))
+      await mydb.commit()
+      deleted += count
+      if count < self.batch_size:
+        return deleted
+
+  async def sweep(self):
+    start = time.monotonic()
+    async with await db.getMyAsyncDB() as mydb:
+      try:
+        self.stats['removed'] += await self.deleteExpired(mydb, 'remove', self.remove_grace)
+        self.stats['resets'] += await self.deleteExpired(mydb, 'reset', self.reset_grace)
+        await eventlog.getLog().purge(mydb, settings.event_log_retention, self.batch_size)
+      except Exception:
+        await mydb.rollback()
+        raise
+    self.stats['runs'] += 1
+    self.stats['last_run'] = tools.getNow().strftime("%Y-%m-%d %H:%M:%S")
+    self.stats['last_duration'] = round(time.monotonic() - start, 3)
+
+  async def run(self):
+    while True:
+      await asyncio.sleep(self.interval)
+      try:
+        await self.sweep()
+      except asyncio.CancelledError:
+        raise
+      except Exception:
+        self.stats['errors'] += 1
+        logger.exception("Sweep of location requests failed")
+
+  def start(self):
+    if self._task is None:
+      self._task = asyncio.get_running_loop().create_task(self.run())
+
+  async def stop(self):
+    if self._task is not None:
+      self._task.cancel()
+      try:
+        await self._task
+      except asyncio.CancelledError:
+        pass
+      self._task = None
+
+  def getStats(self):
+    stats = dict(self.stats)
+    stats['running'] = self._task is not None and not self._task.done()
+    return stats
+
+_sweeper = None
+
+def getSweeper():
+  global _sweeper
+  if _sweeper is None:
+    _sweeper = Sweeper(settings.sweeper_interval, settings.sweeper_batch_size, \
+      settings.request_remove_grace, settings.request_reset_grace)
+  return _sweeper
@@ -0,0 +1,80 @@
+#==============================================================================
+# Copyright (C) 2024  Emmanuel Mazurier <contact@bibliob.us>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#==============================================================================
+
+from collections import OrderedDict
+from config import settings
+import threading
+
+class TagCache:
+    '''tag ids by folded label (LRU) and taxonomies by label, shared by requests of worker
+
+    entries are written through by tag resolution once the transaction which read or created them is committed,
+    so ids of rolled back inserts never reach the cache
+    '''
+
+    def __init__(self, max_items):
+        self.max_items = max_items
+        self._tags = OrderedDict()
+        self._taxonomies = {}
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def getTags(self, keys):
+        '''cached ids for folded labels found in cache'''
+        found = {}
+        with self._lock:
+            for key in keys:
+                tag_id = self._tags.get(key)
+                if tag_id is None:
+                    self.stats['misses'] += 1
+                else:
+                    self._tags.move_to_end(key)
+                    self.stats['hits'] += 1
+                    found[key] = tag_id
+        return found
+
+    def storeTags(self, tag_ids):
+        with self._lock:
+            for key, tag_id in tag_ids.items():
+                self._tags[key] = tag_id
+                self._tags.move_to_end(key)
+            while len(self._tags) > self.max_items:
+                self._tags.popitem(last=False)
+
+    def getTaxonomy(self, label):
+        return self._taxonomies.get(label)
+
+    def storeTaxonomy(self, label, taxonomy):
+        self._taxonomies[label] = taxonomy
+
+    def clear(self):
+        with self._lock:
+            self._tags.clear()
+            self._taxonomies.clear()
+
+    def getStats(self):
+        stats = dict(self.stats)
+        stats.update({'tags': len(self._tags), 'taxonomies': len(self._taxonomies)})
+        return stats
+
+_cache = None
+
+def getCache():
+    global _cache
+    if _cache is None:
+        _cache = TagCache(settings.tag_cache_max_items)
+    return _cache
@@ -0,0 +1,109 @@
+#==============================================================================
+# Copyright (C) 2024  Emmanuel Mazurier <contact@bibliob.us>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#==============================================================================
+
+import asyncio
+import httpx, pytest
+from config import settings
+import bookapi
+
+@pytest.fixture
+def provider(monkeypatch):
+  '''stub provider answering with statuses queued in list, or raising queued exceptions'''
+  answers = []
+  calls = []
+  def handler(request):
+    calls.append(request)
+    answer = answers.pop(0)
+    if isinstance(answer, Exception):
+      raise answer
+    return httpx.Response(answer, json={'items': []})
+  monkeypatch.setattr(settings, 'book_api_retries', 1)
+  monkeypatch.setattr(settings, 'book_api_backoff', 0)
+  monkeypatch.setattr(settings, 'book_api_breaker_threshold', 2)
+  monkeypatch.setattr(bookapi, '_client', httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+  monkeypatch.setattr(bookapi, '_breakers', {})
+  return answers, calls
+
+def get():
+  return asyncio.run(bookapi.getJson('stub', 'http://stub/volumes'))
+
+def test_success(provider):
+  answers, calls = provider
+  answers += [200]
+  assert get() == {'items': []}
+  assert bookapi.getBreaker('stub').state() == 'closed'
+
+def test_client_error_is_not_failure(provider):
+  answers, calls = provider
+  answers += [404, 404, 400]
+  for _ in range(3):
+    with pytest.raises(bookapi.ProviderError):
+      get()
+  # not retried, circuit stays closed
+  assert len(calls) == 3
+  assert bookapi.getBreaker('stub').failures == 0
+  assert bookapi.getBreaker('stub').state() == 'closed'
+
+def test_throttling_is_not_failure(provider):
+  answers, calls = provider
+  answers += [429, 429]
+  with pytest.raises(bookapi.ProviderError):
+    get()
+  assert len(calls) == 2
+  assert bookapi.getBreaker('stub').failures == 0
+
+def test_server_errors_and_timeouts_open_circuit(provider):
+  answers, calls = provider
+  answers += [503, 500, httpx.ConnectTimeout('timeout'), httpx.ConnectError('refused')]
+  for _ in range(2):
+    with pytest.raises(bookapi.ProviderError):
+      get()
+  assert bookapi.getBreaker('stub').state() == 'open'
+  with pytest.raises(bookapi.CircuitOpen):
+    get()
+  assert len(calls) == 4
+
+def test_half_open_allows_one_probe(monkeypatch):
+  now = [100.0]
+  monkeypatch.setattr(bookapi.time, 'monotonic', lambda: now[0])
+  breaker = bookapi.CircuitBreaker(threshold=1, reset_timeout=30)
+  breaker.failure()
+  assert not breaker.allow()
+  now[0] += 30
+  assert breaker.state() == 'half-open'
+  assert breaker.allow()
+  # probe in flight : other calls rejected
+  assert not breaker.allow()
+  breaker.failure()
+  assert breaker.state() == 'open'
+  now[0] += 30
+  assert breaker.allow()
+  breaker.success()
+  assert breaker.state() == 'closed'
+  assert breaker.allow() and breaker.allow()
+
+def test_lost_probe_expires(monkeypatch):
+  now = [100.0]
+  monkeypatch.setattr(bookapi.time, 'monotonic', lambda: now[0])
+  breaker = bookapi.CircuitBreaker(threshold=1, reset_timeout=30)
+  breaker.failure()
+  now[0] += 30
+  assert breaker.allow()
+  now[0] += 10
+  assert not breaker.allow()
+  now[0] += 20
+  assert breaker.allow()
@@ -0,0 +1,58 @@
+#==============================================================================
+# Copyright (C) 2024  Emmanuel Mazurier <contact@bibliob.us>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#==============================================================================
+
+import asyncio, threading
+import broker
+
+class Connection:
+  def __init__(self):
+    self.callbacks = []
+
+  def onCommit(self, callback):
+    self.callbacks.append(callback)
+
+  def commit(self):
+    for callback in self.callbacks:
+      callback()
+    self.callbacks = []
+
+def test_committed_change_wakes_streams_of_app():
+  events = broker.Broker()
+  async def stream():
+    watched = events.subscribe(7)
+    other = events.subscribe(8)
+    mydb = Connection()
+    events.notify(mydb, 7)
+    # not committed yet : nothing to send
+    assert not await watched.wait(0.01)
+    # committed from a request thread
+    thread = threading.Thread(target=mydb.commit)
+    thread.start()
+    assert await watched.wait(1)
+    thread.join()
+    assert not await other.wait(0.01)
+    # woken once by change
+    assert not await watched.wait(0.01)
+    watched.close()
+    other.close()
+  asyncio.run(stream())
+  assert events.getStats() == {'published': 1, 'woken': 1, 'apps': 0, 'streams': 0}
+
+def test_publish_without_streams():
+  events = broker.Broker()
+  events.publish(7)
+  assert events.getStats()['woken'] == 0
@@ -0,0 +1,148 @@
+#==============================================================================
+# Copyright (C) 2024  Emmanuel Mazurier <contact@bibliob.us>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#==============================================================================
+
+import threading, time
+import mysql.connector
+import pytest
+import db
+
+class FakeConnection:
+  '''mysql connection opened by pool'''
+
+  def __init__(self):
+    self.closed = False
+    self.rollbacks = 0
+    self.unread_result = False
+    self.broken = False
+
+  def rollback(self):
+    if self.broken:
+      raise mysql.connector.OperationalError("Lost connection")
+    self.rollbacks += 1
+
+  def close(self):
+    self.closed = True
+
+  def is_connected(self):
+    return not self.broken
+
+  def reconnect(self, attempts, delay):
+    self.broken = False
+
+@pytest.fixture
+def opened(monkeypatch):
+  '''connections opened by pool, in order'''
+  connections = []
+  def connect(**args):
+    connections.append(FakeConnection())
+    return connections[-1]
+  monkeypatch.setattr(db.mysql.connector, 'connect', connect)
+  return connections
+
+def pool(**args):
+  return db.ConnectionPool(**dict({'size': 2, 'max_overflow': 1, 'timeout': 0.1, 'leak_timeout': 0}, **args))
+
+def test_checkin_reuses_connection(opened):
+  connections = pool()
+  first = connections.connect()
+  first.close()
+  # closed twice : given back once
+  first.close()
+  second = connections.connect()
+  assert len(opened) == 1
+  assert second._cnx is opened[0]
+  assert opened[0].rollbacks == 1
+  assert connections.status()['idle'] == 0
+  second.close()
+  assert connections.status()['idle'] == 1
+
+def test_overflow_connections_closed_on_checkin(opened):
+  connections = pool()
+  checked_out = [connections.connect() for _ in range(3)]
+  status = connections.status()
+  assert (status['checked_out'], status['overflow'], status['peak']) == (3, 1, 3)
+  # pool keeps size connections : first one given back is over size
+  for proxy in checked_out:
+    proxy.close()
+  status = connections.status()
+  assert (status['idle'], status['overflow'], status['closed']) == (2, 0, 1)
+  assert [cnx.closed for cnx in opened] == [True, False, False]
+
+def test_timeout_when_pool_and_overflow_full(opened):
+  connections = pool()
+  checked_out = [connections.connect() for _ in range(3)]
+  with pytest.raises(db.PoolTimeout):
+    connections.connect()
+  assert connections.status()['timeouts'] == 1
+  # slot freed : new connection opened
+  checked_out[0].close()
+  proxy = connections.connect()
+  assert proxy._cnx is opened[3]
+  for proxy in checked_out[1:] + [proxy]:
+    proxy.close()
+
+def test_waiting_checkout_gets_released_connection(opened):
+  connections = pool(timeout=5)
+  checked_out = [connections.connect() for _ in range(3)]
+  threading.Timer(0.05, checked_out[1].close).start()
+  proxy = connections.connect()
+  assert connections.status()['waits'] >= 1
+  assert len(opened) == 4 and opened[1].closed
+  for proxy in [checked_out[0], checked_out[2], proxy]:
+    proxy.close()
+
+def test_broken_connection_discarded_on_checkin(opened):
+  connections = pool()
+  proxy = connections.connect()
+  opened[0].broken = True
+  proxy.close()
+  assert opened[0].closed
+  assert connections.status()['idle'] == 0
+  proxy = connections.connect()
+  assert proxy._cnx is opened[1]
+  proxy.close()
+
+def test_idle_connection_reopened(opened, monkeypatch):
+  connections = pool(idle_timeout=10)
+  connections.connect().close()
+  now = time.monotonic()
+  monkeypatch.setattr(db.time, 'monotonic', lambda: now + 11)
+  proxy = connections.connect()
+  assert proxy._cnx is opened[1]
+  assert opened[0].closed
+  assert connections.status()['recycled'] == 1
+  proxy.close()
+
+def test_pre_ping_reconnects(opened):
+  connections = pool()
+  connections.connect().close()
+  opened[0].broken = True
+  proxy = connections.connect()
+  assert proxy._cnx is opened[0]
+  assert connections.status()['reconnected'] == 1
+  proxy.close()
+
+def test_commit_callbacks_dropped_on_rollback(opened):
+  called = []
+  proxy = pool().connect()
+  proxy._cnx.commit = lambda: None
+  proxy.onCommit(lambda: called.append('rolled back'))
+  proxy.rollback()
+  proxy.onCommit(lambda: called.append('committed'))
+  proxy.commit()
+  assert called == ['committed']
+  proxy.close()
@@ -0,0 +1,97 @@
+#==============================================================================
+# Copyright (C) 2024  Emmanuel Mazurier <contact@bibliob.us>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#==============================================================================
+
+import asyncio, json
+import pytest
+import eventlog
+from eventlog import Event, EventLog
+
+@pytest.fixture
+def stored(monkeypatch):
+  '''biblio_event rows read by log, as (id, source, data)'''
+  rows = []
+  queries = []
+  async def fetchAll(mydb, query, params = None):
+    queries.append(params)
+    app_id, after_id, last_id = params
+    return [{'id': id, 'source': source, 'data': json.dumps(data)} for id, source, data in rows if after_id < id <= last_id]
+  async def fetchOne(mydb, query, params = None):
+    queries.append(params)
+    found = [row for row in rows if row[1] == params[1]]
+    return {'id': found[-1][0], 'source': found[-1][1], 'data': json.dumps(found[-1][2])} if found else None
+  monkeypatch.setattr(eventlog.db, 'fetchAll', fetchAll)
+  monkeypatch.setattr(eventlog.db, 'fetchOne', fetchOne)
+  return rows, queries
+
+def events(first, last, source = 'server'):
+  return [Event(id, source, [{'id': id}]) for id in range(first, last + 1)]
+
+def test_remember_keeps_last_events():
+  log = EventLog(3)
+  log._remember(1, events(1, 2))
+  log._remember(1, events(2, 5))
+  assert [event.id for event in log._rings[1]] == [3, 4, 5]
+  assert log.getStats()['memory'] == 3
+
+def test_remember_clears_ring_on_gap():
+  log = EventLog(5)
+  log._remember(1, events(1, 3))
+  log._remember(1, events(6, 6))
+  assert [event.id for event in log._rings[1]] == [6]
+  # older events are ignored
+  log._remember(1, events(4, 5))
+  assert [event.id for event in log._rings[1]] == [6]
+
+def test_since_from_memory(stored):
+  rows, queries = stored
+  log = EventLog(10)
+  log._remember(1, events(3, 8))
+  assert [event.id for event in asyncio.run(log.since(None, 1, 4, 7))] == [5, 6, 7]
+  assert asyncio.run(log.since(None, 1, 7, 7)) == []
+  assert queries == []
+  assert log.stats['memory_reads'] == 1
+
+def test_since_from_database_when_not_held(stored):
+  rows, queries = stored
+  rows += [(id, 'server', [{'id': id}]) for id in range(1, 9)]
+  log = EventLog(10)
+  found = asyncio.run(log.since(None, 1, 2, 8))
+  assert found == events(3, 8)
+  assert queries == [(1, 2, 8)]
+  # events read are kept for next readers
+  assert [event.id for event in log._rings[1]] == [3, 4, 5, 6, 7, 8]
+  asyncio.run(log.since(None, 1, 2, 8))
+  assert log.stats == dict(log.stats, memory_reads=1, db_reads=1)
+
+def test_since_from_database_when_ring_starts_later(stored):
+  rows, queries = stored
+  rows += [(id, 'server', [{'id': id}]) for id in range(1, 9)]
+  log = EventLog(10)
+  log._remember(1, events(5, 8))
+  assert asyncio.run(log.since(None, 1, 2, 8)) == events(3, 8)
+  assert queries == [(1, 2, 8)]
+
+def test_last_event_of_source(stored):
+  rows, queries = stored
+  log = EventLog(10)
+  log._remember(1, events(1, 2) + events(3, 3, 'mobile'))
+  assert asyncio.run(log.last(None, 1, 'server', 3)).id == 2
+  assert queries == []
+  # ring behind sequence : read from database
+  rows += [(4, 'server', [{'id': 4}])]
+  assert asyncio.run(log.last(None, 1, 'server', 4)) == Event(4, 'server', [{'id': 4}])
+  assert asyncio.run(log.last(None, 2, 'mobile', 0)) is None
@@ -0,0 +1,138 @@
+#==============================================================================
+# Copyright (C) 2024  Emmanuel Mazurier <contact@bibliob.us>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#==============================================================================
+
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+from config import settings
+from models import Book, Tag
+import dependencies, main
+
+def parse(chunks, fmt):
+  async def stream():
+    for chunk in chunks:
+      yield chunk
+  async def collect():
+    return [parsed async for parsed in Book.parseBooksStream(stream(), fmt)]
+  return asyncio.run(collect())
+
+def test_csv_records_split_across_chunks():
+  data = '﻿Title,Author,Pages\n"Les Misérables","Hugo, Victor",1900\n\n"A ""quoted""\ntitle",Anon,12\nshort\n'.encode('utf-8')
+  # split inside quoted newline and inside an utf-8 character
+  cut = data.index('é'.encode('utf-8')) + 1
+  assert parse([data[:cut], data[cut:40], data[40:]], 'csv') == [
+    (2, {'title': 'Les Misérables', 'author': 'Hugo, Victor', 'pages': '1900'}, None),
+    (4, {'title': 'A "quoted"\ntitle', 'author': 'Anon', 'pages': '12'}, None),
+    (5, None, "Expected 3 fields, found 1"),
+  ]
+
+def test_ndjson_records_and_errors():
+  data = b'{"title": "Dune", "author": "Herbert", "pages": 600}\n\n[1]\n{bad\n{"title": "Last"}'
+  parsed = parse([data[:20], data[20:]], 'ndjson')
+  assert [(line, row, error and error.split(':')[0]) for line, row, error in parsed] == [
+    (1, {'title': 'Dune', 'author': 'Herbert', 'pages': 600}, None),
+    (3, None, "Expected a json object"),
+    (4, None, "Invalid json"),
+    (5, {'title': 'Last'}, None),
+  ]
+
+class Connection:
+  '''connection of an import : books of user, multi rows inserts and request transaction'''
+
+  def __init__(self, books = ()):
+    self.books = list(books)
+    self.inserts = []
+    self.commits = 0
+    self.callbacks = []
+    self.rows = []
+
+  def cursor(self, dictionary = False, **args):
+    return self
+
+  def execute(self, query, params = ()):
+    if query.startswith("SELECT id, isbn, reference"):
+      self.rows = [book for book in self.books if book['isbn'] in params or book['reference'] in params]
+    elif query.startswith("SELECT LAST_INSERT_ID()"):
+      self.rows = [{'id': self.books[-len(self.inserts[-1])]['id']}]
+    elif query.startswith("SELECT id, isbn FROM biblio_book"):
+      self.rows = [book for book in self.books if book['id'] >= params[0]][:params[3]]
+    elif query.startswith("SELECT DISTINCT id_app"):
+      self.rows = [{'id_app': 7}]
+    else:
+      raise AssertionError("unexpected query " + query)
+
+  def executemany(self, query, params):
+    self.inserts.append(params)
+    for values in params:
+      self.books.append({'id': len(self.books) + 1, 'isbn': values[2], 'reference': values[10]})
+
+  def fetchone(self):
+    return self.rows[0] if self.rows else None
+
+  def fetchall(self):
+    return self.rows
+
+  def onCommit(self, callback):
+    self.callbacks.append(callback)
+
+  def commit(self):
+    self.commits += 1
+
+  def rollback(self):
+    pass
+
+  def close(self):
+    pass
+
+def test_import_chunk_validates_and_skips_duplicates():
+  mydb = Connection([{'id': 1, 'isbn': '111', 'reference': None}])
+  errors = []
+  seen = {'isbn': set(), 'reference': set()}
+  rows = [(2, {'title': 'Known', 'author': 'A', 'pages': '10', 'isbn': '111'}), \
+    (3, {'title': ' New ', 'author': 'B', 'pages': '240', 'isbn': '222', 'categories': ['roman', 'classique']}), \
+    (4, {'title': 'Twice', 'author': 'C', 'pages': '20', 'isbn': '222'}), \
+    (5, {'title': 'No pages', 'author': 'D', 'pages': ''})]
+  books = Book.importBooks(mydb, rows, 1, 7, errors, seen)
+  assert [(book['id'], book['title'], book['categories'], book['line']) for book in books] == [(2, 'New', 'roman,classique', 3)]
+  assert books[0]['width'] == 20
+  # invalid rows are found before duplicates
+  assert [error['line'] for error in errors] == [5, 2, 4]
+  assert errors[0]['error'] == "pages: Field required"
+  assert len(mydb.inserts) == 1
+
+@pytest.fixture
+def client(monkeypatch):
+  mydb = Connection()
+  tagged = []
+  monkeypatch.setattr(dependencies, 'getMyDB', lambda: mydb)
+  monkeypatch.setattr(Tag, 'setTagsBooks', lambda mydb, books, user_id: tagged.append([book['id'] for book in books]))
+  monkeypatch.setattr(settings, 'book_import_chunk_size', 2)
+  main.app.dependency_overrides[dependencies.get_auth_device] = lambda: {'user': {'id': 1}, 'device': {'id': 7}}
+  yield TestClient(main.app), mydb, tagged
+  main.app.dependency_overrides.clear()
+
+def test_import_saves_by_chunks_in_request_transaction(client):
+  client, mydb, tagged = client
+  data = "title,author,pages\n" + ''.join(f"Book {i},Author {i},{100 + i}\n" for i in range(5)) + "Bad,Author,-1\n"
+  response = client.post("/books/import", content=data.encode('utf-8'), headers={'content-type': 'text/csv'})
+  assert response.status_code == 200
+  assert response.json() == {'imported': 5, 'book_ids': [1, 2, 3, 4, 5], \
+    'errors': [{'line': 7, 'error': "pages: Input should be greater than or equal to 1"}]}
+  # one insert and one tags call by chunk, committed once when response is sent
+  assert [len(insert) for insert in mydb.inserts] == [2, 2, 1]
+  assert tagged == [[1, 2], [3, 4], [5]]
+  assert mydb.commits == 1
@@ -0,0 +1,119 @@
+#==============================================================================
+# Copyright (C) 2024  Emmanuel Mazurier <contact@bibliob.us>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#==============================================================================
+
+import random
+import pytest
+from pydantic import ValidationError
+from layout import Fenwick, ShelfLayout, computeLedColumns
+from models import Book, Position
+
+def book(item_id, position, range, shiftpos = 0):
+  return {'id_item': item_id, 'item_type': 'book', 'position': position, 'range': range, 'shiftpos': shiftpos}
+
+def static(position, led_column, range):
+  return {'id_item': 0, 'item_type': 'static', 'position': position, 'led_column': led_column, 'range': range}
+
+def sqlLedColumn(books, statics, own):
+  '''led column as computed before the layout engine : one SUM query per book, then shift and statics'''
+  column = sum(row['range'] + row['shiftpos'] for row in books
+    if row['position'] < own['position'] and row['id_item'] != own['id_item'])
+  if own['shiftpos'] > 0:
+    column += own['shiftpos']
+  for row in sorted(statics, key=lambda static: static['position']):
+    if column >= row['led_column']:
+      column += row['range']
+  return column
+
+@pytest.mark.parametrize('seed', range(20))
+def test_led_columns_match_sql_sums(seed):
+  rand = random.Random(seed)
+  books = [book(item_id, rand.randint(1, 15), rand.randint(0, 6), rand.randint(-1, 3)) for item_id in range(1, 21)]
+  books.sort(key=lambda row: (row['position'], row['id_item']))
+  statics = [static(rand.randint(1, 15), rand.randint(0, 40), rand.randint(1, 5)) for _ in range(rand.randint(0, 3))]
+  statics.sort(key=lambda static: static['position'])
+  assert computeLedColumns(books, statics) == [sqlLedColumn(books, statics, row) for row in books]
+
+def test_fenwick_prefix_and_grow():
+  tree = Fenwick(2)
+  tree.add(1, 3)
+  tree.add(2, 4)
+  # grown on demand, previous values kept
+  tree.add(9, 5)
+  assert [tree.prefix(i) for i in range(0, 11)] == [0, 3, 7, 7, 7, 7, 7, 7, 7, 12, 12]
+  tree.add(2, -4)
+  assert tree.prefix(9) == 8
+
+@pytest.mark.parametrize('index', [0, -1])
+def test_fenwick_rejects_index_below_one(index):
+  with pytest.raises(ValueError):
+    Fenwick(4).add(index, 1)
+
+def test_fenwick_rejects_negative_prefix():
+  with pytest.raises(ValueError):
+    Fenwick(4).prefix(-1)
+
+def test_layout_led_columns_match_one_pass_computation():
+  rows = [book(1, 1, 3), book(2, 2, 4, 1), book(3, 2, 2), book(4, 5, 6), static(3, 5, 10)]
+  shelf = ShelfLayout(rows, row_version=7)
+  books = sorted((row for row in rows if row['item_type'] == 'book'), key=lambda row: (row['position'], row['id_item']))
+  expected = computeLedColumns(books, shelf.statics)
+  assert shelf.row_version == 7
+  assert shelf.order() == [1, 2, 3, 4]
+  assert [shelf.ledColumn(row['id_item']) for row in books] == expected
+
+def test_layout_insert_move_remove():
+  shelf = ShelfLayout([book(1, 1, 3), book(2, 2, 4)])
+  shelf.insert(3, 1, 5)
+  assert shelf.itemsAt(1) == [1, 3]
+  assert shelf.after(1) == [2]
+  assert shelf.ledColumn(2) == 8
+  # moved item leaves its previous position
+  shelf.insert(3, 4, 5)
+  assert shelf.itemsAt(1) == [1]
+  assert shelf.ledColumns([2, 3]) == {2: 3, 3: 7}
+  shelf.resize(1, 1)
+  assert shelf.ledColumn(3) == 5
+  shelf.remove(1)
+  shelf.remove(1)
+  assert shelf.order() == [2, 3]
+  assert shelf.ledColumn(3) == 4
+
+def test_layout_copy_edited_alone():
+  shelf = ShelfLayout([book(1, 1, 3), book(2, 2, 4), static(2, 3, 10)], row_version=2)
+  edited = shelf.copy()
+  edited.insert(3, 1, 5)
+  edited.resize(2, 1)
+  edited.row_version = 3
+  assert (shelf.row_version, shelf.order(), shelf.ledColumn(2)) == (2, [1, 2], 13)
+  assert (edited.order(), edited.ledColumn(2), edited.statics) == ([1, 3, 2], 18, shelf.statics)
+
+@pytest.mark.parametrize('position', [0, -2])
+def test_layout_rejects_position_below_one(position):
+  shelf = ShelfLayout([book(1, 1, 3)])
+  with pytest.raises(ValueError):
+    shelf.insert(2, position, 3)
+  with pytest.raises(ValueError):
+    ShelfLayout([book(1, position, 3)])
+  assert shelf.order() == [1]
+
+def test_saved_position_zero_read_but_not_accepted():
+  row = {'id_app': 1, 'id_item': 2, 'position': 0, 'row': 1, 'range': 3, 'led_column': 0}
+  # rows saved before positions started at 1 still load
+  assert Position.Position(**row).position == 0
+  with pytest.raises(ValidationError):
+    Position.PositionEdit(**row)
+  assert Position.PositionEdit(**dict(row, position=1)).position == 1
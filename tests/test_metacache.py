@@ -0,0 +1,92 @@
+#==============================================================================
+# Copyright (C) 2024  Emmanuel Mazurier <contact@bibliob.us>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#==============================================================================
+
+import asyncio, threading
+import pytest
+import metacache
+from metacache import MetadataCache
+
+@pytest.fixture
+def cache(tmp_path):
+  cache = MetadataCache(str(tmp_path / 'metadata.sqlite3'), ttl=100, negative_ttl=10, max_items=2)
+  yield cache
+  cache.close()
+
+@pytest.fixture
+def clock(monkeypatch):
+  now = [1000.0]
+  monkeypatch.setattr(metacache.time, 'time', lambda: now[0])
+  return now
+
+def test_concurrent_lookups_share_one_call(cache):
+  calls = []
+  async def loader():
+    calls.append(1)
+    await asyncio.sleep(0.01)
+    return {'title': 'Dune'}
+  async def lookups():
+    return await asyncio.gather(*[cache.get('googleapis', '9780441013593', loader) for _ in range(5)])
+  assert asyncio.run(lookups()) == [{'title': 'Dune'}] * 5
+  assert len(calls) == 1
+  assert cache.stats['misses'] == 1 and cache.stats['coalesced'] == 4
+
+def test_ttl_and_negative_ttl(cache, clock):
+  async def found():
+    return {'title': 'Dune'}
+  async def unknown():
+    return {}
+  async def lookups():
+    await cache.get('googleapis', 'a', found)
+    await cache.get('googleapis', 'b', unknown)
+    clock[0] += 11
+    # empty result expired, found one still held
+    assert await cache.peek('googleapis', 'b') is None
+    assert await cache.peek('googleapis', 'a') == {'title': 'Dune'}
+    clock[0] += 90
+    assert await cache.peek('googleapis', 'a') is None
+  asyncio.run(lookups())
+
+def test_values_kept_in_file_for_other_workers(cache, tmp_path):
+  async def loader():
+    return {'title': 'Dune'}
+  asyncio.run(cache.get('openlibrary', 'a', loader))
+  other = MetadataCache(cache.path, ttl=100, negative_ttl=10, max_items=2)
+  try:
+    assert asyncio.run(other.peek('openlibrary', 'a')) == {'title': 'Dune'}
+    assert other.stats['disk_hits'] == 1
+  finally:
+    other.close()
+
+def test_file_read_out_of_event_loop(cache, monkeypatch):
+  threads = []
+  read = cache._read
+  def recordingRead(*args):
+    threads.append(threading.current_thread())
+    return read(*args)
+  monkeypatch.setattr(cache, '_read', recordingRead)
+  assert asyncio.run(cache.peek('googleapis', 'a')) is None
+  assert threads and threads[0] is not threading.main_thread()
+
+def test_loader_errors_are_not_cached(cache):
+  async def failing():
+    raise RuntimeError("provider down")
+  async def loader():
+    return {'title': 'Dune'}
+  with pytest.raises(RuntimeError):
+    asyncio.run(cache.get('googleapis', 'a', failing))
+  assert asyncio.run(cache.get('googleapis', 'a', loader)) == {'title': 'Dune'}
+  assert cache.stats['errors'] == 1
@@ -0,0 +1,247 @@
+#==============================================================================
+# Copyright (C) 2024  Emmanuel Mazurier <contact@bibliob.us>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#==============================================================================
+
+import asyncio, copy
+import pytest
+from fastapi.testclient import TestClient
+from models import Book, Position
+import dependencies, main
+
+class Connection:
+  '''positions, row versions and books of a transaction : committed state is restored on rollback'''
+
+  def __init__(self, positions = (), books = ()):
+    self.positions = [dict({'item_type': 'book', 'shiftpos': 0, 'led_column': 0, 'borrowed': 0}, **row) for row in positions]
+    self.versions = {}
+    self.books = {book['id']: dict(book) for book in books}
+    self.callbacks = []
+    self.commits = 0
+    self.rows = []
+    self._committed = self._state()
+
+  def _state(self):
+    return copy.deepcopy((self.positions, self.versions, self.books))
+
+  def cursor(self, dictionary = False, **args):
+    return self
+
+  def execute(self, query, params = ()):
+    query = ' '.join(query.split())
+    params = list(params)
+    if query.startswith("SELECT `row`, version FROM biblio_row_version"):
+      app_id, rows = params[0], params[1:]
+      self.rows = [{'row': row, 'version': self.versions[(app_id, row)]} for row in rows if (app_id, row) in self.versions]
+    elif query.startswith("SELECT version FROM biblio_row_version"):
+      version = self.versions.get(tuple(params))
+      self.rows = [{'version': version}] if version else []
+    elif query.startswith("SELECT `id_item`, `item_type`, `position`, `range`, `shiftpos`, `led_column` FROM biblio_position") \
+      or query.startswith("SELECT * FROM biblio_position where id_app=%s and `row`=%s"):
+      self.rows = self._select(lambda row: row['id_app'] == params[0] and row['row'] == params[1] \
+        and ('static' not in query or row['item_type'] == 'book'))
+    elif query.startswith("SELECT id_item, `row`, `position` FROM biblio_position"):
+      count = query.split('(`row`, `position`) IN')[0].count('%s') - 1
+      items, places = params[1:count + 1], set(zip(params[count + 1::2], params[count + 2::2]))
+      self.rows = self._select(lambda row: row['id_app'] == params[0] and row['item_type'] == 'book' \
+        and (row['id_item'] in items or (row['row'], row['position']) in places))
+    elif query.startswith("SELECT * FROM biblio_position where id_app=%s and item_type='book' and id_item IN"):
+      self.rows = self._select(lambda row: row['id_app'] == params[0] and row['item_type'] == 'book' and row['id_item'] in params[1:])
+      self.rows.sort(key=lambda row: (row['row'], row['position']))
+    elif query.startswith("SELECT id_item, id_app, `row`, `range` FROM biblio_position"):
+      self.rows = self._select(lambda row: row['item_type'] == 'book' and row['id_item'] in params[:-1])
+      self.rows.sort(key=lambda row: row['id_app'] != params[-1])
+    elif query.startswith("DELETE FROM biblio_position WHERE `id_item`=%s"):
+      self.positions = [row for row in self.positions if not (row['id_item'], row['item_type'], row['id_app'], row['row']) == tuple(params)]
+    elif query.startswith("SELECT `id`, `isbn`, `title`"):
+      self.rows = [self.books[book_id] for book_id in params[:-1] if self.books.get(book_id, {}).get('id_user') == params[-1]]
+    elif query.startswith("UPDATE biblio_position SET `led_column` = CASE"):
+      count = (len(params) - 2) // 3
+      columns = dict(zip(params[0:2 * count:2], params[1:2 * count:2]))
+      for row in self.positions:
+        if row['id_app'] == params[2 * count] and row['row'] == params[2 * count + 1] and row['id_item'] in columns:
+          row['led_column'] = columns[row['id_item']]
+    elif query.startswith("SELECT DISTINCT id_app FROM biblio_book"):
+      self.rows = [{'id_app': self.books[book_id]['id_app']} for book_id in set(params) \
+        if self.books.get(book_id, {}).get('id_app') is not None]
+    elif query.startswith("UPDATE biblio_book SET id_app"):
+      for book_id in params[1:]:
+        self.books.setdefault(book_id, {'id': book_id})['id_app'] = params[0]
+    elif "biblio_search_version" in query:
+      self.rows = []
+    else:
+      raise AssertionError("unexpected query " + query)
+
+  def executemany(self, query, params):
+    query = ' '.join(query.split())
+    if query.startswith("INSERT INTO biblio_row_version"):
+      for key in params:
+        self.versions[key] = self.versions.get(key, 0) + 1
+    elif query.startswith("INSERT INTO biblio_position"):
+      for app_id, item_id, position, row, range, led_column, shiftpos in params:
+        self.positions = [pos for pos in self.positions if not (pos['id_app'] == app_id and pos['id_item'] == item_id)]
+        self.positions.append({'id_app': app_id, 'id_item': item_id, 'item_type': 'book', 'position': position, 'row': row, \
+          'range': range, 'led_column': led_column, 'shiftpos': shiftpos, 'borrowed': 0})
+    elif not query.startswith("INSERT INTO biblio_search_version"):
+      raise AssertionError("unexpected query " + query)
+
+  def _select(self, where):
+    return sorted((dict(row) for row in self.positions if where(row)), key=lambda row: row['position'])
+
+  def fetchone(self):
+    return self.rows[0] if self.rows else None
+
+  def fetchall(self):
+    return self.rows
+
+  def onCommit(self, callback):
+    self.callbacks.append(callback)
+
+  def commit(self):
+    self.commits += 1
+    self._committed = self._state()
+    callbacks, self.callbacks = self.callbacks, []
+    for callback in callbacks:
+      callback()
+
+  def rollback(self):
+    self.positions, self.versions, self.books = copy.deepcopy(self._committed)
+    self.callbacks = []
+
+  def close(self):
+    pass
+
+@pytest.fixture(autouse=True)
+def layouts(monkeypatch):
+  monkeypatch.setattr(Position, '_layouts', {})
+
+@pytest.fixture
+def connect(monkeypatch):
+  def connect(mydb):
+    monkeypatch.setattr(dependencies, 'getMyDB', lambda: mydb)
+    return TestClient(main.app)
+  main.app.dependency_overrides[dependencies.get_auth_device] = lambda: \
+    {'user': {'id': 1}, 'device': {'id': 7, 'leds_interval': 1}}
+  yield connect
+  main.app.dependency_overrides.clear()
+
+def position(item_id, position, range, row = 1):
+  return {'id_app': 7, 'id_item': item_id, 'position': position, 'row': row, 'range': range}
+
+def test_first_book_of_row_at_led_zero(connect):
+  mydb = Connection()
+  response = connect(mydb).post("/positions/items", json=[position(1, 1, 3), position(2, 2, 4), position(3, 1, 2, row=2)])
+  assert response.status_code == 200
+  assert [(pos['id_item'], pos['row'], pos['led_column']) for pos in response.json()] == [(1, 1, 0), (2, 1, 3), (3, 2, 0)]
+  assert mydb.versions == {(7, 1): 1, (7, 2): 1}
+  assert mydb.books[1]['id_app'] == 7
+
+def test_positions_conflicts_save_nothing(connect):
+  mydb = Connection([position(1, 1, 3), position(2, 2, 4)])
+  response = connect(mydb).post("/positions/items", json=[position(1, 3, 3), position(3, 2, 2)])
+  assert response.status_code == 400
+  assert response.json()['detail'] == ["A position already exists for book 1", "Position 2 of row 1 is already taken by item id 2"]
+  assert len(mydb.positions) == 2 and mydb.versions == {}
+
+def test_position_from_one_on_input(connect):
+  response = connect(Connection()).post("/positions/items", json=[position(1, 0, 3)])
+  assert response.status_code == 422
+
+def order(response):
+  return [(pos['book'], pos['position'], pos['led_column']) for pos in response.json()['positions']]
+
+def test_shelf_edit_moves_inserts_and_removes(connect):
+  mydb = Connection([position(1, 1, 3), position(2, 2, 4), position(3, 3, 2), position(5, 1, 6, row=2)], \
+    [{'id': 4, 'id_user': 1, 'width': 50, 'pages': 100}])
+  client = connect(mydb)
+  response = client.get("/positions/order/1")
+  assert response.json()['version'] == 0
+  assert [(pos['book'], pos['position']) for pos in response.json()['positions']] == [(1, 1), (2, 2), (3, 3)]
+  response = client.patch("/positions/order/1", json={'version': 0, 'operations': [
+    {'op': 'move', 'id_item': 3, 'index': 1},
+    {'op': 'insert', 'id_item': 4, 'index': 2},
+    {'op': 'insert', 'id_item': 5, 'index': 4},
+    {'op': 'remove', 'id_item': 2}]})
+  assert response.status_code == 200
+  assert response.json()['version'] == 1
+  # new book gets its range from width, book taken from row 2 keeps its range
+  assert order(response) == [(3, 1, 0), (4, 2, 2), (1, 3, 7), (5, 4, 10)]
+  saved = {row['id_item']: (row['row'], row['position'], row['led_column']) for row in mydb.positions}
+  assert saved == {3: (1, 1, 0), 4: (1, 2, 2), 1: (1, 3, 7), 5: (1, 4, 10)}
+  # row books were taken from is locked and versioned with edited one
+  assert mydb.versions == {(7, 1): 1, (7, 2): 1}
+  assert mydb.books[2]['id_app'] is None and mydb.books[4]['id_app'] == 7
+
+def test_shelf_edit_on_changed_row_answers_current_order(connect):
+  mydb = Connection([position(1, 1, 3), position(2, 2, 4)])
+  mydb.versions[(7, 1)] = 3
+  mydb.commit()
+  response = connect(mydb).patch("/positions/order/1", json={'version': 2, 'operations': [{'op': 'remove', 'id_item': 1}]})
+  assert response.status_code == 409
+  detail = response.json()['detail']
+  assert detail['version'] == 3
+  assert [(pos['book'], pos['led_column']) for pos in detail['positions']] == [(1, 0), (2, 3)]
+  assert len(mydb.positions) == 2 and mydb.versions == {(7, 1): 3}
+
+@pytest.mark.parametrize('operation, detail', [
+  ({'op': 'move', 'id_item': 1}, "Index is required to move item 1"),
+  ({'op': 'move', 'id_item': 9, 'index': 1}, "Item 9 is not in row 1"),
+  ({'op': 'insert', 'id_item': 2, 'index': 1}, "Item 2 is already in row 1"),
+  ({'op': 'insert', 'id_item': 9, 'index': 1}, "Book 9 not found"),
+])
+def test_shelf_edit_errors_save_nothing(connect, operation, detail):
+  mydb = Connection([position(1, 1, 3), position(2, 2, 4)])
+  response = connect(mydb).patch("/positions/order/1", json={'version': 0, 'operations': [operation]})
+  assert response.status_code in (400, 404)
+  assert response.json()['detail'] == detail
+  assert mydb.versions == {} and [row['position'] for row in mydb.positions] == [1, 2]
+
+def test_rolled_back_edit_leaves_cached_layout(monkeypatch):
+  mydb = Connection([position(1, 1, 3), position(2, 2, 4)])
+  device = {'id': 7}
+  Position.newPositionsForBooks(mydb, device, [dict(position(3, 3, 2), item_type='book')])
+  mydb.commit()
+  assert Position._layouts[(7, 1)].row_version == 1
+  def fail(*args):
+    raise RuntimeError("connection lost")
+  monkeypatch.setattr(Book, 'updateAppBooks', fail)
+  with pytest.raises(RuntimeError):
+    Position.newPositionsForBooks(mydb, device, [dict(position(4, 4, 2), item_type='book')])
+  mydb.rollback()
+  shelf = Position._layouts[(7, 1)]
+  assert (shelf.row_version, shelf.order()) == (1, [1, 2, 3])
+  # row edited by another worker gets the version the rolled back edit had
+  mydb.positions.append(dict(position(5, 4, 1), item_type='book', shiftpos=0, led_column=9, borrowed=0))
+  mydb.versions[(7, 1)] = 2
+  mydb.commit()
+  shelf = Position.lockLayout(mydb, 7, 1)
+  assert (shelf.row_version, shelf.order()) == (3, [1, 2, 3, 5])
+  assert Position._layouts[(7, 1)].row_version == 1
+
+def test_shelf_order_cached_once_committed(connect):
+  mydb = Connection([position(1, 1, 3), position(2, 2, 4), position(3, 3, 2)])
+  response = connect(mydb).put("/positions/order/1", params={'book_ids': [3, 1], 'version': 0})
+  assert response.status_code == 200
+  assert [(pos['book'], pos['position'], pos['led_column']) for pos in response.json()['positions']] == [(2, 1, 0), (3, 2, 4), (1, 3, 6)]
+  shelf = Position._layouts[(7, 1)]
+  assert (shelf.row_version, shelf.order()) == (1, [2, 3, 1])
+  assert shelf.ledColumns([3, 1]) == {3: 4, 1: 6}
+
+def test_row_locks_dropped_when_released():
+  async def edit():
+    async with Position.lockRows(7, [2, 1, 2]):
+      assert sorted(Position._row_locks.keys()) == [(7, 1), (7, 2)]
+  asyncio.run(edit())
+  assert len(Position._row_locks) == 0
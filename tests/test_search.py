@@ -0,0 +1,155 @@
+#==============================================================================
+# Copyright (C) 2024  Emmanuel Mazurier <contact@bibliob.us>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#==============================================================================
+
+import asyncio
+import pytest
+import search
+from search import SearchIndex
+
+def book(id, title, author = '', tags = '', id_app = 1):
+  return {'id': id, 'id_app': id_app, 'title': title, 'author': author, 'tags': tags}
+
+@pytest.fixture
+def index():
+  index = SearchIndex(1)
+  index.add(book(1, "Les Misérables", "Victor Hugo", "roman"))
+  index.add(book(2, "Notre-Dame de Paris", "Victor Hugo"))
+  index.add(book(3, "Le Petit Prince", "Antoine de Saint-Exupéry", "conte, enfants"))
+  return index
+
+def ids(rows):
+  return [row['id'] for row in rows]
+
+def test_accents_and_case_ignored(index):
+  assert ids(index.search("MISERABLES")) == [1]
+  assert ids(index.search("exupery")) == [3]
+
+def test_prefix_and_inside_word(index):
+  assert ids(index.search("mis")) == [1]
+  # inside word matches need 3 letters
+  assert ids(index.search("erab")) == [1]
+  assert ids(index.search("ra")) == []
+
+def test_all_terms_required_best_ranked_first(index):
+  assert ids(index.search("victor hugo")) == [1, 2]
+  assert ids(index.search("hugo paris")) == [2]
+  # title match weighs more than tags match
+  index.add(book(4, "Un conte", "Anonyme"))
+  assert ids(index.search("conte")) == [4, 3]
+  assert ids(index.search("hugo", limit=1, offset=1)) == [2]
+
+def test_remove_and_update(index):
+  index.add(book(1, "Quatrevingt-treize", "Victor Hugo"))
+  assert ids(index.search("miserables")) == []
+  assert ids(index.search("treize")) == [1]
+  index.remove(2)
+  assert ids(index.search("hugo")) == [1]
+  assert "paris" not in index.postings
+  assert not any("paris" in tokens for tokens in index.grams.values())
+
+class Connection:
+  '''sync connection of a write : books app lookup, commit callbacks and search versions'''
+
+  def __init__(self, books_apps, versions):
+    self.books_apps = books_apps
+    self.versions = versions
+    self.callbacks = []
+    self.rows = []
+
+  def cursor(self, dictionary = False):
+    return self
+
+  def execute(self, query, params):
+    if 'FROM biblio_book' in query:
+      self.rows = [{'id_app': app_id} for app_id in {self.books_apps[book_id] for book_id in params}]
+    else:
+      self.rows = [{'id_app': app_id, 'version': self.versions[app_id]} for app_id in params]
+
+  def executemany(self, query, params):
+    for app_id, in params:
+      self.versions[app_id] = self.versions.get(app_id, 0) + 1
+
+  def fetchall(self):
+    return self.rows
+
+  def onCommit(self, callback):
+    self.callbacks.append(callback)
+
+  def commit(self):
+    callbacks, self.callbacks = self.callbacks, []
+    for callback in callbacks:
+      callback()
+
+@pytest.fixture
+def stored(monkeypatch):
+  '''biblio_search rows by book id, and search versions by app'''
+  rows = {}
+  versions = {}
+  reads = []
+  async def fetchAll(mydb, query, params = None):
+    reads.append(query.split(' where ')[1])
+    if 'id_app=' in query:
+      return [row for row in rows.values() if row['id_app'] == params[0]]
+    return [rows[book_id] for book_id in params if book_id in rows]
+  async def fetchOne(mydb, query, params = None):
+    return {'version': versions[params[0]]} if params[0] in versions else None
+  monkeypatch.setattr(search.db, 'fetchAll', fetchAll)
+  monkeypatch.setattr(search.db, 'fetchOne', fetchOne)
+  monkeypatch.setattr(search, '_indexes', {})
+  monkeypatch.setattr(search, '_dirty', set())
+  return rows, versions, reads
+
+def getIndex():
+  return asyncio.run(search.getIndex(None, 1))
+
+def test_own_writes_refresh_dirty_books(stored):
+  rows, versions, reads = stored
+  rows[1] = book(1, "Les Misérables")
+  assert ids(getIndex().search("miserables")) == [1]
+  # written by this worker : only changed book is read again once committed
+  rows[1] = book(1, "Quatrevingt-treize")
+  mydb = Connection({1: 1}, versions)
+  search.invalidateBook(mydb, 1)
+  assert ids(getIndex().search("treize")) == []
+  mydb.commit()
+  assert versions == {1: 1}
+  assert ids(getIndex().search("treize")) == [1]
+  assert ids(getIndex().search("miserables")) == []
+  assert reads == ['id_app=%s', 'id IN (%s)']
+
+def test_book_moved_to_other_app(stored):
+  rows, versions, reads = stored
+  rows[1] = book(1, "Les Misérables")
+  getIndex()
+  # app of book is read before change, new app is given
+  mydb = Connection({1: 1}, versions)
+  search.invalidateBooks(mydb, [1], [2])
+  rows[1] = book(1, "Les Misérables", id_app=2)
+  mydb.commit()
+  assert versions == {1: 1, 2: 1}
+  assert ids(getIndex().search("miserables")) == []
+  assert ids(asyncio.run(search.getIndex(None, 2)).search("miserables")) == [1]
+
+def test_other_worker_writes_rebuild_index(stored):
+  rows, versions, reads = stored
+  rows[1] = book(1, "Les Misérables")
+  getIndex()
+  rows[2] = book(2, "Notre-Dame de Paris")
+  assert ids(getIndex().search("paris")) == []
+  versions[1] = 1
+  assert ids(getIndex().search("paris")) == [2]
+  assert reads == ['id_app=%s', 'id_app=%s']
@@ -0,0 +1,106 @@
+#==============================================================================
+# Copyright (C) 2024  Emmanuel Mazurier <contact@bibliob.us>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#==============================================================================
+
+import asyncio
+from datetime import timedelta
+import pytest
+import db, eventlog, sweeper, tools
+
+class Connection:
+  '''async connection to location requests and events tables'''
+
+  def __init__(self, requests, fail = False):
+    self.requests = requests
+    self.events = 0
+    self.fail = fail
+    self.deletes = []
+    self.commits = 0
+    self.rollbacks = 0
+    self.rowcount = 0
+
+  async def cursor(self):
+    return self
+
+  async def execute(self, query, params):
+    if self.fail:
+      raise RuntimeError("connection lost")
+    if query.startswith("DELETE FROM biblio_request"):
+      action, before, limit = params
+      expired = [request for request in self.requests if request[0] == action and request[1] < before][:limit]
+      self.requests = [request for request in self.requests if request not in expired]
+      self.deletes.append(action)
+      self.rowcount = len(expired)
+    else:
+      self.rowcount = 0
+
+  async def close(self):
+    pass
+
+  async def commit(self):
+    self.commits += 1
+
+  async def rollback(self):
+    self.rollbacks += 1
+
+  async def __aenter__(self):
+    return self
+
+  async def __aexit__(self, *args):
+    pass
+
+def ago(seconds):
+  return (tools.getNow() - timedelta(seconds=seconds)).strftime("%Y-%m-%d %H:%M:%S")
+
+@pytest.fixture
+def connect(monkeypatch):
+  def connect(mydb):
+    async def getMyAsyncDB():
+      return mydb
+    monkeypatch.setattr(db, 'getMyAsyncDB', getMyAsyncDB)
+  monkeypatch.setattr(eventlog, '_log', eventlog.EventLog(10))
+  return connect
+
+def test_sweep_deletes_expired_requests_by_batches(connect):
+  requests = [('remove', ago(60), i) for i in range(5)] + [('remove', ago(1), 5), ('reset', ago(60), 6), \
+    ('reset', ago(600), 7), ('add', ago(600), 8)]
+  mydb = Connection(requests)
+  connect(mydb)
+  sweep = sweeper.Sweeper(interval=1, batch_size=2, remove_grace=30, reset_grace=300)
+  asyncio.run(sweep.sweep())
+  # recent remove, reset before its grace and add requests are kept
+  assert sorted(request[2] for request in mydb.requests) == [5, 6, 8]
+  assert mydb.deletes == ['remove', 'remove', 'remove', 'reset']
+  assert mydb.commits == 5
+  stats = sweep.getStats()
+  assert (stats['runs'], stats['removed'], stats['resets'], stats['running']) == (1, 5, 1, False)
+
+def test_failed_sweep_rolled_back_and_retried(connect):
+  mydb = Connection([('remove', ago(60), 1)], fail=True)
+  connect(mydb)
+  sweep = sweeper.Sweeper(interval=0, batch_size=10, remove_grace=30, reset_grace=300)
+  async def run():
+    sweep.start()
+    while mydb.rollbacks < 2:
+      await asyncio.sleep(0.001)
+    mydb.fail = False
+    while sweep.stats['runs'] < 1:
+      await asyncio.sleep(0.001)
+    assert sweep.getStats()['running']
+    await sweep.stop()
+  asyncio.run(run())
+  assert sweep.stats['errors'] >= 2
+  assert mydb.requests == [] and not sweep.getStats()['running']
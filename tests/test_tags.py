@@ -0,0 +1,113 @@
+#==============================================================================
+# Copyright (C) 2024  Emmanuel Mazurier <contact@bibliob.us>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#==============================================================================
+
+import pytest
+from models import Tag
+import tagcache
+
+class Connection:
+  '''tags tables of a transaction : queries are recorded'''
+
+  def __init__(self, tags):
+    self.tags = tags
+    self.queries = []
+    self.links = []
+    self.user_tags = []
+    self.callbacks = []
+    self.rows = []
+
+  def cursor(self, dictionary = False):
+    return self
+
+  def execute(self, query, params = ()):
+    self.queries.append(query.split(' WHERE ')[0])
+    if query.startswith("SELECT id, tag FROM biblio_tags"):
+      self.rows = [{'id': tag_id, 'tag': tag} for tag, tag_id in self.tags.items() if tag in params]
+    elif query.startswith("SELECT id, label FROM biblio_taxonomy"):
+      self.rows = [{'id': {'Authors': 2, 'Categories': 1}[params[0]], 'label': params[0]}]
+    elif query.startswith("SELECT DISTINCT id_app"):
+      self.rows = []
+    else:
+      raise AssertionError("unexpected query " + query)
+
+  def executemany(self, query, params):
+    self.queries.append(query.split(' VALUES ')[0])
+    if query.startswith("INSERT INTO biblio_tags"):
+      for tag, taxonomy in params:
+        self.tags[tag] = len(self.tags) + 1
+    elif query.startswith("INSERT INTO biblio_tag_node"):
+      self.links += params
+    else:
+      self.user_tags += params
+
+  def fetchone(self):
+    return self.rows[0] if self.rows else None
+
+  def fetchall(self):
+    return self.rows
+
+  def onCommit(self, callback):
+    self.callbacks.append(callback)
+
+  def commit(self):
+    callbacks, self.callbacks = self.callbacks, []
+    for callback in callbacks:
+      callback()
+
+@pytest.fixture
+def cache(monkeypatch):
+  cache = tagcache.TagCache(100)
+  monkeypatch.setattr(tagcache, '_cache', cache)
+  return cache
+
+books = [
+  {'id': 1, 'author': 'Victor Hugo', 'categories': 'Roman, Classique'},
+  {'id': 2, 'author': 'victor hugo, Émile Zola', 'categories': 'roman'},
+]
+
+def test_tags_of_books_resolved_in_one_query(cache):
+  mydb = Connection({'Hugo Victor': 1, 'Roman': 2})
+  Tag.setTagsBooks(mydb, books, 5)
+  # labels differing by case or accents are one tag
+  assert mydb.tags == {'Hugo Victor': 1, 'Roman': 2, 'Zola Émile': 3, 'Classique': 4}
+  assert sorted(mydb.links) == [(1, 1), (1, 2), (1, 4), (2, 1), (2, 2), (2, 3)]
+  assert sorted(mydb.user_tags) == [(5, 2), (5, 4)]
+  assert mydb.queries == [
+    "SELECT id, tag FROM biblio_tags", "SELECT id, label FROM biblio_taxonomy",
+    "INSERT INTO biblio_tags (`tag`, `id_taxonomy`)", "SELECT id, tag FROM biblio_tags",
+    "SELECT id, tag FROM biblio_tags", "SELECT id, label FROM biblio_taxonomy",
+    "INSERT INTO biblio_tags (`tag`, `id_taxonomy`)", "SELECT id, tag FROM biblio_tags",
+    "INSERT INTO biblio_tag_node (`node_type`, `id_node`, `id_tag`)", "SELECT DISTINCT id_app FROM biblio_book",
+    "INSERT INTO biblio_tag_user (`id_user`, `id_tag`)",
+  ]
+
+def test_committed_tags_served_from_cache(cache):
+  mydb = Connection({'Hugo Victor': 1, 'Roman': 2})
+  Tag.setTagsBooks(mydb, books[:1], 5)
+  # not committed : not cached
+  assert cache.getStats()['tags'] == 0
+  mydb.commit()
+  mydb = Connection({})
+  Tag.setTagsBooks(mydb, [{'id': 3, 'author': 'victor HUGO', 'categories': 'roman'}], 5)
+  assert mydb.queries[0].startswith("INSERT INTO biblio_tag_node")
+  assert sorted(mydb.links) == [(3, 1), (3, 2)]
+
+def test_rolled_back_tags_not_cached(cache):
+  mydb = Connection({})
+  Tag.setTagsBooks(mydb, [{'id': 1, 'author': 'Zola', 'categories': None}], 5)
+  # transaction dropped without commit
+  assert cache.getTags(['zola']) == {}
@@ -0,0 +1,47 @@
+#==============================================================================
+# Copyright (C) 2024  Emmanuel Mazurier <contact@bibliob.us>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#==============================================================================
+
+import tools
+
+def position(id_node, row, led_column, interval, color = '255, 0, 0', client = 'server'):
+  return {'row': row, 'led_column': led_column, 'interval': interval, 'id_tag': 4, 'color': color, \
+    'id_node': id_node, 'client': client, 'date_add': None}
+
+def test_build_blocks_groups_following_positions():
+  positions = [position(1, 1, 0, 3), position(2, 1, 3, 2), position(3, 1, 5, 4, client='mobile'), \
+    position(4, 1, 12, 2), position(5, 2, 14, 1)]
+  positions.sort(key=tools.sortPositions)
+  blocks = tools.buildBlockPosition(positions, 'add')
+  assert [(block['row'], block['start'], block['interval'], block['nodes']) for block in blocks] == \
+    [(1, 0, 9, [1, 2, 3]), (1, 12, 2, [4]), (2, 14, 1, [5])]
+  # block takes client of its last position, index of its second one
+  assert blocks[0]['client'] == 'mobile'
+  assert [block['index'] for block in blocks] == [1, 3, 4]
+
+def test_build_blocks_splits_on_color():
+  positions = [position(1, 1, 0, 3), position(2, 1, 3, 2, color='0, 0, 255')]
+  blocks = tools.buildBlockPosition(positions, 'add')
+  assert [block['nodes'] for block in blocks] == [[1], [2]]
+  assert [block['color'] for block in blocks] == ['255, 0, 0', '0, 0, 255']
+
+def test_build_blocks_remove_in_reverse_order():
+  positions = [position(1, 1, 0, 3), position(2, 1, 3, 2), position(3, 1, 10, 1)]
+  blocks = tools.buildBlockPosition(positions, 'remove')
+  assert [(block['action'], block['nodes']) for block in blocks] == [('remove', [3]), ('remove', [1, 2])]
+
+def test_build_blocks_without_positions():
+  assert tools.buildBlockPosition([], 'add') == []
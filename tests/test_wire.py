@@ -0,0 +1,52 @@
+#==============================================================================
+# Copyright (C) 2024  Emmanuel Mazurier <contact@bibliob.us>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#==============================================================================
+
+import base64
+import pytest
+import wire
+
+blocks = [
+  {'action': 'add', 'row': 2, 'start': 14, 'interval': 6, 'color': '255, 128, 0', 'client': 'server'},
+  {'action': 'remove', 'row': 1, 'start': 0, 'interval': 3, 'color': '', 'client': 'mobile'},
+  {'action': 'reset', 'client': 'server'},
+]
+
+def test_encode_decode_round_trip():
+  payload = wire.encode(blocks)
+  assert len(payload) == wire.header.size + wire.frame.size * len(blocks)
+  assert wire.decode(payload) == [
+    {'action': 'add', 'client': 'server', 'row': 2, 'start': 14, 'interval': 6, 'red': 255, 'green': 128, 'blue': 0},
+    {'action': 'remove', 'client': 'mobile', 'row': 1, 'start': 0, 'interval': 3, 'red': 0, 'green': 0, 'blue': 0},
+    {'action': 'reset', 'client': 'server', 'row': 0, 'start': 0, 'interval': 0, 'red': 0, 'green': 0, 'blue': 0},
+  ]
+
+def test_encode_data_is_base64():
+  data = wire.encodeData(blocks)
+  assert base64.b64decode(data) == wire.encode(blocks)
+  assert wire.decodeData(data) == wire.decode(wire.encode(blocks))
+
+@pytest.mark.parametrize('color, expected', [('10,20,30', (10, 20, 30)), ('300, -5, 7', (255, 0, 7)), \
+  ('-1', (0, 0, 0)), (None, (0, 0, 0)), ('', (0, 0, 0))])
+def test_parse_color(color, expected):
+  assert wire.parseColor(color) == expected
+
+def test_decode_rejects_bad_payloads():
+  payload = wire.encode(blocks)
+  with pytest.raises(ValueError):
+    wire.decode(payload[:-1])
+  with pytest.raises(ValueError):
+    wire.decode(bytes([wire.version + 1]) + payload[1:])
@@ -17,7 +17,7 @@
 
 from datetime import datetime
 from config import settings
-import hashlib, base64, re
+import hashlib, base64, re, unicodedata
 
 def getNow():
   return datetime.now()
@@ -60,6 +60,16 @@ def uuidEncode(string):
   except ValueError:
     return False
 
+def fold(text):
+  '''lower case text without accents'''
+  text = unicodedata.normalize('NFKD', str(text or ''))
+  return ''.join(c for c in text if not unicodedata.combining(c)).lower()
+
+def getInitial(label):
+  '''index letter for label : accents removed, '#' for labels not starting with a latin letter'''
+  initial = fold(label).strip()[:1]
+  return initial if 'a' <= initial <= 'z' else '#'
+
 def getLastnameFirstname(names):
   lnfn=[]
   for name in names:
@@ -104,82 +114,39 @@ def setBookWidth(pages):
     cm = 1
   return round(float(cm),2)*10
 
-def sortIndexBlocks(elem):
-  return elem['index']
-
 def sortPositions(address):
-  return address['row']*100+address['led_column']
+  return (address['row'], address['led_column'])
+
+def isFollowing(prev, pos):
+  '''pos starts where prev ends, on same row with same color'''
+  return int(pos['led_column']) == int(prev['led_column'] + prev['interval']) \
+    and pos['color'] == prev['color'] and pos['row'] == prev['row']
+
+def buildBlock(run, index, action):
+  '''block for following positions of run, index of first one in positions list'''
+  first = run[0]
+  if len(run) == 1:
+    return {'action':action, 'row':first['row'], 'index':index, 'start':first['led_column'], \
+      'id_tag':first['id_tag'], 'color':first['color'], 'interval':first['interval'], \
+      'nodes':[first['id_node']], 'client':first['client'], 'date_add':first['date_add']}
+  second, last = run[1], run[-1]
+  return {'action':action, 'row':second['row'], 'index':index + 1, 'start':first['led_column'], \
+    'color':second['color'], 'id_tag':second['id_tag'], 'interval':sum(pos['interval'] for pos in run), \
+    'nodes':list(dict.fromkeys(int(pos['id_node']) for pos in run)), 'client':last['client'], 'date_add':last['date_add']}
 
 def buildBlockPosition(positions, action):
-  '''build blocks of nearby positions :'''
+  '''build blocks of nearby positions (sorted by sortPositions) in one pass :'''
   '''agregate intervals and reduce messages to Arduino'''
-
-  cpt = 0
-  blockend = 0  
-  block = {}
   blocks = []
-  blockelem = []
-  uniqelem = []
-
-  #loop 1 : group nearby positions, and separate isolated postions 
-  for i, pos in enumerate(positions): 
-
-    #check if current pos is following the previous pos
-    if int(pos['led_column']) == int(positions[i-1]['led_column'] + positions[i-1]['interval']) \
-    and pos['color'] == positions[i-1]['color'] and pos['row'] == positions[i-1]['row'] : 
-
-      prevItem = positions[i-1]
-
-      #store node ids inside list
-      if int(prevItem['id_node']) not in blockelem:  
-        blockelem.append(int(prevItem['id_node']))
-      if int(pos['id_node']) not in blockelem:        
-        blockelem.append(int(pos['id_node']))
-
-      #remove block first element from isolated list
-      idx = prevItem['id_node'] if prevItem['id_node'] > 0 else (prevItem['row']+prevItem['led_column']+prevItem['interval'])
-      if idx in uniqelem:
-        uniqelem.remove(idx)
-
-      #build block element : get first position and agragate intervals
-      cpt+=1
-      blockend += prevItem['interval']
-      if cpt==1:
-        block = {'action':action, 'row':pos['row'], 'index':i, 'start':prevItem['led_column'], \
-        'color':pos['color'], 'id_tag':pos['id_tag'],}
-      block.update({'interval':blockend+pos['interval'], 'nodes':blockelem, 'client':pos['client'], 'date_add':pos['date_add']})
-
-      #populate blocks list
-      if block not in blocks:
-        blocks.append(block)
-        
-    #reinit for next block
-    else:
-
-      block = {}
-      blockelem = []
-      blockend = 0
-      cpt = 0
-
-      #store isolated elements: node_id for books, position for gaming
-      idx = pos['id_node'] if pos['id_node'] > 0 else (pos['row']+pos['led_column']+pos['interval'])
-      uniqelem.append(idx)
-  
-  #loop 2 : build response for isolated elements
-  for i, pos in enumerate(positions):
-    idx = pos['id_node'] if pos['id_node'] > 0 else (pos['row']+pos['led_column']+pos['interval'])
-    for j in uniqelem:
-      if j == idx:
-        blocks.append({'action':action, 'row':pos['row'], 'index':i, 'start':pos['led_column'], \
-          'id_tag':pos['id_tag'], 'color':pos['color'], 'interval':pos['interval'], \
-          'nodes':[pos['id_node']], 'client':pos['client'], 'date_add':pos['date_add']})
-  
-  #print(blocks)
+  start = 0
+  for i in range(1, len(positions) + 1):
+    if i < len(positions) and isFollowing(positions[i-1], positions[i]):
+      continue
+    blocks.append(buildBlock(positions[start:i], start, action))
+    start = i
 
   #reset order for blocks:
   if(action=='remove'):
-    blocks.sort(key=sortIndexBlocks, reverse=True)
-  else:
-    blocks.sort(key=sortIndexBlocks)
+    blocks.reverse()
 
   return blocks
@@ -0,0 +1,85 @@
+#==============================================================================
+# Copyright (C) 2024  Emmanuel Mazurier <contact@bibliob.us>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#==============================================================================
+
+'''compact frames of led blocks for Bibus devices, sent base64 encoded as event stream data
+
+payload, little endian : header then one frame by block
+  header (3 bytes) : version (uint8), frames count (uint16)
+  frame (11 bytes) : action (uint8), flags (uint8), row (uint16), start (uint16), interval (uint16),
+    red, green, blue (uint8)
+actions : 1 add, 2 remove, 3 reset (other fields are 0)
+flags : bit 0 set when request comes from server
+'''
+
+from functools import lru_cache
+import base64, struct
+
+version = 1
+header = struct.Struct('<BH')
+frame = struct.Struct('<BBHHHBBB')
+
+actions = {'add': 1, 'remove': 2, 'reset': 3}
+action_names = {code: action for action, code in actions.items()}
+flag_server = 1
+
+'''stream format negotiated with format query param, or Accept header'''
+format_name = 'frames'
+media_type = 'application/vnd.bibliobus.frames'
+
+def isRequested(request, format):
+  return format == format_name or media_type in request.headers.get('accept', '')
+
+@lru_cache(maxsize=1024)
+def parseColor(color):
+  '''"r, g, b" string to bytes, off (0, 0, 0) for empty or "-1" colors'''
+  try:
+    red, green, blue = (min(max(int(value), 0), 255) for value in str(color).split(','))
+  except ValueError:
+    return 0, 0, 0
+  return red, green, blue
+
+def encode(blocks):
+  '''blocks built by tools.buildBlockPosition (or reset blocks) to payload bytes'''
+  payload = bytearray(header.size + frame.size * len(blocks))
+  header.pack_into(payload, 0, version, len(blocks))
+  offset = header.size
+  for block in blocks:
+    flags = flag_server if block.get('client') == 'server' else 0
+    frame.pack_into(payload, offset, actions.get(block['action'], 0), flags, block.get('row') or 0, \
+      block.get('start') or 0, block.get('interval') or 0, *parseColor(block.get('color')))
+    offset += frame.size
+  return bytes(payload)
+
+def decode(payload):
+  '''reference decoder : payload bytes to blocks'''
+  payload_version, count = header.unpack_from(payload, 0)
+  if payload_version != version:
+    raise ValueError(f"Unknown frames version {payload_version}")
+  if len(payload) != header.size + frame.size * count:
+    raise ValueError(f"Truncated frames payload: {len(payload)} bytes for {count} frames")
+  blocks = []
+  for action, flags, row, start, interval, red, green, blue in frame.iter_unpack(payload[header.size:]):
+    blocks.append({'action': action_names.get(action), 'client': 'server' if flags & flag_server else 'mobile', \
+      'row': row, 'start': start, 'interval': interval, 'red': red, 'green': green, 'blue': blue})
+  return blocks
+
+def encodeData(blocks):
+  '''payload as event stream data line'''
+  return base64.b64encode(encode(blocks)).decode('ascii')
+
+def decodeData(data):
+  return decode(base64.b64decode(data))